@@ -1,20 +1,39 @@
-from fastapi import FastAPI, File, UploadFile, Query
+from fastapi import FastAPI, File, UploadFile, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from transformers import ViTForImageClassification
-from torchvision import transforms
 from PIL import Image
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.routing import Match
 
 import torch
-import chromadb
+import numpy as np
 import json
 import re
 import io
-
-from langchain.vectorstores import Chroma
-import replicate
+import os
+import sys
+import time
+import random
+import asyncio
+import sqlite3
+import hashlib
+import hmac
+import threading
+import zipfile
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
-import openai
+
+from context_builder import TokenCounter, build_context
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+from pipeline_metrics import (
+    LLM_TOKENS, REQUEST_SECONDS, REQUESTS, RequestProfiler, label_values, render_metrics, request_labels, stage
+)
+from Classification_Model.inference_backends import (
+    CLASSIFIER_BACKEND_MODULES, CLASSIFIER_BACKENDS, load_predictor, take_preloaded_predictor
+)
+from Classification_Model.preprocessing import FastPreprocessor, load_transform_details
+from provider_registry import ProviderRegistry
 
 
 app = FastAPI()
@@ -29,122 +48,193 @@ app.add_middleware(
 )
 
 
-class ReplicateLlama2Embeddings:
-    """
-    A simple embedding class for Llama2 embeddings via Replicate.
+# Per-request profiling: a request sent with `X-Profile: torch` or `X-Profile: cprofile`
+# is profiled and the dump written to PROFILE_DIR (its path comes back in `X-Profile-Path`).
+# PROFILE_SAMPLE_RATE additionally profiles that fraction of all requests with PROFILE_SAMPLE_MODE.
+# Both are off unless PROFILING_ENABLED is set, since profiling slows the whole server down.
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "") == "1"
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "/Plant Disease App/profiles")
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_SAMPLE_MODE = os.environ.get("PROFILE_SAMPLE_MODE", "cprofile")
+
 
-    model_version: The specific model version on replicate, e.g.
-       "andreasjansson/llama-2-7b-embeddings:xxxx..."
+def route_template(request: Request) -> str:
     """
-    def __init__(self, replicate_api_token: str, 
-                 model_version: str = "andreasjansson/llama-2-7b-embeddings:65c48f4d3e526a873d03ab973ca05989bbcdbdf9aca65fdee7ad2a9757e5b8fa"):
-        self.client = replicate.Client(api_token=replicate_api_token)
-        self.model_version = model_version
+    Path template of the route the request matches (e.g. /classify/stream), or "other".
+    Used as the endpoint label, so unknown paths (scanners, typos) share one time series.
+    """
+    for route in app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match != Match.NONE:
+            return route.path
+    return "other"
 
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        embeddings = []
-        for text in texts:
-            result = self.client.run(
-                self.model_version,
-                input={"text": text}
-            )
-            embeddings.append(result)  
-        return embeddings
 
-    def embed_query(self, text: str) -> List[float]:
-        result = self.client.run(
-            self.model_version,
-            input={"text": text}
-        )
-        return result
+@app.middleware("http")
+async def observe_request(request: Request, call_next):
+    """
+    Records request latency and status per endpoint / model / language, makes those
+    labels available to the stage timers, and runs the optional per-request profiler.
+    """
+    labels = label_values(request.query_params.get("model_name"), request.query_params.get("language"))
+    request_labels.set(labels)
+    endpoint = route_template(request)
+
+    profiler = None
+    if PROFILING_ENABLED:
+        mode = request.headers.get("x-profile")
+        if mode is None and PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+            mode = PROFILE_SAMPLE_MODE
+        if mode in RequestProfiler.modes:
+            name = f"{endpoint.strip('/').replace('/', '_') or 'root'}-{int(time.time() * 1000)}"
+            profiler = RequestProfiler(mode, PROFILE_DIR, name)
+            if not profiler.start():
+                profiler = None  # Another request is being profiled
+
+    started = time.perf_counter()
+
+    def finish(status):
+        REQUEST_SECONDS.labels(endpoint, *labels).observe(time.perf_counter() - started)
+        REQUESTS.labels(endpoint, *labels, str(status)).inc()
+        if profiler is not None:
+            profiler.stop()
 
+    try:
+        response = await call_next(request)
+    except BaseException:
+        finish(500)
+        raise
+    if profiler is not None:
+        response.headers["X-Profile-Path"] = profiler.path
 
-class ReplicateLlama2LLM:
-    """
-    A simple LLM class that wraps Llama2 (Chat) via Replicate.
+    # call_next returns as soon as the headers are ready, while a streamed body (/classify/stream)
+    # is still being produced, so the request is timed and profiled until its body is fully sent
+    body_iterator = response.body_iterator
 
-    model_version: The specific model version on replicate, e.g.
-       "meta/llama-2-7b-chat:xxxx..."
-    """
-    def __init__(self, replicate_api_token: str,
-                 model_version: str = "meta/llama-2-70b-chat"):
-        self.client = replicate.Client(api_token=replicate_api_token)
-        self.model_version = model_version
+    async def observed_body():
+        try:
+            async for chunk in body_iterator:
+                yield chunk
+        finally:
+            finish(response.status_code)
 
-    def invoke(self, prompt: str) -> str:
-        output = self.client.run(
-            self.model_version,
-            input={"prompt": prompt, "max_new_tokens": 512}
-        )
-        if isinstance(output, str):
-            return output
-        elif isinstance(output, list):
-            return "".join(output)
-        else:
-            return str(output)
+    response.body_iterator = observed_body()
+    return response
 
 
-class OpenAIEmbeddings:
-    """
-    A simple embedding class for OpenAI embeddings (e.g. text-embedding-ada-002).
-    """
-    def __init__(self, openai_api_key: str, model: str = "text-embedding-ada-002"):
-        # Set your OpenAI key
-        openai.api_key = openai_api_key
-        self.model = model
+def error_response(status_code: int, message: str) -> JSONResponse:
+    """The usual {"error": ...} payload, with an HTTP status that tells the client what went wrong."""
+    return JSONResponse(status_code=status_code, content={"error": message})
 
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        response = openai.Embedding.create(model=self.model, input=texts)
-        embeddings = [d["embedding"] for d in response["data"]]
-        return embeddings
 
-    def embed_query(self, text: str) -> List[float]:
-        response = openai.Embedding.create(model=self.model, input=[text])
-        return response["data"][0]["embedding"]
+# /admin/* endpoints reload models and drop caches. With ADMIN_TOKEN set they require it in the
+# `X-Admin-Token` header; without it they only answer requests from the local machine.
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+LOCAL_HOSTS = {"127.0.0.1", "::1", "localhost"}
 
 
-class OpenAILLM:
+@app.middleware("http")
+async def protect_admin(request: Request, call_next):
     """
-    A simple LLM class that uses OpenAI GPT for generating text (GPT-3.5-turbo by default).
+    Rejects /admin/* requests without the shared secret (or, with none configured, from other hosts).
     """
-    def __init__(self, openai_api_key: str, model_name: str = "gpt-3.5-turbo"):
-        openai.api_key = openai_api_key
-        self.model_name = model_name
+    if request.url.path.startswith("/admin/"):
+        if ADMIN_TOKEN:
+            if not hmac.compare_digest(request.headers.get("x-admin-token", "").encode(), ADMIN_TOKEN.encode()):
+                return error_response(401, "Missing or invalid X-Admin-Token header.")
+        elif request.client is None or request.client.host not in LOCAL_HOSTS:
+            return error_response(403, "Admin endpoints are only available from localhost unless ADMIN_TOKEN is set.")
+    return await call_next(request)
 
-    def invoke(self, prompt: str) -> str:
-        response = openai.ChatCompletion.create(
-            model=self.model_name,
-            messages=[
-                {"role": "system", "content": "You are an expert plant disease management assistant."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=1000,
-            temperature=0.7
-        )
-        return response["choices"][0]["message"]["content"]
 
+# Query embeddings are cached by hash(model + text). The backend embeds with Replicate / OpenAI
+# models while ingestion uses Ollama, so no entries would overlap: each keeps its own file.
+EMBEDDING_CACHE_DB = os.environ.get("EMBEDDING_CACHE_DB", "/Plant Disease App/plant_disease_data/query_embedding_cache.sqlite3")
 
-REPLICATE_API_KEY = "Place Your API Token Here"
-embedding_function_llama2 = ReplicateLlama2Embeddings(replicate_api_token=REPLICATE_API_KEY)
-llm_llama2 = ReplicateLlama2LLM(replicate_api_token=REPLICATE_API_KEY)
+# Upper bounds on the length of a generated advisory
+LLAMA2_MAX_NEW_TOKENS = int(os.environ.get("LLAMA2_MAX_NEW_TOKENS", "512"))
+OPENAI_MAX_TOKENS = int(os.environ.get("OPENAI_MAX_TOKENS", "1000"))
 
+REPLICATE_API_KEY = "Place Your API Token Here"
 OPENAI_API_KEY = "Place Your API Token Here"
-embedding_function_openai = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY)
-llm_openai = OpenAILLM(openai_api_key=OPENAI_API_KEY, model_name="gpt-3.5-turbo")
-
-# Create two separate persistent Chroma clients/collections
-persistent_client = chromadb.PersistentClient(path="/Plant Disease App/plant_disease_data")
 
-vector_store_llama2 = Chroma(
-    client=persistent_client,
-    collection_name="plant_disease_documents",
-    embedding_function=embedding_function_llama2
+CHROMA_PATH = "/Plant Disease App/plant_disease_data"
+CHROMA_COLLECTION = "plant_disease_documents"
+
+# Providers are built through the registry (provider_registry.py): a model's LLM client,
+# embeddings and vector store, and the libraries behind them, are only imported and
+# constructed for models listed in ENABLED_MODELS. PROVIDER_INIT=startup builds them before
+# the server accepts requests; PROVIDER_INIT=lazy on the first request for each model.
+# Requests for a model that isn't enabled get the usual unsupported-model error.
+MODEL_PROVIDERS = {
+    "llama2": ("llama2_vector_store", "llama2_llm"),
+    "gpt-3.5-turbo": ("openai_vector_store", "openai_llm"),
+}
+ENABLED_MODELS = [name.strip().lower() for name in os.environ.get("ENABLED_MODELS", "llama2,gpt-3.5-turbo").split(",") if name.strip()]
+PROVIDER_INIT = os.environ.get("PROVIDER_INIT", "startup")
+
+unknown_models = [name for name in ENABLED_MODELS if name not in MODEL_PROVIDERS]
+if unknown_models:
+    raise ValueError(f"Unknown model(s) in ENABLED_MODELS: {', '.join(unknown_models)}. Choose from: {', '.join(MODEL_PROVIDERS)}")
+if PROVIDER_INIT not in ("startup", "lazy"):
+    raise ValueError(f"PROVIDER_INIT must be 'startup' or 'lazy', not '{PROVIDER_INIT}'")
+
+INVALID_MODEL_MESSAGE = "Invalid model_name. Choose " + " or ".join(f"'{name}'" for name in ENABLED_MODELS) + "."
+
+providers = ProviderRegistry()
+
+providers.register("embedding_cache", lambda: EmbeddingCache(EMBEDDING_CACHE_DB))
+providers.register(
+    "chroma_client", lambda chromadb: chromadb.PersistentClient(path=CHROMA_PATH), modules=("chromadb",)
+)
+providers.register(
+    "llama2_embeddings",
+    lambda replicate_providers: replicate_providers.ReplicateLlama2Embeddings(replicate_api_token=REPLICATE_API_KEY),
+    modules=("replicate_providers",)
+)
+providers.register(
+    "llama2_llm",
+    lambda replicate_providers: replicate_providers.ReplicateLlama2LLM(
+        replicate_api_token=REPLICATE_API_KEY, max_new_tokens=LLAMA2_MAX_NEW_TOKENS
+    ),
+    modules=("replicate_providers",)
 )
+providers.register(
+    "openai_embeddings",
+    lambda openai_providers: openai_providers.OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY),
+    modules=("openai_providers",)
+)
+providers.register(
+    "openai_llm",
+    lambda openai_providers: openai_providers.OpenAILLM(
+        openai_api_key=OPENAI_API_KEY, model_name="gpt-3.5-turbo", max_tokens=OPENAI_MAX_TOKENS
+    ),
+    modules=("openai_providers",)
+)
+
+
+def build_vector_store(vectorstores, embeddings, cache_namespace: str):
+    """A langchain Chroma wrapper over the shared collection, embedding queries through the embedding cache."""
+    return vectorstores.Chroma(
+        client=providers.get("chroma_client"),
+        collection_name=CHROMA_COLLECTION,
+        embedding_function=CachedEmbeddings(embeddings, providers.get("embedding_cache"), cache_namespace)
+    )
+
 
-vector_store_openai = Chroma(
-    client=persistent_client,
-    collection_name="plant_disease_documents",
-    embedding_function=embedding_function_openai
+providers.register(
+    "llama2_vector_store",
+    lambda vectorstores: build_vector_store(
+        vectorstores, providers.get("llama2_embeddings"), providers.get("llama2_embeddings").model_version
+    ),
+    modules=("langchain.vectorstores",), requires=("chroma_client", "embedding_cache", "llama2_embeddings")
+)
+providers.register(
+    "openai_vector_store",
+    lambda vectorstores: build_vector_store(
+        vectorstores, providers.get("openai_embeddings"), providers.get("openai_embeddings").model
+    ),
+    modules=("langchain.vectorstores",), requires=("chroma_client", "embedding_cache", "openai_embeddings")
 )
 
 # Pydantic model for structured response
@@ -155,61 +245,628 @@ class DiseaseResponse(BaseModel):
     recommended_solutions: str
     pesticide_recommendations: str
 
-# Paths for model and label mapping
+# Paths for model, model config and label mapping
+saved_models_dir = "L:/Plant Disease App/Classification_Model/saved_models"
 model_path = "L:/Plant Disease App/Classification_Model/saved_models/final_model.pt"
+vit_config_path = "L:/Plant Disease App/Classification_Model/saved_models/vit_config.json"
 with open("L:/Plant Disease App/Classification_Model/saved_models/label_mapping.json", "r") as f:
     label_mapping = json.load(f)
 
 index_to_label_mapping = {v: k for k, v in label_mapping.items()}
 
-# Image transformation
-transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-])
+# Image preprocessing, defined by the same transform_details.json used in training.
+# Uploads larger than MAX_UPLOAD_BYTES or MAX_IMAGE_PIXELS are rejected before decoding.
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+MAX_IMAGE_PIXELS = int(os.environ.get("MAX_IMAGE_PIXELS", "64000000"))
+transform = FastPreprocessor(
+    load_transform_details("L:/Plant Disease App/Classification_Model/saved_models/transform_details.json"),
+    max_upload_bytes=MAX_UPLOAD_BYTES,
+    max_pixels=MAX_IMAGE_PIXELS
+)
 
 
-def classify_disease(image: Image.Image):
-    """Classify the disease using a ViT model."""
-    input_tensor = transform(image).unsqueeze(0)
+# Execution model: decoding/preprocessing and the ViT forward pass run on bounded
+# thread pools (PIL and torch release the GIL), Chroma lookups run on their own
+# pool, and LLM calls use the providers' async clients behind a semaphore. Each
+# stage can be sized independently so one slow stage never blocks the event loop.
+PREPROCESS_WORKERS = int(os.environ.get("PREPROCESS_WORKERS", "4"))
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", "2"))
+RETRIEVAL_WORKERS = int(os.environ.get("RETRIEVAL_WORKERS", "4"))
+LLM_CONCURRENCY = int(os.environ.get("LLM_CONCURRENCY", "16"))
+
+preprocess_executor = ThreadPoolExecutor(max_workers=PREPROCESS_WORKERS, thread_name_prefix="preprocess")
+inference_executor = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="inference")
+retrieval_executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+llm_semaphore = asyncio.Semaphore(LLM_CONCURRENCY)
+
+
+@app.on_event("shutdown")
+def shutdown_executors():
+    for executor in (preprocess_executor, inference_executor, retrieval_executor):
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+class InvalidUploadError(ValueError):
+    """The upload is not an acceptable image (reported to the client as a 400)."""
+
+
+def load_image(image_data: bytes) -> Image.Image:
+    """Validate and decode uploaded bytes into an RGB image; raises InvalidUploadError for rejected uploads."""
+    try:
+        return transform.decode(image_data)
+    except ValueError as e:
+        raise InvalidUploadError(str(e))
+
+
+def preprocess_image(image_data: bytes) -> torch.Tensor:
+    """Decode uploaded bytes and resize them to a uint8 (3, H, W) tensor ready for `transform.normalize_batch`."""
+    return transform.preprocess_bytes(image_data)
+
+
+# Inference backend: 'torch' (FP32 state dict), 'int8', 'torchscript', 'onnx' or 'student'.
+# The optimized artifacts are produced by Classification_Model/export_model.py, the
+# distilled student by Classification_Model/distillation.py.
+CLASSIFIER_BACKEND = os.environ.get("CLASSIFIER_BACKEND", "torch")
+# MODEL_MMAP=1 memory-maps state-dict checkpoints, so worker processes serving the same
+# file share its pages (set by `serve.py --preload mmap`)
+MODEL_MMAP = os.environ.get("MODEL_MMAP", "") == "1"
+
+
+def default_checkpoint_path(backend: str) -> str:
+    if backend not in CLASSIFIER_BACKENDS:
+        raise ValueError(f"Unknown classifier backend '{backend}'. Choose one of: {', '.join(CLASSIFIER_BACKENDS)}")
+    if backend == "torch":
+        return model_path
+    return os.path.join(saved_models_dir, CLASSIFIER_BACKENDS[backend][1])
+
+
+def resolve_checkpoint_path(checkpoint_path: str) -> str:
+    """
+    A checkpoint named by a client (file name or path), which must be an existing file
+    inside saved_models: checkpoints are unpickled, so arbitrary paths are never loaded.
+    """
+    root = os.path.realpath(saved_models_dir)
+    path = os.path.realpath(os.path.join(root, checkpoint_path))
+    if os.path.commonpath([root, path]) != root or not os.path.isfile(path):
+        raise ValueError(f"checkpoint_path must name an existing file inside {saved_models_dir}")
+    return path
+
+
+class ModelRegistry:
+    """
+    Keeps a single classifier resident in memory for every request.
+
+    The model is built from the local config file (no hub lookup) through the
+    configured inference backend, and the checkpoint is loaded and warmed up
+    once (or taken over from serve.py, which loads it before forking workers).
+    `load` can be called again at any time to swap in a new checkpoint
+    or backend: the new model is fully built before it replaces the old one,
+    so requests are never served a half-loaded model.
+    """
+    def __init__(self, config_path: str, num_labels: int, backend: str = "torch", mmap: bool = False):
+        self.config_path = config_path
+        self.num_labels = num_labels
+        self.backend = backend
+        self.mmap = mmap
+        self.model = None
+        self.checkpoint_path = None
+        self.tag = None
+        self.version = 0
+        self._load_lock = threading.Lock()
+
+    def build(self, checkpoint_path: str, backend: str):
+        predictor = take_preloaded_predictor(backend, checkpoint_path)
+        if predictor is None:
+            predictor = load_predictor(backend, checkpoint_path, self.config_path, self.num_labels, mmap=self.mmap)
+
+        # Warm up with a dummy batch so the first real request doesn't pay for lazy init
+        with torch.no_grad():
+            predictor(torch.zeros(1, 3, 224, 224))
+        return predictor
+
+    def load(self, checkpoint_path: str, backend: str = None):
+        backend = backend or self.backend
+        # Only one swap at a time; readers keep using the current model meanwhile
+        with self._load_lock:
+            model = self.build(checkpoint_path, backend)
+            self.model = model
+            self.backend = backend
+            self.checkpoint_path = checkpoint_path
+            # Identifies the exact weights being served, e.g. for cached predictions
+            self.tag = f"{backend}:{os.path.abspath(checkpoint_path)}:{os.path.getmtime(checkpoint_path)}"
+            self.version += 1
+
+    def get(self):
+        """Returns the current predictor: pixel values (N, 3, 224, 224) -> logits (N, num_labels)."""
+        model = self.model
+        if model is None:
+            raise RuntimeError("Classification model is not loaded yet.")
+        return model
+
+
+model_registry = ModelRegistry(vit_config_path, num_labels=len(label_mapping), backend=CLASSIFIER_BACKEND, mmap=MODEL_MMAP)
+
+
+def build_classifier(*modules):
+    model_registry.load(default_checkpoint_path(CLASSIFIER_BACKEND))
+    return model_registry
 
-    model = ViTForImageClassification.from_pretrained(
-        "google/vit-base-patch16-224-in21k", num_labels=65
-    )
-    model.load_state_dict(torch.load(model_path, weights_only=True))
-    model.eval()
+
+# Registered like the providers so `--check` reports the classifier's import and load time
+providers.register("classifier", build_classifier, modules=CLASSIFIER_BACKEND_MODULES.get(CLASSIFIER_BACKEND, ()))
+
+
+@app.on_event("startup")
+def load_classification_model():
+    providers.get("classifier")
+
+
+def predict_logits(input_tensors: torch.Tensor) -> torch.Tensor:
+    """Run a stacked batch of preprocessed images through the resident model in one forward pass."""
+    model = model_registry.get()
 
     with torch.no_grad():
-        outputs = model(input_tensor)
-        logits = outputs.logits
-        predicted_label = logits.argmax(dim=1).item()
+        return model(input_tensors)
+
+
+def labels_from_logits(logits: torch.Tensor) -> List[str]:
+    predicted_labels = logits.argmax(dim=-1).reshape(-1).tolist()
+    return [index_to_label_mapping.get(label, "Unknown Disease") for label in predicted_labels]
+
+
+# How many alternatives to report, and the top-1 probability below which a photo is
+# treated as unusable (blurry, not a leaf, ...) and the retrieval + LLM stage is skipped
+CLASSIFY_TOP_K = int(os.environ.get("CLASSIFY_TOP_K", "3"))
+CONFIDENCE_THRESHOLD = float(os.environ.get("CONFIDENCE_THRESHOLD", "0.5"))
+
+
+def top_k_predictions(logits: torch.Tensor, k: int = CLASSIFY_TOP_K) -> List[dict]:
+    """Softmax over one row of logits; the k most likely labels with their probabilities."""
+    probabilities = torch.softmax(logits.reshape(-1).float(), dim=0)
+    values, indices = probabilities.topk(min(k, probabilities.numel()))
+    return [
+        {"disease_name": index_to_label_mapping.get(index, "Unknown Disease"), "probability": round(value, 4)}
+        for value, index in zip(values.tolist(), indices.tolist())
+    ]
+
+
+def is_confident(predictions: List[dict], threshold: float = CONFIDENCE_THRESHOLD) -> bool:
+    return predictions[0]["probability"] >= threshold
+
+
+def uncertain_response(predictions: List[dict]) -> dict:
+    """Returned instead of an advisory when the classifier is guessing."""
+    return {
+        "status": "uncertain",
+        "message": "The image could not be classified with enough confidence. Please retake the photo "
+                   "of a single leaf in good light.",
+        "confidence": predictions[0]["probability"],
+        "predictions": predictions,
+    }
+
 
-    disease_name = index_to_label_mapping.get(predicted_label, "Unknown Disease")
-    return disease_name
+def predict_resized_batch(images: List[torch.Tensor], out: torch.Tensor = None) -> torch.Tensor:
+    """Normalize resized uint8 images (into `out` when given) and return their logits from one forward pass."""
+    return predict_logits(transform.normalize_batch(images, out=out))
 
-def search_documents_by_disease(vector_store: Chroma, disease_name: str):
+
+# Micro-batching settings: a batch is flushed when it is full or when the
+# oldest request has waited CLASSIFY_MAX_WAIT_MS, whichever comes first.
+CLASSIFY_MAX_BATCH_SIZE = int(os.environ.get("CLASSIFY_MAX_BATCH_SIZE", "16"))
+CLASSIFY_MAX_WAIT_MS = float(os.environ.get("CLASSIFY_MAX_WAIT_MS", "10"))
+
+
+class BatchingClassifier:
     """
-    Search documents from the appropriate vector store by disease name.
+    Collects concurrent classification requests into one batched forward pass.
+
+    Each caller awaits its own future, which is resolved with that caller's logits
+    once the batch it was placed in has run. Forward passes run on the inference
+    pool, at most `max_in_flight` at a time, while the next batch is collected;
+    each in-flight batch is normalized into its own preallocated input buffer.
+    Batch sizes and queue wait times are recorded so the two settings above can
+    be tuned for throughput vs latency.
     """
+    def __init__(self, max_batch_size: int = 16, max_wait_ms: float = 10.0,
+                 max_in_flight: int = 1, history_size: int = 2048):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_in_flight = max_in_flight
+        self.queue = None
+        self.worker = None
+        self.in_flight = None
+        self.buffers = []
+        self.batch_tasks = set()
+        self.batch_sizes = Counter()
+        self.queue_waits = deque(maxlen=history_size)
+        self.total_requests = 0
+        self.total_batches = 0
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.in_flight = asyncio.Semaphore(self.max_in_flight)
+        self.buffers = [transform.allocate_batch(self.max_batch_size) for _ in range(self.max_in_flight)]
+        self.worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+            self.worker = None
+
+    async def predict(self, image: Image.Image) -> torch.Tensor:
+        loop = asyncio.get_running_loop()
+        input_tensor = await loop.run_in_executor(preprocess_executor, transform.resize, image)
+        future = loop.create_future()
+        await self.queue.put((input_tensor, future, time.perf_counter()))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            await self.in_flight.acquire()
+            task = asyncio.create_task(self._run_batch(batch))
+            self.batch_tasks.add(task)
+            task.add_done_callback(self.batch_tasks.discard)
+
+    async def _run_batch(self, batch):
+        started = time.perf_counter()
+        for _, _, enqueued in batch:
+            self.queue_waits.append(started - enqueued)
+        self.batch_sizes[len(batch)] += 1
+        self.total_batches += 1
+        self.total_requests += len(batch)
+
+        # Holding an in-flight slot guarantees a free buffer
+        buffer = self.buffers.pop()
+        try:
+            logits = await asyncio.get_running_loop().run_in_executor(
+                inference_executor, predict_resized_batch, [tensor for tensor, _, _ in batch], buffer
+            )
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self.buffers.append(buffer)
+            self.in_flight.release()
+
+        for (_, future, _), row in zip(batch, logits):
+            if not future.done():
+                future.set_result(row)
+
+    def metrics(self) -> dict:
+        waits = sorted(self.queue_waits)
+
+        def percentile(q):
+            if not waits:
+                return 0.0
+            return waits[min(len(waits) - 1, int(q * len(waits)))] * 1000.0
+
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "total_requests": self.total_requests,
+            "total_batches": self.total_batches,
+            "mean_batch_size": self.total_requests / self.total_batches if self.total_batches else 0.0,
+            "batch_size_distribution": {str(size): count for size, count in sorted(self.batch_sizes.items())},
+            "queue_wait_ms": {
+                "p50": percentile(0.50),
+                "p95": percentile(0.95),
+                "p99": percentile(0.99),
+                "max": waits[-1] * 1000.0 if waits else 0.0,
+            },
+        }
+
+
+batching_classifier = BatchingClassifier(CLASSIFY_MAX_BATCH_SIZE, CLASSIFY_MAX_WAIT_MS, max_in_flight=INFERENCE_WORKERS)
+
+
+@app.on_event("startup")
+async def start_batching_classifier():
+    batching_classifier.start()
+
+
+@app.on_event("shutdown")
+async def stop_batching_classifier():
+    await batching_classifier.stop()
+
+
+class BackgroundSQLite:
+    """
+    SQLite file whose writes run in order on one background thread, so commits (and
+    their fsyncs) never block the event loop. Reads use their own connection and the
+    file is in WAL mode, so a read never waits for the writer's transaction; `aread`
+    runs the read on a reader thread for callers on the event loop.
+    """
+    def __init__(self, db_path: str, name: str):
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.lock = threading.Lock()
+        self.read_db = sqlite3.connect(db_path, check_same_thread=False)
+        self.read_lock = threading.Lock()
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{name}-writer")
+        self.reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{name}-reader")
+
+    def read(self, query: str, params=()):
+        with self.read_lock:
+            return self.read_db.execute(query, params).fetchone()
+
+    async def aread(self, query: str, params=()):
+        return await asyncio.get_running_loop().run_in_executor(self.reader, self.read, query, params)
+
+    def write(self, statements):
+        """Queues (query, params) statements for one transaction; the future resolves to their rowcounts."""
+        future = self.writer.submit(self._write, statements)
+        future.add_done_callback(self._report_failure)
+        return future
+
+    def _write(self, statements):
+        with self.lock:
+            rowcounts = [self.db.execute(query, params).rowcount for query, params in statements]
+            self.db.commit()
+            return rowcounts
+
+    @staticmethod
+    def _report_failure(future):
+        if not future.cancelled() and future.exception() is not None:
+            print(f"SQLite cache write failed: {future.exception()}")
+
+    def close(self):
+        self.reader.shutdown(wait=True)
+        self.writer.shutdown(wait=True)
+        self.db.close()
+        self.read_db.close()
+
+
+# Prediction cache settings. Set PREDICTION_CACHE_DB to a file path to keep
+# predictions across restarts; leave it empty for an in-process cache only.
+# The file keeps at most PREDICTION_CACHE_DB_MAX_ROWS of the most recent predictions.
+PREDICTION_CACHE_SIZE = int(os.environ.get("PREDICTION_CACHE_SIZE", "4096"))
+PREDICTION_CACHE_DB = os.environ.get("PREDICTION_CACHE_DB", "")
+PREDICTION_CACHE_DB_MAX_ROWS = int(os.environ.get("PREDICTION_CACHE_DB_MAX_ROWS", "100000"))
+
+
+class PredictionCache:
+    """
+    Bounded LRU from the SHA-256 of the raw upload bytes to the predicted label and logits.
+
+    A re-submitted photo (retries, shares, switching language) skips decoding and
+    inference entirely. Entries are tagged with the served model, so predictions
+    from a previous checkpoint or backend are never returned.
+    """
+    def __init__(self, max_entries: int = 4096, db_path: str = "", max_db_rows: int = 100000):
+        self.max_entries = max_entries
+        self.max_db_rows = max_db_rows
+        self.entries = OrderedDict()
+        self.stats = Counter()
+        self.db = None
+        if db_path:
+            self.db = BackgroundSQLite(db_path, "prediction-cache")
+            self.db.write([(
+                "CREATE TABLE IF NOT EXISTS predictions (image_hash TEXT PRIMARY KEY, model_tag TEXT, label TEXT, logits BLOB)", ()
+            )]).result()
+
+    async def get(self, image_hash: str, model_tag: str):
+        entry = self.entries.get(image_hash)
+        if entry is not None and entry[0] == model_tag:
+            self.entries.move_to_end(image_hash)
+            self.stats["hits"] += 1
+            return entry[1], entry[2]
+
+        if self.db is not None:
+            row = await self.db.aread(
+                "SELECT label, logits FROM predictions WHERE image_hash = ? AND model_tag = ?", (image_hash, model_tag)
+            )
+            if row is not None:
+                logits = torch.from_numpy(np.frombuffer(row[1], dtype=np.float32).copy())
+                self._remember(image_hash, model_tag, row[0], logits)
+                self.stats["disk_hits"] += 1
+                return row[0], logits
+
+        self.stats["misses"] += 1
+        return None
+
+    def set(self, image_hash: str, model_tag: str, label: str, logits: torch.Tensor):
+        logits = logits.detach().float().clone()
+        self._remember(image_hash, model_tag, label, logits)
+        if self.db is not None:
+            # A replaced row gets a new rowid, so the rowids below the newest max_db_rows are the oldest predictions
+            self.db.write([
+                ("INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?)",
+                 (image_hash, model_tag, label, logits.numpy().tobytes())),
+                ("DELETE FROM predictions WHERE rowid <= (SELECT MAX(rowid) FROM predictions) - ?", (self.max_db_rows,)),
+            ])
+
+    def _remember(self, image_hash: str, model_tag: str, label: str, logits: torch.Tensor):
+        self.entries[image_hash] = (model_tag, label, logits)
+        self.entries.move_to_end(image_hash)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def metrics(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["disk_hits"] + self.stats["misses"]
+        return {
+            "size": len(self.entries),
+            "max_entries": self.max_entries,
+            "persistent": self.db is not None,
+            "hit_rate": (self.stats["hits"] + self.stats["disk_hits"]) / lookups if lookups else 0.0,
+            **self.stats,
+        }
+
+
+prediction_cache = PredictionCache(PREDICTION_CACHE_SIZE, PREDICTION_CACHE_DB, PREDICTION_CACHE_DB_MAX_ROWS)
+
+
+@app.on_event("shutdown")
+def close_prediction_cache():
+    if prediction_cache.db is not None:
+        prediction_cache.db.close()  # Flushes queued writes
+
+
+async def classify_upload(image_data: bytes):
+    """
+    Returns (disease_name, logits) for raw upload bytes, from the prediction cache
+    when the same bytes were classified before by the same model.
+    """
+    image_hash = hashlib.sha256(image_data).hexdigest()
+    model_tag = model_registry.tag
+    cached = await prediction_cache.get(image_hash, model_tag)
+    if cached is not None:
+        return cached
+
+    with stage("decode"):
+        image = await asyncio.get_running_loop().run_in_executor(preprocess_executor, load_image, image_data)
+    with stage("classify"):
+        logits = await batching_classifier.predict(image)
+    disease_name = labels_from_logits(logits)[0]
+    prediction_cache.set(image_hash, model_tag, disease_name, logits)
+    return disease_name, logits
+
+
+# Context assembly (see context_builder.py): retrieved chunks are deduplicated, stripped of
+# bookkeeping metadata, ranked by relevance to the four advisory sections and cut to a token
+# budget per model. Tokens are counted locally: exactly when LLAMA2_TOKENIZER_FILE /
+# OPENAI_TOKENIZER_FILE point at the model's tokenizer.json, else with a conservative estimate.
+CONTEXT_TOKEN_BUDGETS = {
+    "llama2": int(os.environ.get("LLAMA2_CONTEXT_TOKENS", "1500")),
+    "gpt-3.5-turbo": int(os.environ.get("OPENAI_CONTEXT_TOKENS", "2500")),
+}
+token_counters = {
+    "llama2": TokenCounter(os.environ.get("LLAMA2_TOKENIZER_FILE")),
+    "gpt-3.5-turbo": TokenCounter(os.environ.get("OPENAI_TOKENIZER_FILE")),
+}
+
+
+def render_disease_context(documents: List[str], metadatas: List[dict], model_name: str) -> str:
+    """
+    Assembles the chunks retrieved for one disease into the context block used in the prompt for `model_name`.
+    """
+    model_name = model_name.lower()
+    return build_context(documents, metadatas, CONTEXT_TOKEN_BUDGETS[model_name], token_counters[model_name])
+
+
+class DiseaseContextIndex:
+    """
+    In-memory map from disease_name to its pre-rendered context blocks (one per model
+    budget), per Chroma collection.
+
+    The knowledge base only changes on ingestion, so the whole collection is read
+    once at startup (and again via `/admin/reload-knowledge-base`) and requests are
+    served with a dict lookup instead of a Chroma metadata scan. Chunks keep the
+    order given by their `chunk_index` metadata when present, else storage order.
+    """
+    def __init__(self):
+        self.blocks = {}
+        self.missing_labels = {}
+
+    def build(self, collection, labels: List[str]) -> dict:
+        results = collection.get(include=["documents", "metadatas"])
+        grouped = {}
+        for position, (doc, metadata) in enumerate(zip(results["documents"], results["metadatas"])):
+            metadata = metadata or {}
+            disease_name = metadata.get("disease_name")
+            if disease_name is None:
+                continue
+            grouped.setdefault(disease_name, []).append((metadata.get("chunk_index", position), doc, metadata))
+
+        blocks = {}
+        for disease_name, chunks in grouped.items():
+            chunks.sort(key=lambda chunk: chunk[0])
+            documents = [doc for _, doc, _ in chunks]
+            metadatas = [metadata for _, _, metadata in chunks]
+            blocks[disease_name] = {
+                model_name: render_disease_context(documents, metadatas, model_name)
+                for model_name in ENABLED_MODELS
+            }
+
+        # Swap in the new blocks in one assignment so lookups never see a partial index
+        self.blocks = {**self.blocks, collection.name: blocks}
+        self.missing_labels[collection.name] = sorted(label for label in labels if label not in blocks)
+        return {
+            "collection": collection.name,
+            "diseases": len(blocks),
+            "chunks": sum(len(chunks) for chunks in grouped.values()),
+            "missing_labels": self.missing_labels[collection.name],
+        }
+
+    def is_built(self, collection_name: str) -> bool:
+        return collection_name in self.blocks
+
+    def lookup(self, collection_name: str, disease_name: str, model_name: str):
+        blocks = self.blocks[collection_name].get(disease_name)
+        return blocks[model_name.lower()] if blocks is not None else None
+
+
+disease_context_index = DiseaseContextIndex()
+
+
+def rebuild_disease_context_index() -> List[dict]:
+    """
+    Re-reads each collection into the index. A collection that hasn't been ingested
+    yet is indexed as empty, with every label reported missing.
+    """
+    reports = []
+    for collection_name in [CHROMA_COLLECTION]:
+        collection = providers.get("chroma_client").get_or_create_collection(collection_name)
+        report = disease_context_index.build(collection, list(label_mapping))
+        if report["chunks"] == 0:
+            print(f"Collection '{collection_name}' is empty: run data_cleaning_and_vector_database_storage.py, "
+                  f"then POST /admin/reload-knowledge-base to load it")
+        elif report["missing_labels"]:
+            print(f"No documents in '{collection_name}' for labels: {', '.join(report['missing_labels'])} "
+                  f"(ingest them, then POST /admin/reload-knowledge-base)")
+        reports.append(report)
+    return reports
+
+
+def load_disease_context_index():
+    rebuild_disease_context_index()
+    return disease_context_index
+
+
+providers.register("disease_context_index", load_disease_context_index, requires=("chroma_client",))
+
+
+@app.on_event("startup")
+def build_disease_context_index():
+    providers.get("disease_context_index")
+
+
+def search_documents_by_disease(vector_store, disease_name: str, model_name: str):
+    """
+    Search documents from the appropriate vector store by disease name, assembled for `model_name`.
+    Served from the in-memory index once it is built, otherwise from Chroma.
+    """
+    collection_name = vector_store._collection.name
+    if disease_context_index.is_built(collection_name):
+        return disease_context_index.lookup(collection_name, disease_name, model_name)
+
     results = vector_store._collection.get(where={"disease_name": disease_name})
     if not results['documents']:
         return None
 
-    retrieved_info = []
-    for i, doc in enumerate(results['documents']):
-        disease_info = (
-            f"Result {i + 1}:\n"
-            f"Metadata: {results['metadatas'][i]}\n"
-            f"Page Content: {doc}\n"
-        )
-        retrieved_info.append(disease_info)
-
-    return "\n".join(retrieved_info)
+    return render_disease_context(results['documents'], results['metadatas'], model_name)
 
-def generate_llm_response(llm, disease_name: str, retrieved_info: str, language: str = "english"):
+def build_llm_prompt(disease_name: str, retrieved_info: str, language: str = "english") -> str:
     """
-    Generates a structured response using whichever LLM we pass in.
+    Builds the advisory prompt for a disease.
     If language == 'urdu', we instruct the LLM to craft a clear, accessible, and accurate response in Urdu.
     """
 
@@ -252,9 +909,13 @@ def generate_llm_response(llm, disease_name: str, retrieved_info: str, language:
     'Symptoms:', 'Causes:', 'Recommended Solutions:', and 'Pesticide Recommendations:'.
     Do not leave any section empty or missing.Make clear statements or lines for all the above sections.make sure to not use \n,\t,\\n,*,\n1,\n2,\\,\n3 for any section in your response. 
     """
+    return prompt
 
-    response_text = llm.invoke(prompt)
 
+def parse_llm_response(response_text: str, disease_name: str, language: str = "english") -> str:
+    """
+    Extracts the four advisory sections from the raw LLM text into a DiseaseResponse JSON string.
+    """
     # Extract with regex
     symptoms = re.search(
         r"Symptoms:\s*(.*?)(?=Causes:|Recommended Solutions:|Pesticide Recommendations:|$)",
@@ -297,12 +958,258 @@ def generate_llm_response(llm, disease_name: str, retrieved_info: str, language:
     return response_data.json()
 
 
+def log_token_usage(model_name: str, disease_name: str, retrieved_info: str, prompt: str, completion: str):
+    """
+    Records the context, prompt and completion token counts of one LLM call, in the
+    `plant_disease_llm_tokens` histogram on /metrics and as a log line.
+    """
+    counter = token_counters[model_name.lower()]
+    counts = {"context": counter.count(retrieved_info), "prompt": counter.count(prompt), "completion": counter.count(completion)}
+    model = label_values(model_name, None)[0]
+    for kind, tokens in counts.items():
+        LLM_TOKENS.labels(model, kind).observe(tokens)
+    print(f"LLM tokens ({'exact' if counter.exact else 'estimated'}) model={model_name} disease={disease_name} "
+          + " ".join(f"{kind}={tokens}" for kind, tokens in counts.items()))
+
+
+async def agenerate_llm_response(llm, disease_name: str, retrieved_info: str, language: str = "english",
+                                 model_name: str = "llama2"):
+    """
+    Generates a structured response with whichever LLM we pass in, using the provider's async client.
+    """
+    prompt = build_llm_prompt(disease_name, retrieved_info, language=language)
+    async with llm_semaphore:
+        with stage("llm"):
+            response_text = await llm.ainvoke(prompt)
+    log_token_usage(model_name, disease_name, retrieved_info, prompt, response_text)
+    with stage("parse"):
+        return parse_llm_response(response_text, disease_name, language=language)
+
+
+
+# Advisory cache settings. Set ADVISORY_CACHE_DB to a file path to keep
+# advisories across restarts; leave it empty for an in-process cache only.
+ADVISORY_CACHE_SIZE = int(os.environ.get("ADVISORY_CACHE_SIZE", "512"))
+ADVISORY_CACHE_TTL_SECONDS = float(os.environ.get("ADVISORY_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+ADVISORY_CACHE_DB = os.environ.get("ADVISORY_CACHE_DB", "")
+
+
+class AdvisoryCache:
+    """
+    Caches parsed disease advisories keyed by (disease_name, model_name, language).
+
+    Entries live in an in-process LRU with a TTL, optionally backed by a SQLite
+    table that survives restarts. Concurrent misses for the same key share one
+    in-flight generation (single-flight), so a burst of requests for the same
+    disease triggers only one LLM call. Every invalidation bumps `generation`;
+    advisories generated across a bump are returned but not cached.
+    """
+    def __init__(self, max_entries: int = 512, ttl_seconds: float = 604800.0, db_path: str = ""):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.inflight = {}
+        self.stats = Counter()
+        self.generation = 0
+        self.db = None
+        if db_path:
+            self.db = BackgroundSQLite(db_path, "advisory-cache")
+            self.db.write([(
+                "CREATE TABLE IF NOT EXISTS advisories ("
+                "disease_name TEXT, model_name TEXT, language TEXT, value TEXT, expires_at REAL, "
+                "PRIMARY KEY (disease_name, model_name, language))", ()
+            )]).result()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        now = time.time()
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > now:
+                self.entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return value
+            del self.entries[key]
+
+        if self.db is not None:
+            row = self.db.read(
+                "SELECT value, expires_at FROM advisories WHERE disease_name = ? AND model_name = ? AND language = ?",
+                key
+            )
+            if row is not None and row[1] > now:
+                self._remember(key, row[0], row[1])
+                self.stats["disk_hits"] += 1
+                return row[0]
+
+        self.stats["misses"] += 1
+        return None
+
+    def set(self, key, value: str, generation: int = None):
+        """
+        Caches `value`, unless `generation` (read before generating it) shows the
+        cache was invalidated meanwhile and the value may be built on stale context.
+        """
+        if generation is not None and generation != self.generation:
+            self.stats["stale_dropped"] += 1
+            return
+        expires_at = time.time() + self.ttl_seconds
+        self._remember(key, value, expires_at)
+        if self.db is not None:
+            self.db.write([("INSERT OR REPLACE INTO advisories VALUES (?, ?, ?, ?, ?)", (*key, value, expires_at))])
+
+    def _remember(self, key, value: str, expires_at: float):
+        self.entries[key] = (expires_at, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    async def get_or_create(self, key, factory):
+        """
+        Returns the cached value for `key`, or awaits `factory()` to produce it.
+        A `None` result is returned to every waiter but is not cached.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        inflight = self.inflight.get(key)
+        if inflight is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        generation = self.generation
+        try:
+            value = await factory()
+            if value is not None:
+                self.set(key, value, generation)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # Mark as retrieved when nobody else was waiting
+            raise
+        finally:
+            if self.inflight.get(key) is future:
+                del self.inflight[key]
+
+    async def invalidate(self, disease_name: str = None, model_name: str = None, language: str = None) -> int:
+        """
+        Drops every entry matching the given fields (None matches anything). The
+        SQLite delete is queued behind any pending writes and awaited off the loop.
+        """
+        pattern = (disease_name, model_name, language)
+
+        def matches(key):
+            return all(wanted is None or wanted == actual for wanted, actual in zip(pattern, key))
+
+        # Generations already running keep their waiters but won't be cached,
+        # and later misses start a fresh generation instead of joining them
+        self.generation += 1
+        for key in [key for key in self.inflight if matches(key)]:
+            del self.inflight[key]
+
+        removed = [key for key in self.entries if matches(key)]
+        for key in removed:
+            del self.entries[key]
+        count = len(removed)
+
+        if self.db is not None:
+            columns = ("disease_name", "model_name", "language")
+            conditions = [f"{column} = ?" for column, wanted in zip(columns, pattern) if wanted is not None]
+            query = "DELETE FROM advisories" + (" WHERE " + " AND ".join(conditions) if conditions else "")
+            params = [wanted for wanted in pattern if wanted is not None]
+            rowcounts = await asyncio.wrap_future(self.db.write([(query, params)]))
+            count = max(count, rowcounts[0])
+
+        self.stats["invalidated"] += count
+        return count
+
+    def metrics(self) -> dict:
+        return {"size": len(self.entries), "max_entries": self.max_entries,
+                "persistent": self.db is not None, **self.stats}
+
+
+advisory_cache = AdvisoryCache(ADVISORY_CACHE_SIZE, ADVISORY_CACHE_TTL_SECONDS, ADVISORY_CACHE_DB)
+
+
+@app.on_event("shutdown")
+def close_advisory_cache():
+    if advisory_cache.db is not None:
+        advisory_cache.db.close()  # Flushes queued writes
+
+
+def advisory_cache_key(model_name: str, disease_name: str, language: str):
+    return (disease_name, model_name.lower(), language.lower())
+
+
+async def retrieve_disease_context(vector_store, disease_name: str, model_name: str):
+    """
+    Returns the context block for a disease and model, from the in-memory index when built, else from Chroma.
+    """
+    with stage("retrieve"):
+        if disease_context_index.is_built(vector_store._collection.name):
+            return search_documents_by_disease(vector_store, disease_name, model_name)
+        return await asyncio.get_running_loop().run_in_executor(
+            retrieval_executor, search_documents_by_disease, vector_store, disease_name, model_name
+        )
+
+
+async def get_disease_advisory(vector_store, llm, model_name: str, disease_name: str, language: str = "english"):
+    """
+    Returns the advisory for a disease as a dict, served from the advisory cache
+    when possible. Returns None when the knowledge base has nothing on the disease.
+    """
+    async def generate():
+        retrieved_info = await retrieve_disease_context(vector_store, disease_name, model_name)
+        if not retrieved_info:
+            return None
+        return await agenerate_llm_response(llm, disease_name, retrieved_info, language=language, model_name=model_name)
+
+    key = advisory_cache_key(model_name, disease_name, language)
+    advisory_json = await advisory_cache.get_or_create(key, generate)
+    return json.loads(advisory_json) if advisory_json is not None else None
+
+
+def select_providers(model_name: str):
+    """
+    Returns the (vector_store, llm) pair for `model_name`, or None if it is not supported
+    or not enabled. Builds them on first use.
+    """
+    model_name = model_name.lower()
+    if model_name not in ENABLED_MODELS:
+        return None
+    vector_store_name, llm_name = MODEL_PROVIDERS[model_name]
+    return providers.get(vector_store_name), providers.get(llm_name)
+
+
+async def aselect_providers(model_name: str):
+    """
+    `select_providers` for the request path: providers that still have to be built
+    (PROVIDER_INIT=lazy) are built on the retrieval pool, off the event loop.
+    """
+    name = model_name.lower()
+    if name in ENABLED_MODELS and not all(providers.is_built(component) for component in MODEL_PROVIDERS[name]):
+        return await asyncio.get_running_loop().run_in_executor(retrieval_executor, select_providers, model_name)
+    return select_providers(model_name)
+
+
+@app.on_event("startup")
+def initialize_providers():
+    if PROVIDER_INIT == "startup":
+        for model_name in ENABLED_MODELS:
+            select_providers(model_name)
+
 
 @app.post("/classify")
 async def classify_image(
     file: UploadFile = File(...),
     model_name: str = Query(..., description="Choose 'llama2' or 'gpt-3.5-turbo'"),
     language: str = Query("english", description="Choose 'english' or 'urdu'"),
+    confidence_threshold: float = Query(CONFIDENCE_THRESHOLD, ge=0.0, le=1.0,
+                                        description="Minimum top-1 probability to generate an advisory"),
 ):
     """
     Classify the plant disease from an uploaded image and get a response from 
@@ -310,38 +1217,458 @@ async def classify_image(
     Additionally, select the language ('english' or 'urdu') for the final answer.
     """
     try:
+        # Step 1: Choose the correct embedding & LLM based on model_name
+        selected = await aselect_providers(model_name)
+        if selected is None:
+            return error_response(400, INVALID_MODEL_MESSAGE)
+        vector_store, llm = selected
+
         # Read image data
         image_data = await file.read()
-        image = Image.open(io.BytesIO(image_data)).convert("RGB")
-
-        # Step 1: Classify disease
-        disease_name = classify_disease(image)
-
-        # Step 2: Choose the correct embedding & LLM based on model_name
-        if model_name.lower() == "llama2":
-            vector_store = vector_store_llama2
-            llm = llm_llama2
-        elif model_name.lower() == "gpt-3.5-turbo":
-            vector_store = vector_store_openai
-            llm = llm_openai
+
+        # Step 2: Classify disease (skipped for images classified before)
+        disease_name, logits = await classify_upload(image_data)
+        predictions = top_k_predictions(logits)
+        if not is_confident(predictions, confidence_threshold):
+            return uncertain_response(predictions)
+
+        # Step 3 + 4: Retrieve information about this disease and generate the response
+        # in the chosen language, or reuse a cached advisory
+        advisory = await get_disease_advisory(vector_store, llm, model_name, disease_name, language=language)
+        if advisory is None:
+            return error_response(404, f"No information found for disease: {disease_name}")
+        return {**advisory, "confidence": predictions[0]["probability"], "predictions": predictions}
+
+    except InvalidUploadError as e:
+        return error_response(400, f"Invalid image: {str(e)}")
+    except Exception as e:
+        return error_response(500, f"An error occurred while processing the image: {str(e)}")
+
+# Section headers in the order the prompt asks for them, mapped to DiseaseResponse fields
+ADVISORY_SECTIONS = {
+    "Symptoms": "symptoms",
+    "Causes": "causes",
+    "Recommended Solutions": "recommended_solutions",
+    "Pesticide Recommendations": "pesticide_recommendations",
+}
+
+
+class AdvisorySectionParser:
+    """
+    Incrementally splits streamed LLM text into the four advisory sections.
+
+    `feed` returns the sections completed by the new text: a section is complete
+    once a different section header follows it. `close` flushes the last one.
+    Each section is emitted at most once, matching `parse_llm_response`, which
+    keeps the first occurrence of every header.
+    """
+    header_pattern = re.compile("(" + "|".join(re.escape(name) for name in ADVISORY_SECTIONS) + "):")
+
+    def __init__(self):
+        self.buffer = ""
+        self.position = 0
+        self.current = None
+        self.content_start = 0
+        self.emitted = set()
+
+    def feed(self, text: str):
+        self.buffer += text
+        completed = []
+        for match in self.header_pattern.finditer(self.buffer, self.position):
+            header = match.group(1)
+            self.position = match.end()
+            if header == self.current:
+                continue
+            completed.extend(self._finish(match.start()))
+            self.current = header
+            self.content_start = match.end()
+        # A header may be split across chunks, so rescan the tail next time
+        longest = max(len(name) for name in ADVISORY_SECTIONS) + 1
+        self.position = max(self.position, len(self.buffer) - longest)
+        return completed
+
+    def close(self):
+        return self._finish(len(self.buffer))
+
+    def _finish(self, end: int):
+        if self.current is None or self.current in self.emitted:
+            return []
+        self.emitted.add(self.current)
+        return [(ADVISORY_SECTIONS[self.current], self.buffer[self.content_start:end].strip())]
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/classify/stream")
+async def classify_image_stream(
+    file: UploadFile = File(...),
+    model_name: str = Query(..., description="Choose 'llama2' or 'gpt-3.5-turbo'"),
+    language: str = Query("english", description="Choose 'english' or 'urdu'"),
+    confidence_threshold: float = Query(CONFIDENCE_THRESHOLD, ge=0.0, le=1.0,
+                                        description="Minimum top-1 probability to generate an advisory"),
+):
+    """
+    Streaming variant of /classify as Server-Sent Events. A `classification` event is
+    sent as soon as the disease is known, followed by `token` events as the LLM
+    generates, a `section` event whenever one of the four sections is complete,
+    and a final `done` event with the full parsed response (or an `error` event).
+    """
+    try:
+        selected = await aselect_providers(model_name)
+    except Exception as e:
+        return error_response(500, f"An error occurred while loading the {model_name} model: {str(e)}")
+    if selected is None:
+        return error_response(400, INVALID_MODEL_MESSAGE)
+    vector_store, llm = selected
+    image_data = await file.read()
+
+    async def events():
+        try:
+            disease_name, logits = await classify_upload(image_data)
+            predictions = top_k_predictions(logits)
+            yield sse_event("classification", {
+                "disease_name": disease_name,
+                "confidence": predictions[0]["probability"],
+                "predictions": predictions
+            })
+            if not is_confident(predictions, confidence_threshold):
+                yield sse_event("uncertain", uncertain_response(predictions))
+                return
+
+            key = advisory_cache_key(model_name, disease_name, language)
+            advisory_json = advisory_cache.get(key)
+            if advisory_json is None:
+                generation = advisory_cache.generation
+                retrieved_info = await retrieve_disease_context(vector_store, disease_name, model_name)
+                if not retrieved_info:
+                    yield sse_event("error", {"error": f"No information found for disease: {disease_name}"})
+                    return
+
+                prompt = build_llm_prompt(disease_name, retrieved_info, language=language)
+                parser = AdvisorySectionParser()
+                chunks = []
+                async with llm_semaphore:
+                    # Includes the time the client takes to consume the events
+                    with stage("llm"):
+                        async for text in llm.astream(prompt):
+                            chunks.append(text)
+                            yield sse_event("token", {"text": text})
+                            for section, content in parser.feed(text):
+                                yield sse_event("section", {"section": section, "content": content})
+                for section, content in parser.close():
+                    yield sse_event("section", {"section": section, "content": content})
+                log_token_usage(model_name, disease_name, retrieved_info, prompt, "".join(chunks))
+
+                with stage("parse"):
+                    advisory_json = parse_llm_response("".join(chunks), disease_name, language=language)
+                advisory_cache.set(key, advisory_json, generation)
+            else:
+                for section, content in json.loads(advisory_json).items():
+                    if section in ADVISORY_SECTIONS.values():
+                        yield sse_event("section", {"section": section, "content": content})
+
+            yield sse_event("done", json.loads(advisory_json))
+
+        except Exception as e:
+            yield sse_event("error", {"error": f"An error occurred while processing the image: {str(e)}"})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# Upper bounds per /classify/batch request (after unpacking zips): number of images and
+# their total size. Every image is also limited to MAX_UPLOAD_BYTES.
+BATCH_MAX_IMAGES = int(os.environ.get("BATCH_MAX_IMAGES", "64"))
+BATCH_MAX_TOTAL_BYTES = int(os.environ.get("BATCH_MAX_TOTAL_BYTES", str(256 * 1024 * 1024)))
+
+
+class BatchTooLargeError(ValueError):
+    """The batch exceeds one of the limits above (reported to the client as a 413)."""
+
+
+def unpack_batch_uploads(files):
+    """
+    (filename, bytes, SHA-256 hex digest) of every image in `files`, a list of
+    (filename, bytes) uploads, unpacking any zip archives. Zip members are checked
+    against the limits from the archive's directory before anything is decompressed,
+    so a zip bomb is rejected without being expanded.
+    """
+    uploads = []
+    images = 0
+    total_bytes = 0
+
+    def check_limits(filename: str, size: int):
+        nonlocal images, total_bytes
+        images += 1
+        total_bytes += size
+        if images > BATCH_MAX_IMAGES:
+            raise BatchTooLargeError(f"Too many images (maximum is {BATCH_MAX_IMAGES}).")
+        if size > MAX_UPLOAD_BYTES:
+            raise BatchTooLargeError(f"{filename} is larger than {MAX_UPLOAD_BYTES} bytes.")
+        if total_bytes > BATCH_MAX_TOTAL_BYTES:
+            raise BatchTooLargeError(f"The images add up to more than {BATCH_MAX_TOTAL_BYTES} bytes.")
+
+    for filename, data in files:
+        if zipfile.is_zipfile(io.BytesIO(data)):
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                members = [
+                    member for member in archive.infolist()
+                    if not member.is_dir() and not member.filename.startswith("__MACOSX/")
+                ]
+                # Reads never return more than a member's declared file_size
+                for member in members:
+                    check_limits(member.filename, member.file_size)
+                for member in members:
+                    member_data = archive.read(member)
+                    uploads.append((member.filename, member_data, hashlib.sha256(member_data).hexdigest()))
         else:
-            return {"error": "Invalid model_name. Choose 'llama2' or 'gpt-3.5-turbo'."}
+            check_limits(filename, len(data))
+            uploads.append((filename, data, hashlib.sha256(data).hexdigest()))
+    return uploads
 
-        # Step 3: Search for information about this disease in the chosen vector store
-        retrieved_info = search_documents_by_disease(vector_store, disease_name)
-        if not retrieved_info:
-            return {"error": f"No information found for disease: {disease_name}"}
 
-        # Step 4: Generate response using the selected LLM, in the chosen language
-        llm_response_json = generate_llm_response(llm, disease_name, retrieved_info, language=language)
-        return json.loads(llm_response_json)
+async def read_batch_uploads(files: List[UploadFile]):
+    """
+    Reads the uploaded files, then unpacks and hashes them on the preprocess pool:
+    decompressing and hashing up to BATCH_MAX_TOTAL_BYTES would stall the event loop.
+    """
+    contents = [(file.filename, await file.read()) for file in files]
+    return await asyncio.get_running_loop().run_in_executor(preprocess_executor, unpack_batch_uploads, contents)
+
+
+@app.post("/classify/batch")
+async def classify_image_batch(
+    files: List[UploadFile] = File(...),
+    model_name: str = Query(..., description="Choose 'llama2' or 'gpt-3.5-turbo'"),
+    language: str = Query("english", description="Choose 'english' or 'urdu'"),
+    confidence_threshold: float = Query(CONFIDENCE_THRESHOLD, ge=0.0, le=1.0,
+                                        description="Minimum top-1 probability to generate an advisory"),
+):
+    """
+    Classify many leaf images in one request (multiple files and/or zip archives).
+    Images are decoded in parallel and classified in one batched forward pass; the
+    retrieval and LLM steps run once per distinct disease and are shared by every
+    image with that prediction.
+    """
+    try:
+        selected = await aselect_providers(model_name)
+        if selected is None:
+            return error_response(400, INVALID_MODEL_MESSAGE)
+        vector_store, llm = selected
+
+        try:
+            uploads = await read_batch_uploads(files)
+        except BatchTooLargeError as e:
+            return error_response(413, str(e))
+        if not uploads:
+            return error_response(400, "No images were uploaded.")
+
+        # Step 1: Reuse cached predictions, and decode the remaining images in parallel;
+        # undecodable files are reported per image
+        loop = asyncio.get_running_loop()
+        model_tag = model_registry.tag
+        image_hashes = [image_hash for _, _, image_hash in uploads]
+        disease_names = {}
+        predictions = {}
+        cached_predictions = await asyncio.gather(*(prediction_cache.get(image_hash, model_tag) for image_hash in image_hashes))
+        for i, cached in enumerate(cached_predictions):
+            if cached is not None:
+                disease_names[i] = cached[0]
+                predictions[i] = top_k_predictions(cached[1])
+        pending = [i for i in range(len(uploads)) if i not in disease_names]
+
+        with stage("decode"):
+            decoded = await asyncio.gather(
+                *(loop.run_in_executor(preprocess_executor, preprocess_image, uploads[i][1]) for i in pending),
+                return_exceptions=True
+            )
+        tensors = dict(zip(pending, decoded))
+        valid = [i for i in pending if not isinstance(tensors[i], Exception)]
+
+        # Step 2: Classify every remaining decodable image in one forward pass
+        if valid:
+            with stage("classify"):
+                logits = await loop.run_in_executor(
+                    inference_executor, predict_resized_batch, [tensors[i] for i in valid]
+                )
+            for i, row, label in zip(valid, logits, labels_from_logits(logits)):
+                disease_names[i] = label
+                predictions[i] = top_k_predictions(row)
+                prediction_cache.set(image_hashes[i], model_tag, label, row)
+
+        # Step 3: Retrieve and generate once per distinct disease, skipping low-confidence images
+        async def advise(disease_name: str):
+            advisory = await get_disease_advisory(vector_store, llm, model_name, disease_name, language=language)
+            if advisory is None:
+                return {"error": f"No information found for disease: {disease_name}"}
+            return advisory
+
+        confident = {i for i in disease_names if is_confident(predictions[i], confidence_threshold)}
+        distinct_diseases = sorted({disease_names[i] for i in confident})
+        advisories = await asyncio.gather(*(advise(name) for name in distinct_diseases), return_exceptions=True)
+        advisory_by_disease = {}
+        for name, advisory in zip(distinct_diseases, advisories):
+            if isinstance(advisory, Exception):
+                advisory = {"error": f"An error occurred while generating the response: {str(advisory)}"}
+            advisory_by_disease[name] = advisory
+
+        # Step 4: Per-image results, in upload order
+        results = []
+        for i, (filename, _, _) in enumerate(uploads):
+            if i not in disease_names:
+                results.append({"filename": filename, "error": f"Could not decode image: {str(tensors[i])}"})
+            elif i not in confident:
+                results.append({"filename": filename, **uncertain_response(predictions[i])})
+            else:
+                results.append({
+                    "filename": filename,
+                    **advisory_by_disease[disease_names[i]],
+                    "confidence": predictions[i][0]["probability"],
+                    "predictions": predictions[i]
+                })
+        return {"results": results}
 
     except Exception as e:
-        return {"error": f"An error occurred while processing the image: {str(e)}"}
+        return error_response(500, f"An error occurred while processing the images: {str(e)}")
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """
+    Request and per-stage latency histograms and error counters in the Prometheus text format.
+    """
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
+@app.get("/metrics/batching")
+def batching_metrics():
+    """
+    Batch-size distribution and queue wait percentiles of the classification batcher.
+    """
+    return batching_classifier.metrics()
+
+
+@app.get("/metrics/prediction-cache")
+def prediction_cache_metrics():
+    """
+    Size and hit/miss counters of the image prediction cache.
+    """
+    return prediction_cache.metrics()
+
+
+@app.get("/metrics/advisory-cache")
+def advisory_cache_metrics():
+    """
+    Size and hit/miss counters of the advisory cache.
+    """
+    return advisory_cache.metrics()
+
+
+@app.post("/admin/advisory-cache/invalidate")
+async def invalidate_advisory_cache(
+    disease_name: str = Query(None, description="Only drop advisories for this disease"),
+    model_name: str = Query(None, description="Only drop advisories for this model"),
+    language: str = Query(None, description="Only drop advisories in this language"),
+):
+    """
+    Drop cached advisories, e.g. after the knowledge base has been re-ingested.
+    With no filters every entry is removed.
+    """
+    removed = await advisory_cache.invalidate(
+        disease_name,
+        model_name.lower() if model_name else None,
+        language.lower() if language else None
+    )
+    return {"invalidated": removed}
+
+
+@app.post("/admin/reload-knowledge-base")
+async def reload_knowledge_base():
+    """
+    Rebuild the per-disease context index after re-ingestion and drop cached advisories.
+    """
+    try:
+        reports = await asyncio.get_running_loop().run_in_executor(retrieval_executor, rebuild_disease_context_index)
+    except Exception as e:
+        return error_response(500, f"An error occurred while rebuilding the index: {str(e)}")
+    return {"collections": reports, "invalidated_advisories": await advisory_cache.invalidate()}
+
+
+@app.post("/admin/reload-model")
+def reload_model(
+    checkpoint_path: str = Query(None, description="Checkpoint file inside saved_models; defaults to the backend's artifact"),
+    backend: str = Query(None, description="Inference backend: 'torch', 'int8', 'torchscript', 'onnx' or 'student'"),
+):
+    """
+    Load a new checkpoint (optionally on another backend) and swap it in without restarting the server.
+    """
+    backend = backend or model_registry.backend
+    try:
+        checkpoint_path = resolve_checkpoint_path(checkpoint_path) if checkpoint_path else default_checkpoint_path(backend)
+        model_registry.load(checkpoint_path, backend)
+    except ValueError as e:
+        return error_response(400, str(e))
+    except Exception as e:
+        return error_response(500, f"An error occurred while loading the model: {str(e)}")
+    return {
+        "backend": model_registry.backend,
+        "checkpoint_path": model_registry.checkpoint_path,
+        "version": model_registry.version
+    }
+
+
+# Libraries that should only be imported by the component that needs them
+HEAVY_MODULES = ("transformers", "torchvision", "onnxruntime", "chromadb", "langchain", "openai", "replicate")
+
+
+def check_startup() -> dict:
+    """
+    Builds every component the server builds at startup (the providers of all enabled
+    models, whatever PROVIDER_INIT says) and reports the import and init time of each.
+    """
+    import psutil
+
+    report = {
+        # Interpreter start plus importing this module, before any component is built
+        "process_startup_seconds": time.time() - psutil.Process().create_time(),
+        "heavy_modules_at_import": [name for name in HEAVY_MODULES if name in sys.modules],
+        "classifier_backend": CLASSIFIER_BACKEND,
+        "enabled_models": ENABLED_MODELS,
+    }
+    started = time.perf_counter()
+    for name in ["classifier", "disease_context_index"] + [
+        component for model_name in ENABLED_MODELS for component in MODEL_PROVIDERS[model_name]
+    ]:
+        try:
+            providers.get(name)
+        except Exception:
+            pass  # Recorded under the component's "error"
+    report["components_seconds"] = time.perf_counter() - started
+    report["components"] = providers.report()
+    return report
+
 
 # --------------------- MAIN ENTRY POINT ---------------------
 
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Plant disease detection API.")
+    parser.add_argument("--check", action="store_true",
+                        help="Build every startup component, print their import/init times as JSON and exit")
+    args = parser.parse_args()
+
+    if args.check:
+        report = check_startup()
+        print(json.dumps(report, indent=4))
+        sys.exit(1 if any("error" in component for component in report["components"].values()) else 0)
+
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
 
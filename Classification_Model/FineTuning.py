@@ -1,248 +1,190 @@
 import os
-from PIL import Image, UnidentifiedImageError
+import argparse
 import torch
-from torchvision import transforms
-from sklearn.model_selection import train_test_split
 from torch import nn, optim
 from transformers import ViTForImageClassification
-from torch.utils.data import Dataset, DataLoader
-import random
+
+from checkpointing import CheckpointWriter, ResumableSampler, load_training_state, training_state, write_json_atomic
+from dataset_cache import CompiledImageDataset, compile_dataset, is_compiled, load_index, split_indices
+from preprocessing import BatchAugmentation, FastPreprocessor, TrainingCollate, load_transform_details
+from training_engine import PRECISIONS, build_loader, evaluate_loader, train_one_epoch
 
 # Define the root folder where all plant disease folders are stored
 root_folder = "L:\\Plant Disease App\\Classification_Model\\Images Dataset of plants"  # Ensure the path is correct
 
-# Define the basic image transformations (resize and normalization)
-basic_transform = transforms.Compose([
-    transforms.Resize((224, 224)),  # Resize images to 224x224 for ViT
-    transforms.ToTensor(),  # Convert images to PyTorch tensors
-    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])  # Normalize with ImageNet stats
-])
-
-# Define additional augmentations for 30% of images
-augmented_transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.RandomRotation(degrees=30),  # Random rotation by 30 degrees
-    transforms.RandomHorizontalFlip(p=0.5),  # Random horizontal flip
-    transforms.RandomVerticalFlip(p=0.5),  # Random vertical flip
-    transforms.ColorJitter(brightness=0.4, contrast=0.4, saturation=0.4, hue=0.2),  # Color jitter
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-])
-
-# Lists to hold image file paths and corresponding labels
-image_paths = []
-labels = []
-skipped_images = 0  # To count the number of skipped images
-
-# Loop through the root folder to find plant disease folders
-for plant in os.listdir(root_folder):
-    plant_folder = os.path.join(root_folder, plant)
-    
-    if os.path.isdir(plant_folder):  # Check if it's a directory
-        for disease in os.listdir(plant_folder):
-            disease_folder = os.path.join(plant_folder, disease)
-            
-            if os.path.isdir(disease_folder):  # Check if it's a directory
-                for image_file in os.listdir(disease_folder):
-                    if image_file.endswith(('.jpg', '.png','.JPG','.jpeg')):  # Check for image files
-                        image_path = os.path.join(disease_folder, image_file)
-                        try:
-                            # Open image to ensure it's valid
-                            img = Image.open(image_path)
-                            img.verify()  # Verify the image to check for corruption
-                            image_paths.append(image_path)
-                            labels.append(disease)  # Disease name as label
-                        except (UnidentifiedImageError, OSError):
-                            skipped_images += 1  # Increment skipped images count
-                            print(f"Skipped corrupted image: {image_path}")
-
-# Print the number of images, unique labels, and skipped images
-print(f"Number of images: {len(image_paths)}")
-print(f"Unique disease labels: {len(set(labels))}")
-print(f"Skipped images: {skipped_images}")
-
-# Custom dataset for loading plant disease images
-class PlantDiseaseDataset(Dataset):
-    def __init__(self, image_paths, labels, basic_transform, augmented_transform, augment_ratio=0.4):
-        self.image_paths = image_paths
-        self.labels = labels
-        self.basic_transform = basic_transform
-        self.augmented_transform = augmented_transform
-        self.augment_ratio = augment_ratio
-        self.label2idx = {label: idx for idx, label in enumerate(sorted(set(labels)))}
-
-        # Duplicate 40% of the images for augmentation
-        num_augmented = int(len(self.image_paths) * self.augment_ratio)
-        augmented_image_paths = random.sample(self.image_paths, num_augmented)
-        augmented_labels = [self.labels[self.image_paths.index(path)] for path in augmented_image_paths]
-        
-        # Append augmented images and labels to the original lists
-        self.image_paths += augmented_image_paths
-        self.labels += augmented_labels
-
-    def __len__(self):
-        return len(self.image_paths)
-
-    def __getitem__(self, idx):
-        image_path = self.image_paths[idx]
-        label = self.labels[idx]
-        
-        try:
-            image = Image.open(image_path).convert("RGB")  # Load image as RGB
-        except (UnidentifiedImageError, OSError):
-            print(f"Skipping invalid image during dataset loading: {image_path}")
-            return None, None, False  # Skip invalid image
-        
-        # Apply transformations: use augmented transformation only for duplicates
-        is_augmented = idx >= len(self.image_paths) - int(len(self.image_paths) * self.augment_ratio)
-        if is_augmented:
-            image = self.augmented_transform(image)  # Apply augmentation to duplicates
-        else:
-            image = self.basic_transform(image)  # Apply basic transformation to originals
-        
-        return image, self.label2idx[label], is_augmented  # Return the augmentation flag
-
-
-# Split dataset into 70% train, 20% validation, and 10% test
-train_paths, test_paths, train_labels, test_labels = train_test_split(
-    image_paths, labels, test_size=0.1, random_state=42, stratify=labels
-)
-train_paths, val_paths, train_labels, val_labels = train_test_split(
-    train_paths, train_labels, test_size=0.2222, random_state=42, stratify=train_labels  # 0.2222 because 0.2222 * 0.9 ≈ 0.2
-)
-
-# Create train, validation, and test datasets
-train_dataset = PlantDiseaseDataset(train_paths, train_labels, basic_transform, augmented_transform)
-val_dataset = PlantDiseaseDataset(val_paths, val_labels, basic_transform, augmented_transform)
-test_dataset = PlantDiseaseDataset(test_paths, test_labels, basic_transform, augmented_transform)
-
-# Create data loaders
-train_loader = DataLoader(train_dataset, batch_size=32, shuffle=True)
-val_loader = DataLoader(val_dataset, batch_size=32, shuffle=False)
-test_loader = DataLoader(test_dataset, batch_size=32, shuffle=False)
-
-# Load pre-trained ViT model for image classification
-model = ViTForImageClassification.from_pretrained(
-    'google/vit-base-patch16-224-in21k', 
-    num_labels=len(set(train_labels))  # Set the number of classes
-)
-
-# Move model to the GPU (if available)
-device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-model.to(device)
-
-# Define optimizer and loss function
-optimizer = optim.AdamW(model.parameters(), lr=5e-5)
-loss_fn = nn.CrossEntropyLoss()
-
-# Directory to save the model
+# Decoded, resized uint8 images live in one memory-mapped file built by dataset_cache.py.
+# The tree is scanned and decoded (in parallel) only when no compiled copy exists yet.
+compiled_dataset_dir = "L:/Plant Disease App/Classification_Model/compiled_dataset"
+
+# Resize/normalization and augmentation settings live in transform_details.json,
+# which Backend.py reads too, so training and serving always preprocess the same way
+transform_details = load_transform_details("L:/Plant Disease App/Classification_Model/saved_models/transform_details.json")
+
+# Normalization (the resize already happened when the dataset was compiled)
+preprocessor = FastPreprocessor(transform_details)
+
+# Directory to save the model; the best model by validation accuracy is promoted to
+# final_model.pt, the checkpoint Backend.py serves
 save_dir = "L:/Plant Disease App/Classification_Model/saved_models"
-os.makedirs(save_dir, exist_ok=True)
-
-# Training loop
-num_epochs = 3
-
-for epoch in range(num_epochs):
-    model.train()  # Set the model to training mode
-    running_loss = 0.0
-    correct_predictions = 0
-    total_samples_epoch = 0
-    total_samples = 0
-    total_augmented = 0  # Track total augmented images in the epoch
-
-    for i, batch in enumerate(train_loader):
-        # Get the inputs and labels, and the augmented flags
-        pixel_values, labels, augmented_flags = batch
-
-        # Skip if a batch contains None values
-        if pixel_values is None or labels is None:
-            continue
-        
-        pixel_values, labels = pixel_values.to(device), labels.to(device)
-        
-        # Zero the parameter gradients
-        optimizer.zero_grad()
-
-        # Forward pass
-        outputs = model(pixel_values)
-        logits = outputs.logits
-        loss = loss_fn(logits, labels)
-
-        # Backward pass and optimization
-        loss.backward()
-        optimizer.step()
-
-        # Track metrics
-        running_loss += loss.item() * pixel_values.size(0)
-        _, predicted = torch.max(logits, 1)
-        correct_predictions += (predicted == labels).sum().item()
-        total_samples += labels.size(0)
-        total_samples_epoch += labels.size(0)  # Count the total number of images
-
-        # Add the number of augmented images for the batch
-        total_augmented += augmented_flags.sum().item()  # Count augmented images
-
-        # Print output for each batch
-        print(f"Batch {i+1}/{len(train_loader)}, Loss: {loss.item():.4f}, Accuracy: {(correct_predictions / total_samples):.4f}")
-
-    epoch_loss = running_loss / total_samples
-    epoch_accuracy = correct_predictions / total_samples
-
-    print(f"Epoch {epoch+1}/{num_epochs}, Loss: {epoch_loss:.4f}, Accuracy: {epoch_accuracy:.4f}")
-    print(f"Total images processed in this epoch: {total_samples}")
-    print(f"Total augmented images in this epoch: {total_augmented} ({(total_augmented / total_samples_epoch) * 100:.2f}% of total images)")
-    print(f"Total number of images used for training in this epoch: {total_samples_epoch}")
-
-    # Save the model at the end of each epoch
-    torch.save(model.state_dict(), os.path.join(save_dir, f"model_epoch_{epoch+1}.pt"))
-
-    # Validation loop 
-    model.eval()
-    val_loss = 0.0
-    val_correct = 0
-    val_total = 0
-
-    with torch.no_grad():
-        for val_batch in val_loader:
-            val_pixel_values, val_labels, _ = val_batch
-            val_pixel_values, val_labels = val_pixel_values.to(device), val_labels.to(device)
-
-            val_outputs = model(val_pixel_values)
-            val_logits = val_outputs.logits
-            val_loss += loss_fn(val_logits, val_labels).item() * val_pixel_values.size(0)
-
-            _, val_predicted = torch.max(val_logits, 1)
-            val_correct += (val_predicted == val_labels).sum().item()
-            val_total += val_labels.size(0)
-
-    val_loss /= val_total
-    val_accuracy = val_correct / val_total
-    print(f"Validation Loss: {val_loss:.4f}, Validation Accuracy: {val_accuracy:.4f}")
-
-# Testing loop 
-model.eval()
-test_loss = 0.0
-test_correct = 0
-test_total = 0
-
-with torch.no_grad():
-    for test_batch in test_loader:
-        test_pixel_values, test_labels, _ = test_batch
-        test_pixel_values, test_labels = test_pixel_values.to(device), test_labels.to(device)
-
-        test_outputs = model(test_pixel_values)
-        test_logits = test_outputs.logits
-        test_loss += loss_fn(test_logits, test_labels).item() * test_pixel_values.size(0)
-
-        _, test_predicted = torch.max(test_logits, 1)
-        test_correct += (test_predicted == test_labels).sum().item()
-        test_total += test_labels.size(0)
-
-test_loss /= test_total
-test_accuracy = test_correct / test_total
-print(f"Test Loss: {test_loss:.4f}, Test Accuracy: {test_accuracy:.4f}")
-
-# Save the final model
-torch.save(model.state_dict(), os.path.join(save_dir, "final_model.pt"))
-
-print("Model training and testing complete. Model saved.")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fine-tune the ViT plant disease classifier.")
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--lr", type=float, default=5e-5)
+    parser.add_argument("--accumulation-steps", type=int, default=1,
+                        help="Batches per optimizer step (effective batch = batch size * steps)")
+    parser.add_argument("--num-workers", type=int, default=min(8, os.cpu_count() or 1),
+                        help="DataLoader worker processes (0 loads in the training process)")
+    parser.add_argument("--prefetch-factor", type=int, default=4, help="Batches prefetched per worker")
+    parser.add_argument("--precision", choices=list(PRECISIONS), default="bf16",
+                        help="bf16 runs forward/backward under bfloat16 autocast (CPU or GPU); "
+                             "validation and test always run in fp32")
+    parser.add_argument("--augment-probability", type=float, default=0.4,
+                        help="Chance that a training image is augmented in a given epoch")
+    parser.add_argument("--log-every", type=int, default=50, help="Print running metrics every N batches")
+    parser.add_argument("--seed", type=int, default=42, help="Seed of the per-epoch shuffling order")
+    parser.add_argument("--state-path", default=os.path.join(save_dir, "training_state.pt"),
+                        help="Full training-state checkpoint (model, optimizer, RNG, data position)")
+    parser.add_argument("--checkpoint-every", type=int, default=200,
+                        help="Also write the training state every N optimizer steps (0: only at epoch end)")
+    parser.add_argument("--resume", action="store_true", help="Continue the run saved at --state-path")
+    return parser.parse_args()
+
+
+# Data loading workers and the decoding pool start new processes, so only run training as a script
+if __name__ == "__main__":
+    args = parse_args()
+
+    # Compile the dataset on the first run; later runs reuse it without rescanning the tree
+    if not is_compiled(compiled_dataset_dir, transform_details):
+        compile_dataset(root_folder, compiled_dataset_dir, transform_details)
+    dataset_index = load_index(compiled_dataset_dir)
+    image_paths = dataset_index["paths"]
+    labels = dataset_index["labels"]
+
+    # Print the number of images, unique labels, and skipped images
+    print(f"Number of images: {len(image_paths)}")
+    print(f"Unique disease labels: {len(set(labels))}")
+    print(f"Skipped images: {len(dataset_index['skipped'])}")
+
+    # Split dataset into 70% train, 20% validation, and 10% test (indices into the compiled dataset)
+    train_indices, val_indices, test_indices = split_indices(labels)
+
+    # Create train, validation, and test datasets
+    label2idx = {label: idx for idx, label in enumerate(sorted(set(labels)))}
+    train_dataset = CompiledImageDataset(compiled_dataset_dir, label2idx, train_indices)
+    val_dataset = CompiledImageDataset(compiled_dataset_dir, label2idx, val_indices)
+    test_dataset = CompiledImageDataset(compiled_dataset_dir, label2idx, test_indices)
+
+    # Training batches are augmented on the fly (each image with --augment-probability) in the
+    # loader workers; validation and test batches are only normalized
+    train_collate = TrainingCollate(preprocessor, BatchAugmentation(transform_details, args.augment_probability))
+    eval_collate = TrainingCollate(preprocessor)
+
+    # Move model to the GPU (if available)
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+    # Create data loaders
+    loader_options = {"num_workers": args.num_workers, "prefetch_factor": args.prefetch_factor, "device": device}
+    # The sampler's order depends only on (seed, epoch), so a resumed epoch continues where it stopped
+    train_sampler = ResumableSampler(len(train_dataset), seed=args.seed)
+    train_loader = build_loader(train_dataset, args.batch_size, shuffle=True, collate_fn=train_collate,
+                                sampler=train_sampler, **loader_options)
+    val_loader = build_loader(val_dataset, args.batch_size, shuffle=False, collate_fn=eval_collate, **loader_options)
+    test_loader = build_loader(test_dataset, args.batch_size, shuffle=False, collate_fn=eval_collate, **loader_options)
+
+    # Load pre-trained ViT model for image classification
+    model = ViTForImageClassification.from_pretrained(
+        'google/vit-base-patch16-224-in21k', 
+        num_labels=len(label2idx)  # Set the number of classes
+    )
+
+    model.to(device)
+
+    # Define optimizer and loss function
+    optimizer = optim.AdamW(model.parameters(), lr=args.lr)
+    loss_fn = nn.CrossEntropyLoss()
+
+    os.makedirs(save_dir, exist_ok=True)
+    final_model_path = os.path.join(save_dir, "final_model.pt")
+    best_model_report = os.path.join(save_dir, "best_model.json")
+
+    # Checkpoints are written on a background thread while training continues
+    checkpoint_writer = CheckpointWriter()
+    best = {"epoch": None, "val_accuracy": -1.0, "val_loss": None}
+    start_epoch, resume_samples = 0, 0
+    if args.resume:
+        state = load_training_state(args.state_path, model, optimizer)
+        start_epoch, resume_samples, best = state["epoch"], state["samples_seen"], state["best"]
+        train_sampler.seed = state["config"]["seed"]
+        print(f"Resumed from {args.state_path}: epoch {start_epoch+1}, {resume_samples} images into the epoch, "
+              f"best validation accuracy so far {best['val_accuracy']:.4f}")
+    run_config = {"seed": train_sampler.seed, "num_labels": len(label2idx)}
+    progress = {"epoch": start_epoch, "start": 0, "steps": 0}
+
+    def checkpoint_step(images_done):
+        # Called after each optimizer step: periodically save the state mid-epoch
+        progress["steps"] += 1
+        if args.checkpoint_every and progress["steps"] % args.checkpoint_every == 0:
+            checkpoint_writer.save(
+                training_state(model, optimizer, progress["epoch"], progress["start"] + images_done, best, run_config),
+                args.state_path
+            )
+
+    # Training loop
+    num_epochs = args.epochs
+
+    for epoch in range(start_epoch, num_epochs):
+        progress["epoch"] = epoch
+        progress["start"] = resume_samples if epoch == start_epoch else 0
+        if progress["start"] >= len(train_dataset):
+            # Resumed from a checkpoint taken on the epoch's last optimizer step: only validation is left
+            print(f"Epoch {epoch+1}/{num_epochs}: training already complete, resuming at validation")
+        else:
+            train_sampler.set_epoch(epoch, start=progress["start"])
+            train_metrics = train_one_epoch(
+                model, train_loader, optimizer, loss_fn, device,
+                precision=args.precision,
+                accumulation_steps=args.accumulation_steps,
+                log_every=args.log_every,
+                header=f"Epoch {epoch+1}/{num_epochs} ",
+                on_optimizer_step=checkpoint_step
+            )
+            total_samples = train_metrics["images"]
+            total_augmented = train_metrics["augmented_images"]
+
+            print(f"Epoch {epoch+1}/{num_epochs}, Loss: {train_metrics['loss']:.4f}, Accuracy: {train_metrics['accuracy']:.4f}")
+            print(f"Total images processed in this epoch: {total_samples}")
+            print(f"Total augmented images in this epoch: {total_augmented} ({(total_augmented / total_samples) * 100:.2f}% of total images)")
+            print(f"Throughput: {train_metrics['images_per_sec']:.1f} images/sec ({train_metrics['seconds']:.1f}s)")
+
+        # Save the model at the end of each epoch
+        checkpoint_writer.save(model.state_dict(), os.path.join(save_dir, f"model_epoch_{epoch+1}.pt"))
+
+        # Validation loop, in fp32 so best-model selection isn't skewed by bf16 rounding
+        val_metrics = evaluate_loader(model, val_loader, loss_fn, device, precision="fp32")
+        print(f"Validation Loss: {val_metrics['loss']:.4f}, Validation Accuracy: {val_metrics['accuracy']:.4f}")
+
+        # Promote the model if it is the best so far (atomic rename, so the backend never reads a partial file)
+        if val_metrics["accuracy"] > best["val_accuracy"]:
+            best = {"epoch": epoch + 1, "val_accuracy": val_metrics["accuracy"], "val_loss": val_metrics["loss"]}
+            checkpoint_writer.save(
+                model.state_dict(), final_model_path,
+                on_saved=lambda report=dict(best): write_json_atomic(report, best_model_report)
+            )
+            print(f"New best model (epoch {epoch+1}), promoted to {final_model_path}")
+
+        checkpoint_writer.save(training_state(model, optimizer, epoch + 1, 0, best, run_config), args.state_path)
+
+    checkpoint_writer.close()
+
+    # Testing loop, on the best model (the one that is served)
+    if best["epoch"] is not None:
+        model.load_state_dict(torch.load(final_model_path, map_location=device, weights_only=True))
+    test_metrics = evaluate_loader(model, test_loader, loss_fn, device, precision="fp32")
+    print(f"Test Loss: {test_metrics['loss']:.4f}, Test Accuracy: {test_metrics['accuracy']:.4f}")
+    write_json_atomic({**best, "test_accuracy": test_metrics["accuracy"], "test_loss": test_metrics["loss"]}, best_model_report)
+
+    print(f"Model training and testing complete. Best model (epoch {best['epoch']}) saved to {final_model_path}.")
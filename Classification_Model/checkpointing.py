@@ -0,0 +1,134 @@
+import os
+import json
+import random
+import numpy as np
+import torch
+from concurrent.futures import ThreadPoolExecutor
+from torch.utils.data import Sampler
+
+# Resumable training: full training-state checkpoints written on a background thread,
+# a sampler that can restart an epoch mid-way, and atomic promotion of the best model
+# to the checkpoint Backend.py serves.
+
+
+def _to_cpu(value):
+    """Deep copy of a (nested) state dict with every tensor cloned to CPU memory."""
+    if torch.is_tensor(value):
+        return value.detach().to("cpu", copy=True)
+    if isinstance(value, dict):
+        return {key: _to_cpu(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_to_cpu(item) for item in value)
+    return value
+
+def atomic_save(obj, path):
+    """torch.save to a temp file, then rename, so readers never see a partial file."""
+    tmp_path = path + ".tmp"
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+
+class CheckpointWriter:
+    """
+    Writes checkpoints on one background thread so training doesn't wait on disk.
+
+    `save` snapshots the state to CPU on the calling thread (a memory copy, so later
+    optimizer steps can't change what gets written) and returns immediately. Writes
+    happen in submission order; `wait` blocks until all of them are on disk.
+    """
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = []
+
+    def save(self, state, path, on_saved=None):
+        snapshot = _to_cpu(state)
+
+        def write():
+            atomic_save(snapshot, path)
+            if on_saved is not None:
+                on_saved()
+
+        self.pending = [future for future in self.pending if not future.done()]
+        self.pending.append(self.executor.submit(write))
+
+    def wait(self):
+        for future in self.pending:
+            future.result()
+        self.pending = []
+
+    def close(self):
+        self.wait()
+        self.executor.shutdown()
+
+
+class ResumableSampler(Sampler):
+    """
+    Shuffles with a permutation derived from (seed, epoch), so an interrupted epoch can be
+    replayed exactly and restarted after the samples that were already trained on.
+    """
+    def __init__(self, num_samples, seed=42):
+        self.num_samples = num_samples
+        self.seed = seed
+        self.epoch = 0
+        self.start = 0
+
+    def set_epoch(self, epoch, start=0):
+        self.epoch = epoch
+        self.start = start
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        return iter(torch.randperm(self.num_samples, generator=generator)[self.start:].tolist())
+
+    def __len__(self):
+        return self.num_samples - self.start
+
+
+def rng_state():
+    state = {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+def restore_rng_state(state):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+def training_state(model, optimizer, epoch, samples_seen, best, config):
+    """
+    Everything needed to continue a run: weights, AdamW moments, RNG streams, and the
+    position in the data (epoch plus samples of that epoch already trained on).
+    """
+    return {
+        "model": model.state_dict(),
+        "optimizer": optimizer.state_dict(),
+        "rng": rng_state(),
+        "epoch": epoch,
+        "samples_seen": samples_seen,
+        "best": best,
+        "config": config,
+    }
+
+def load_training_state(path, model, optimizer):
+    """Restores a training_state checkpoint into `model` and `optimizer`; returns the checkpoint dict."""
+    state = torch.load(path, map_location="cpu", weights_only=False)
+    model.load_state_dict(state["model"])
+    optimizer.load_state_dict(state["optimizer"])
+    restore_rng_state(state["rng"])
+    return state
+
+
+def write_json_atomic(obj, path):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(obj, f, indent=4)
+    os.replace(tmp_path, path)
@@ -0,0 +1,208 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+import torch
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, UnidentifiedImageError
+from sklearn.model_selection import train_test_split
+from torch.utils.data import Dataset
+
+from preprocessing import FastPreprocessor, load_transform_details
+
+# One-time compiler for the training image tree. Every image is decoded and resized
+# once (in parallel) and stored as uint8 (3, H, W) in a single memory-mapped file:
+#   <output_dir>/images.u8   - raw uint8 array of shape (count, 3, H, W)
+#   <output_dir>/index.json  - shape, labels, source paths and the settings used
+# FineTuning.py then trains from the mmap instead of re-decoding JPEGs every epoch.
+
+root_folder = "L:\\Plant Disease App\\Classification_Model\\Images Dataset of plants"
+compiled_dataset_dir = "L:/Plant Disease App/Classification_Model/compiled_dataset"
+transform_details_path = "L:/Plant Disease App/Classification_Model/saved_models/transform_details.json"
+
+IMAGES_FILE = "images.u8"
+INDEX_FILE = "index.json"
+IMAGE_EXTENSIONS = ('.jpg', '.png', '.JPG', '.jpeg')
+
+
+def scan_image_tree(root_folder):
+    """
+    Lists (image path, disease label) pairs in the same order as FineTuning.py's scan:
+    <root>/<plant>/<disease>/<image>. Files are not opened here.
+    """
+    image_paths = []
+    labels = []
+    for plant in os.listdir(root_folder):
+        plant_folder = os.path.join(root_folder, plant)
+        if os.path.isdir(plant_folder):
+            for disease in os.listdir(plant_folder):
+                disease_folder = os.path.join(plant_folder, disease)
+                if os.path.isdir(disease_folder):
+                    for image_file in os.listdir(disease_folder):
+                        if image_file.endswith(IMAGE_EXTENSIONS):
+                            image_paths.append(os.path.join(disease_folder, image_file))
+                            labels.append(disease)
+    return image_paths, labels
+
+
+_preprocessor = None
+
+def _init_worker(details, draft=False):
+    global _preprocessor
+    # By default a full decode (no JPEG draft mode), so images match the torchvision pipeline
+    _preprocessor = FastPreprocessor(details, draft=draft)
+
+def _decode(path):
+    """Decode + resize one image in a worker; None for corrupted files."""
+    try:
+        if _preprocessor.draft:
+            with open(path, "rb") as f:
+                return _preprocessor.preprocess_bytes(f.read()).numpy()
+        with Image.open(path) as image:
+            image = image.convert("RGB")
+        return _preprocessor.resize(image).numpy()
+    except (UnidentifiedImageError, OSError, ValueError):
+        return None
+
+
+def iter_decoded(image_paths, details, workers=None, chunksize=16, draft=False):
+    """
+    Yields (path, uint8 (3, H, W) array or None) for every path, in order, decoding
+    and resizing on a process pool. None marks a corrupted image.
+    """
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(details, draft)) as executor:
+        yield from zip(image_paths, executor.map(_decode, image_paths, chunksize=chunksize))
+
+
+def compile_dataset(root_folder, output_dir, details, workers=None, chunksize=16):
+    """
+    Decodes every image under `root_folder` once and writes the uint8 mmap + index.
+    Corrupted images are skipped (and listed in the index). Returns the index.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    height, width = details["basic_transform"]["resize"]
+    image_paths, labels = scan_image_tree(root_folder)
+    images_path = os.path.join(output_dir, IMAGES_FILE)
+    # A previous compile's index no longer describes the directory once recompiling starts,
+    # and the images are written to a temp file, so an interrupted run leaves no usable index
+    if os.path.exists(os.path.join(output_dir, INDEX_FILE)):
+        os.remove(os.path.join(output_dir, INDEX_FILE))
+    tmp_images_path = images_path + ".tmp"
+
+    started = time.perf_counter()
+    array = np.memmap(tmp_images_path, dtype=np.uint8, mode="w+", shape=(max(len(image_paths), 1), 3, height, width))
+    kept_paths, kept_labels, skipped = [], [], []
+    for label, (path, image) in zip(labels, iter_decoded(image_paths, details, workers, chunksize)):
+        if image is None:
+            skipped.append(path)
+            print(f"Skipped corrupted image: {path}")
+            continue
+        array[len(kept_paths)] = image
+        kept_paths.append(path)
+        kept_labels.append(label)
+    array.flush()
+    del array
+    # Drop the slots reserved for skipped images
+    os.truncate(tmp_images_path, len(kept_paths) * 3 * height * width)
+    os.replace(tmp_images_path, images_path)
+
+    index = {
+        "shape": [len(kept_paths), 3, height, width],
+        "paths": kept_paths,
+        "labels": kept_labels,
+        "skipped": skipped,
+        "root_folder": root_folder,
+        "basic_transform": details["basic_transform"],
+    }
+    # The index is written last, so a directory with an index always has complete images
+    tmp_path = os.path.join(output_dir, INDEX_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp_path, os.path.join(output_dir, INDEX_FILE))
+
+    seconds = time.perf_counter() - started
+    print(f"Compiled {len(kept_paths)} images ({len(skipped)} skipped) in {seconds:.1f}s "
+          f"({len(image_paths) / max(seconds, 1e-9):.1f} images/sec) to {output_dir}")
+    return index
+
+
+def load_index(output_dir):
+    with open(os.path.join(output_dir, INDEX_FILE), "r") as f:
+        return json.load(f)
+
+def is_compiled(output_dir, details=None):
+    """True if `output_dir` holds a complete compiled dataset (made with the same resize, if details are given)."""
+    if not os.path.exists(os.path.join(output_dir, INDEX_FILE)):
+        return False
+    return details is None or load_index(output_dir)["basic_transform"] == details["basic_transform"]
+
+
+def split_indices(labels, seed=42):
+    """
+    The 70% train / 20% validation / 10% test split used by every training script,
+    as index lists into the compiled dataset (stratified by label).
+    """
+    train_indices, test_indices, train_labels, _ = train_test_split(
+        list(range(len(labels))), labels, test_size=0.1, random_state=seed, stratify=labels
+    )
+    train_indices, val_indices = train_test_split(
+        train_indices, test_size=0.2222, random_state=seed, stratify=train_labels  # 0.2222 because 0.2222 * 0.9 ≈ 0.2
+    )
+    return train_indices, val_indices, test_indices
+
+
+def held_out_test_split(output_dir):
+    """
+    (image paths, labels) of the 10% test split no training script trains on. The
+    compiled index only lists images that decoded, so no file is re-verified here.
+    """
+    index = load_index(output_dir)
+    _, _, test_indices = split_indices(index["labels"])
+    return [index["paths"][i] for i in test_indices], [index["labels"][i] for i in test_indices]
+
+
+class CompiledImageDataset(Dataset):
+    """
+    Reads images zero-copy from a compiled dataset.
+
+    Items are (uint8 (3, H, W) tensor, label index). The mmap is opened lazily in
+    each DataLoader worker, so workers share the page cache instead of copies.
+    `indices` selects a subset (e.g. a train/val/test split) without copying data.
+    """
+    def __init__(self, output_dir, label2idx, indices=None):
+        self.index = load_index(output_dir)
+        self.images_path = os.path.join(output_dir, IMAGES_FILE)
+        self.shape = tuple(self.index["shape"])
+        self.label2idx = label2idx
+        self.indices = list(range(self.shape[0])) if indices is None else list(indices)
+        self.targets = [label2idx[self.index["labels"][i]] for i in self.indices]
+        self.images = None
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, idx):
+        if self.images is None:
+            # Copy-on-write mapping: tensors are writable views and the file is never modified
+            self.images = np.memmap(self.images_path, dtype=np.uint8, mode="c", shape=self.shape)
+        return torch.from_numpy(self.images[self.indices[idx]]), self.targets[idx]
+
+    def __getstate__(self):
+        # Don't pickle an open mmap into DataLoader workers
+        state = dict(self.__dict__)
+        state["images"] = None
+        return state
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Decode the training image tree once into a memory-mapped uint8 dataset.")
+    parser.add_argument("--dataset-root", default=root_folder)
+    parser.add_argument("--output-dir", default=compiled_dataset_dir)
+    parser.add_argument("--workers", type=int, default=None, help="Decoding processes (default: one per CPU)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    compile_dataset(args.dataset_root, args.output_dir, load_transform_details(transform_details_path), args.workers)
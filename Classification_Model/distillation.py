@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import argparse
+import torch
+from torch import nn, optim
+from torch.nn import functional as F
+from transformers import ViTConfig, ViTForImageClassification
+
+from checkpointing import atomic_save, write_json_atomic
+from dataset_cache import CompiledImageDataset, compile_dataset, is_compiled, load_index, split_indices
+from inference_backends import STUDENT_CONFIG_FILE, load_vit
+from preprocessing import BatchAugmentation, FastPreprocessor, TrainingCollate, load_transform_details
+from training_engine import PRECISIONS, build_loader, evaluate_loader, train_one_epoch
+
+# Knowledge distillation: the fine-tuned ViT-Base (final_model.pt) is the teacher, and a
+# compact ViT student is trained on its temperature-softened predictions plus the true
+# labels. The student is written as saved_models/student_model.pt with its config next
+# to it, and served by Backend.py with CLASSIFIER_BACKEND=student. It keeps the teacher's
+# label indices, so it is served with the same label_mapping.json.
+
+root_folder = "L:\\Plant Disease App\\Classification_Model\\Images Dataset of plants"
+compiled_dataset_dir = "L:/Plant Disease App/Classification_Model/compiled_dataset"
+saved_models_dir = "L:/Plant Disease App/Classification_Model/saved_models"
+
+# Student sizes (same patch size and resolution as the teacher, so preprocessing is shared)
+STUDENT_CONFIGS = {
+    "tiny": {"hidden_size": 192, "num_hidden_layers": 12, "num_attention_heads": 3, "intermediate_size": 768},
+    "small": {"hidden_size": 384, "num_hidden_layers": 12, "num_attention_heads": 6, "intermediate_size": 1536},
+    "micro": {"hidden_size": 192, "num_hidden_layers": 6, "num_attention_heads": 3, "intermediate_size": 768},
+}
+
+
+class DistillationLoss(nn.Module):
+    """
+    alpha * T^2 * KL(teacher_T || student_T) + (1 - alpha) * cross-entropy with the labels,
+    where _T are the softmax distributions at temperature T (Hinton et al.).
+    """
+    def __init__(self, temperature=4.0, alpha=0.7):
+        super().__init__()
+        self.temperature = temperature
+        self.alpha = alpha
+
+    def forward(self, student_logits, labels, teacher_logits):
+        t = self.temperature
+        soft = F.kl_div(
+            F.log_softmax(student_logits / t, dim=1), F.log_softmax(teacher_logits / t, dim=1),
+            reduction="batchmean", log_target=True
+        ) * (t * t)
+        hard = F.cross_entropy(student_logits, labels)
+        return self.alpha * soft + (1 - self.alpha) * hard
+
+
+def build_student(teacher_config_path, size, num_labels, pretrained=None):
+    """A student ViT: from a hub checkpoint if given, otherwise freshly initialized from a preset."""
+    if pretrained:
+        return ViTForImageClassification.from_pretrained(pretrained, num_labels=num_labels, ignore_mismatched_sizes=True)
+    config = ViTConfig.from_json_file(teacher_config_path)
+    for key, value in STUDENT_CONFIGS[size].items():
+        setattr(config, key, value)
+    config.num_labels = num_labels
+    return ViTForImageClassification(config)
+
+
+def count_parameters(model):
+    return sum(parameter.numel() for parameter in model.parameters())
+
+def cpu_latency_ms(model, runs=20):
+    """Median single-image CPU latency, as one /classify request sees it."""
+    sample = torch.zeros(1, 3, 224, 224)
+    latencies = []
+    with torch.no_grad():
+        model(sample)
+        for _ in range(runs):
+            started = time.perf_counter()
+            model(sample)
+            latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return latencies[len(latencies) // 2] * 1000.0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Distill the fine-tuned ViT into a compact student classifier.")
+    parser.add_argument("--teacher", default=os.path.join(saved_models_dir, "final_model.pt"))
+    parser.add_argument("--student-size", choices=list(STUDENT_CONFIGS), default="tiny")
+    parser.add_argument("--student-pretrained", default=None,
+                        help="Optional hub checkpoint to start the student from (e.g. a ViT-Tiny)")
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--lr", type=float, default=5e-4)
+    parser.add_argument("--temperature", type=float, default=4.0)
+    parser.add_argument("--alpha", type=float, default=0.7, help="Weight of the soft-target loss")
+    parser.add_argument("--num-workers", type=int, default=min(8, os.cpu_count() or 1))
+    parser.add_argument("--prefetch-factor", type=int, default=4)
+    parser.add_argument("--precision", choices=list(PRECISIONS), default="bf16")
+    parser.add_argument("--augment-probability", type=float, default=0.4)
+    parser.add_argument("--log-every", type=int, default=50)
+    parser.add_argument("--report", default=os.path.join(saved_models_dir, "distillation_report.json"))
+    args = parser.parse_args()
+    if args.epochs < 1:
+        parser.error("--epochs must be at least 1")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    transform_details = load_transform_details(os.path.join(saved_models_dir, "transform_details.json"))
+    teacher_config_path = os.path.join(saved_models_dir, "vit_config.json")
+    with open(os.path.join(saved_models_dir, "label_mapping.json"), "r") as f:
+        label_mapping = json.load(f)
+
+    if not is_compiled(compiled_dataset_dir, transform_details):
+        compile_dataset(root_folder, compiled_dataset_dir, transform_details)
+    labels = load_index(compiled_dataset_dir)["labels"]
+    unknown = sorted(set(labels) - set(label_mapping))
+    if unknown:
+        raise SystemExit(f"Dataset labels missing from label_mapping.json: {', '.join(unknown)}")
+
+    # Same split as FineTuning.py, and the teacher's label indices
+    train_indices, val_indices, test_indices = split_indices(labels)
+    preprocessor = FastPreprocessor(transform_details)
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    loader_options = {"num_workers": args.num_workers, "prefetch_factor": args.prefetch_factor, "device": device}
+    eval_collate = TrainingCollate(preprocessor)
+    train_loader = build_loader(
+        CompiledImageDataset(compiled_dataset_dir, label_mapping, train_indices), args.batch_size, shuffle=True,
+        collate_fn=TrainingCollate(preprocessor, BatchAugmentation(transform_details, args.augment_probability)),
+        **loader_options
+    )
+    val_loader = build_loader(CompiledImageDataset(compiled_dataset_dir, label_mapping, val_indices), args.batch_size,
+                              shuffle=False, collate_fn=eval_collate, **loader_options)
+    test_loader = build_loader(CompiledImageDataset(compiled_dataset_dir, label_mapping, test_indices), args.batch_size,
+                               shuffle=False, collate_fn=eval_collate, **loader_options)
+
+    teacher = load_vit(args.teacher, teacher_config_path, len(label_mapping)).to(device)
+    student = build_student(teacher_config_path, args.student_size, len(label_mapping), args.student_pretrained).to(device)
+    print(f"Teacher: {count_parameters(teacher) / 1e6:.1f}M parameters, student: {count_parameters(student) / 1e6:.1f}M")
+
+    optimizer = optim.AdamW(student.parameters(), lr=args.lr)
+    scheduler = optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=args.epochs)
+    distillation_loss = DistillationLoss(args.temperature, args.alpha)
+    eval_loss = nn.CrossEntropyLoss()
+
+    student_path = os.path.join(saved_models_dir, "student_model.pt")
+    best_val_accuracy = -1.0
+    for epoch in range(args.epochs):
+        train_metrics = train_one_epoch(
+            student, train_loader, optimizer, distillation_loss, device,
+            precision=args.precision, log_every=args.log_every, header=f"Epoch {epoch+1}/{args.epochs} ",
+            teacher=teacher
+        )
+        scheduler.step()
+        # Validated in fp32 so best-student selection isn't skewed by bf16 rounding
+        val_metrics = evaluate_loader(student, val_loader, eval_loss, device, precision="fp32")
+        print(f"Epoch {epoch+1}/{args.epochs}, Distillation Loss: {train_metrics['loss']:.4f}, "
+              f"Validation Accuracy: {val_metrics['accuracy']:.4f}, {train_metrics['images_per_sec']:.1f} images/sec")
+
+        # Keep the best student by validation accuracy
+        if val_metrics["accuracy"] > best_val_accuracy:
+            best_val_accuracy = val_metrics["accuracy"]
+            atomic_save({key: value.detach().cpu() for key, value in student.state_dict().items()}, student_path)
+            student.config.to_json_file(os.path.join(saved_models_dir, STUDENT_CONFIG_FILE))
+            print(f"Saved student (epoch {epoch+1}) to {student_path}")
+
+    # Teacher vs best student, side by side
+    student.load_state_dict(torch.load(student_path, map_location=device, weights_only=True))
+    report = {}
+    for name, model, path in (("teacher", teacher, args.teacher), ("student", student, student_path)):
+        test_metrics = evaluate_loader(model, test_loader, eval_loss, device, precision="fp32")
+        cpu_model = model.to("cpu").eval()
+        report[name] = {
+            "test_accuracy": test_metrics["accuracy"],
+            "parameters_millions": count_parameters(cpu_model) / 1e6,
+            "size_mb": os.path.getsize(path) / 1e6,
+            "cpu_latency_ms_p50": cpu_latency_ms(lambda x: cpu_model(x).logits),
+            "throughput_images_per_sec": test_metrics["images_per_sec"],
+        }
+    report["student"]["accuracy_delta"] = report["student"]["test_accuracy"] - report["teacher"]["test_accuracy"]
+    report["student"]["speedup_p50"] = report["teacher"]["cpu_latency_ms_p50"] / report["student"]["cpu_latency_ms_p50"]
+
+    print(json.dumps(report, indent=4))
+    write_json_atomic(report, args.report)
@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import argparse
+import torch
+from PIL import Image
+
+from dataset_cache import held_out_test_split, is_compiled
+from inference_backends import CLASSIFIER_BACKENDS, LogitsOnly, load_predictor, load_vit, quantize_int8
+from preprocessing import build_basic_transform, load_transform_details
+
+# Export the trained ViT into optimized CPU artifacts and check them against the FP32 model:
+#   int8        - dynamically quantized Linear layers, saved as TorchScript
+#   torchscript - traced FP32 TorchScript
+#   onnx        - ONNX graph for onnxruntime
+# Backend.py picks one of them with CLASSIFIER_BACKEND.
+
+saved_models_dir = "L:/Plant Disease App/Classification_Model/saved_models"
+compiled_dataset_dir = "L:/Plant Disease App/Classification_Model/compiled_dataset"
+
+
+def export_int8(model, example, path):
+    quantized = quantize_int8(model)
+    with torch.no_grad():
+        traced = torch.jit.trace(quantized, example, strict=False)
+    traced.save(path)
+
+def export_torchscript(model, example, path):
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example, strict=False)
+    traced.save(path)
+
+def export_onnx(model, example, path):
+    torch.onnx.export(
+        model, example, path,
+        input_names=["pixel_values"],
+        output_names=["logits"],
+        dynamic_axes={"pixel_values": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=17
+    )
+
+EXPORTERS = {"int8": export_int8, "torchscript": export_torchscript, "onnx": export_onnx}
+
+
+def evaluate(predictor, test_paths, test_labels, label_mapping, transform, batch_size=32):
+    """Accuracy, predictions, and latency (batch of one) plus batched throughput for one predictor."""
+    predictions = []
+    batch_seconds = 0.0
+    with torch.no_grad():
+        for start in range(0, len(test_paths), batch_size):
+            batch = torch.stack([
+                transform(Image.open(path).convert("RGB")) for path in test_paths[start:start + batch_size]
+            ])
+            started = time.perf_counter()
+            logits = predictor(batch)
+            batch_seconds += time.perf_counter() - started
+            predictions.extend(logits.argmax(dim=1).tolist())
+
+        # Single-image latency, as seen by one /classify request
+        sample = transform(Image.open(test_paths[0]).convert("RGB")).unsqueeze(0)
+        predictor(sample)
+        latencies = []
+        for _ in range(20):
+            started = time.perf_counter()
+            predictor(sample)
+            latencies.append(time.perf_counter() - started)
+
+    correct = sum(1 for predicted, label in zip(predictions, test_labels) if predicted == label_mapping[label])
+    latencies.sort()
+    return predictions, {
+        "accuracy": correct / len(test_labels),
+        "latency_ms_p50": latencies[len(latencies) // 2] * 1000.0,
+        "throughput_images_per_sec": len(test_paths) / batch_seconds,
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export final_model.pt to INT8 / TorchScript / ONNX and check accuracy parity.")
+    parser.add_argument("--checkpoint", default=os.path.join(saved_models_dir, "final_model.pt"))
+    parser.add_argument("--output-dir", default=saved_models_dir)
+    parser.add_argument("--formats", nargs="+", choices=list(EXPORTERS), default=list(EXPORTERS))
+    parser.add_argument("--compiled-dataset", default=compiled_dataset_dir,
+                        help="Compiled dataset (dataset_cache.py) whose held-out test split is evaluated")
+    parser.add_argument("--max-images", type=int, default=None, help="Only evaluate the first N test images")
+    parser.add_argument("--skip-parity", action="store_true", help="Export only, without the accuracy check")
+    parser.add_argument("--report", default=None, help="Write the parity report to this JSON file")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    config_path = os.path.join(saved_models_dir, "vit_config.json")
+    with open(os.path.join(saved_models_dir, "label_mapping.json"), "r") as f:
+        label_mapping = json.load(f)
+    num_labels = len(label_mapping)
+    example = torch.zeros(1, 3, 224, 224)
+
+    fp32 = load_vit(args.checkpoint, config_path, num_labels)
+    model = LogitsOnly(fp32).eval()
+
+    artifacts = {}
+    for name in args.formats:
+        path = os.path.join(args.output_dir, CLASSIFIER_BACKENDS[name][1])
+        EXPORTERS[name](model, example, path)
+        artifacts[name] = path
+        print(f"Exported {name}: {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+
+    if args.skip_parity:
+        raise SystemExit(0)
+
+    transform = build_basic_transform(load_transform_details(os.path.join(saved_models_dir, "transform_details.json")))
+
+    if not is_compiled(args.compiled_dataset):
+        raise SystemExit(f"The parity check needs the compiled dataset in {args.compiled_dataset} (run dataset_cache.py).")
+    test_paths, test_labels = held_out_test_split(args.compiled_dataset)
+    if args.max_images:
+        test_paths, test_labels = test_paths[:args.max_images], test_labels[:args.max_images]
+    print(f"Evaluating on {len(test_paths)} held-out test images")
+
+    reference, fp32_report = evaluate(model, test_paths, test_labels, label_mapping, transform)
+    report = {"fp32": fp32_report}
+
+    for name, path in artifacts.items():
+        predictions, variant_report = evaluate(
+            load_predictor(name, path, config_path, num_labels), test_paths, test_labels, label_mapping, transform
+        )
+        variant_report["agreement_with_fp32"] = sum(
+            1 for a, b in zip(predictions, reference) if a == b
+        ) / len(reference)
+        variant_report["accuracy_delta"] = variant_report["accuracy"] - fp32_report["accuracy"]
+        variant_report["speedup_p50"] = fp32_report["latency_ms_p50"] / variant_report["latency_ms_p50"]
+        variant_report["size_mb"] = os.path.getsize(path) / 1e6
+        report[name] = variant_report
+
+    print(json.dumps(report, indent=4))
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=4)
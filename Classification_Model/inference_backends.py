@@ -0,0 +1,118 @@
+import os
+import torch
+from torch import nn
+
+
+def build_vit(config_path, num_labels):
+    """Build the ViT classifier from the local config file (no hub lookup)."""
+    # Imported here: transformers takes seconds to import and the TorchScript / ONNX backends don't need it
+    from transformers import ViTConfig, ViTForImageClassification
+
+    config = ViTConfig.from_json_file(config_path)
+    config.num_labels = num_labels
+    return ViTForImageClassification(config)
+
+def load_vit(checkpoint_path, config_path, num_labels, mmap=False):
+    """
+    Build the ViT and load a state dict; every key must match. With `mmap`, the weights stay
+    memory-mapped from the checkpoint file instead of being copied into process memory, so
+    several processes serving the same file share one copy in the page cache.
+    """
+    if mmap:
+        # Built without storage: every tensor is assigned from the mapped file below
+        with torch.device("meta"):
+            model = build_vit(config_path, num_labels)
+    else:
+        model = build_vit(config_path, num_labels)
+    state_dict = torch.load(checkpoint_path, map_location="cpu", weights_only=True, mmap=mmap)
+    model.load_state_dict(state_dict, assign=mmap)
+    model.eval()
+    return model
+
+
+class LogitsOnly(nn.Module):
+    """Wraps the ViT so it returns the logits tensor, which is what tracing and ONNX export need."""
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model(pixel_values).logits
+
+def quantize_int8(model):
+    """Dynamic INT8 quantization of every Linear layer (weights int8, activations quantized on the fly)."""
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+# Config of the distilled student model, saved next to its checkpoint
+STUDENT_CONFIG_FILE = "student_vit_config.json"
+
+
+# Each loader returns a predictor: a callable mapping a (N, 3, H, W) float tensor to (N, num_labels) logits.
+# `mmap` only applies to state-dict checkpoints; TorchScript and ONNX artifacts are always read into memory.
+
+def load_torch_predictor(checkpoint_path, config_path, num_labels, mmap=False):
+    model = load_vit(checkpoint_path, config_path, num_labels, mmap=mmap)
+    return lambda pixel_values: model(pixel_values).logits
+
+def load_student_predictor(checkpoint_path, config_path, num_labels, mmap=False):
+    """The distilled student (distillation.py); its config is written next to the checkpoint."""
+    student_config_path = os.path.join(os.path.dirname(checkpoint_path), STUDENT_CONFIG_FILE)
+    return load_torch_predictor(checkpoint_path, student_config_path, num_labels, mmap=mmap)
+
+def load_torchscript_predictor(checkpoint_path, config_path, num_labels, mmap=False):
+    module = torch.jit.load(checkpoint_path, map_location="cpu")
+    module.eval()
+    return module
+
+def load_onnx_predictor(checkpoint_path, config_path, num_labels, mmap=False):
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    # Same thread budget as torch, so serve.py's per-worker setting applies here too
+    options.intra_op_num_threads = torch.get_num_threads()
+    session = onnxruntime.InferenceSession(checkpoint_path, options, providers=["CPUExecutionProvider"])
+
+    def predict(pixel_values):
+        logits = session.run(["logits"], {"pixel_values": pixel_values.numpy()})[0]
+        return torch.from_numpy(logits)
+    return predict
+
+
+# Backend name -> (loader, artifact file name inside saved_models written by export_model.py)
+CLASSIFIER_BACKENDS = {
+    "torch": (load_torch_predictor, "final_model.pt"),
+    "int8": (load_torchscript_predictor, "final_model_int8.pt"),
+    "torchscript": (load_torchscript_predictor, "final_model_torchscript.pt"),
+    "onnx": (load_onnx_predictor, "final_model.onnx"),
+    "student": (load_student_predictor, "student_model.pt"),
+}
+
+# Heavy modules each backend's loader imports on first use (reported by `Backend.py --check`)
+CLASSIFIER_BACKEND_MODULES = {
+    "torch": ("transformers.models.vit.modeling_vit",),
+    "student": ("transformers.models.vit.modeling_vit",),
+    "onnx": ("onnxruntime",),
+}
+
+def load_predictor(backend, checkpoint_path, config_path, num_labels, mmap=False):
+    if backend not in CLASSIFIER_BACKENDS:
+        raise ValueError(f"Unknown classifier backend '{backend}'. Choose one of: {', '.join(CLASSIFIER_BACKENDS)}")
+    loader, _ = CLASSIFIER_BACKENDS[backend]
+    return loader(checkpoint_path, config_path, num_labels, mmap=mmap)
+
+
+# Predictors loaded by serve.py before it forks the serving workers, keyed by (backend,
+# absolute checkpoint path). Each worker's ModelRegistry takes the inherited predictor
+# instead of loading the checkpoint again, so the weight pages stay shared copy-on-write.
+preloaded_predictors = {}
+
+def preload_predictor(backend, checkpoint_path, config_path, num_labels):
+    predictor = load_predictor(backend, checkpoint_path, config_path, num_labels)
+    preloaded_predictors[(backend, os.path.abspath(checkpoint_path))] = predictor
+    return predictor
+
+def take_preloaded_predictor(backend, checkpoint_path):
+    """The preloaded predictor for this checkpoint, once; later loads of the same path read the file again."""
+    return preloaded_predictors.pop((backend, os.path.abspath(checkpoint_path)), None)
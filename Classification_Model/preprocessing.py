@@ -0,0 +1,216 @@
+import io
+import json
+import math
+import numpy as np
+import torch
+from torch.nn import functional as nn_functional
+from PIL import Image
+
+# One definition of the image preprocessing, read from saved_models/transform_details.json,
+# shared by FineTuning.py (BatchAugmentation + FastPreprocessor normalization), the export/
+# evaluation scripts (torchvision pipelines) and Backend.py (FastPreprocessor) so training
+# and serving cannot drift apart.
+
+
+def load_transform_details(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+# torchvision is only imported by the reference pipelines below, which serving never uses
+
+def build_basic_transform(details):
+    from torchvision import transforms
+
+    basic = details["basic_transform"]
+    return transforms.Compose([
+        transforms.Resize(tuple(basic["resize"])),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=basic["normalization_mean"], std=basic["normalization_std"])
+    ])
+
+def build_augmented_transform(details):
+    from torchvision import transforms
+
+    basic = details["basic_transform"]
+    augmented = details["augmented_transform"]
+    return transforms.Compose([
+        transforms.Resize(tuple(augmented["resize"])),
+        transforms.RandomRotation(degrees=augmented["random_rotation"]),
+        transforms.RandomHorizontalFlip(p=augmented["horizontal_flip"]),
+        transforms.RandomVerticalFlip(p=augmented["vertical_flip"]),
+        transforms.ColorJitter(**augmented["color_jitter"]),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=basic["normalization_mean"], std=basic["normalization_std"])
+    ])
+
+# Color space used for the batched hue shift
+_RGB_TO_YIQ = torch.tensor([[0.299, 0.587, 0.114], [0.596, -0.274, -0.322], [0.211, -0.523, 0.312]])
+_YIQ_TO_RGB = torch.linalg.inv(_RGB_TO_YIQ)
+
+
+class BatchAugmentation:
+    """
+    The augmented transform's random ops, vectorized over a whole uint8 (N, 3, H, W) batch.
+
+    Each image is augmented with `probability` (sampled per batch, so no dataset entries
+    are duplicated). Selected images get a random rotation (one affine grid_sample for the
+    batch), per-image horizontal/vertical flips and color jitter with per-image factors.
+    Hue is shifted by rotating chroma in YIQ space, a cheap close match to an HSV hue shift.
+    Returns float images in [0, 255] and the boolean mask of augmented images.
+    """
+    def __init__(self, details, probability=0.4):
+        augmented = details["augmented_transform"]
+        self.probability = probability
+        self.max_rotation = math.radians(augmented["random_rotation"])
+        self.horizontal_flip = augmented["horizontal_flip"]
+        self.vertical_flip = augmented["vertical_flip"]
+        jitter = augmented["color_jitter"]
+        self.brightness = jitter.get("brightness", 0)
+        self.contrast = jitter.get("contrast", 0)
+        self.saturation = jitter.get("saturation", 0)
+        self.hue = jitter.get("hue", 0)
+
+    @staticmethod
+    def _factors(n, amount):
+        return (1 + (torch.rand(n) * 2 - 1) * amount).view(n, 1, 1, 1)
+
+    @staticmethod
+    def _grayscale(x):
+        return (0.299 * x[:, 0:1] + 0.587 * x[:, 1:2] + 0.114 * x[:, 2:3])
+
+    def _rotate(self, x):
+        angles = (torch.rand(len(x)) * 2 - 1) * self.max_rotation
+        cos, sin = torch.cos(angles), torch.sin(angles)
+        zeros = torch.zeros_like(angles)
+        theta = torch.stack([torch.stack([cos, -sin, zeros], 1), torch.stack([sin, cos, zeros], 1)], 1)
+        grid = nn_functional.affine_grid(theta, list(x.shape), align_corners=False)
+        return nn_functional.grid_sample(x, grid, mode="bilinear", padding_mode="zeros", align_corners=False)
+
+    def _flip(self, x, p, dim):
+        flip = torch.rand(len(x)) < p
+        x[flip] = x[flip].flip(dim)
+        return x
+
+    def _jitter(self, x):
+        n = len(x)
+        if self.brightness:
+            x = (x * self._factors(n, self.brightness)).clamp_(0, 1)
+        if self.contrast:
+            mean = self._grayscale(x).mean(dim=(1, 2, 3), keepdim=True)
+            x = ((x - mean) * self._factors(n, self.contrast) + mean).clamp_(0, 1)
+        if self.saturation:
+            gray = self._grayscale(x)
+            x = ((x - gray) * self._factors(n, self.saturation) + gray).clamp_(0, 1)
+        if self.hue:
+            # One 3x3 color matrix per image: RGB -> YIQ, rotate (I, Q), YIQ -> RGB
+            angle = (torch.rand(n) * 2 - 1) * self.hue * 2 * math.pi
+            rotation = torch.zeros(n, 3, 3)
+            rotation[:, 0, 0] = 1
+            rotation[:, 1, 1] = rotation[:, 2, 2] = torch.cos(angle)
+            rotation[:, 1, 2] = -torch.sin(angle)
+            rotation[:, 2, 1] = torch.sin(angle)
+            matrices = _YIQ_TO_RGB @ rotation @ _RGB_TO_YIQ
+            x = torch.einsum("nij,njhw->nihw", matrices, x).clamp_(0, 1)
+        return x
+
+    def __call__(self, images):
+        batch = images.float()
+        mask = torch.rand(len(batch)) < self.probability
+        if mask.any():
+            x = batch[mask] / 255.0
+            x = self._rotate(x)
+            x = self._flip(x, self.horizontal_flip, -1)
+            x = self._flip(x, self.vertical_flip, -2)
+            batch[mask] = self._jitter(x) * 255.0
+        return batch, mask
+
+
+class TrainingCollate:
+    """
+    DataLoader collate_fn for compiled (uint8 image, label) items: stacks the batch,
+    applies BatchAugmentation (if given) and normalizes, all inside the loader worker.
+    Yields (pixel_values, labels, augmented_flags).
+    """
+    def __init__(self, preprocessor, augmentation=None):
+        self.preprocessor = preprocessor
+        self.augmentation = augmentation
+
+    def __call__(self, items):
+        images = torch.stack([image for image, _ in items])
+        labels = torch.tensor([label for _, label in items])
+        if self.augmentation is None:
+            mask = torch.zeros(len(items), dtype=torch.bool)
+        else:
+            images, mask = self.augmentation(images)
+        return self.preprocessor.normalize_batch(images), labels, mask
+
+
+class FastPreprocessor:
+    """
+    Serving-side equivalent of the basic transform, split into cheap stages.
+
+    `decode` validates the upload and decodes it, using JPEG draft mode so a 12MP
+    photo is DCT-downscaled while decoding instead of after. `resize` produces a
+    uint8 (3, H, W) tensor with the same PIL bilinear resize torchvision uses.
+    `normalize_batch` fuses ToTensor + Normalize into one multiply-add per batch,
+    optionally writing into a preallocated buffer.
+    """
+    allowed_formats = {"JPEG", "MPO", "PNG", "WEBP", "BMP"}
+
+    def __init__(self, details, max_upload_bytes=20 * 1024 * 1024, max_pixels=64_000_000, draft=True):
+        basic = details["basic_transform"]
+        self.height, self.width = basic["resize"]
+        mean = np.asarray(basic["normalization_mean"], dtype=np.float32)
+        std = np.asarray(basic["normalization_std"], dtype=np.float32)
+        # (x / 255 - mean) / std  ==  x * scale + offset
+        self.scale = torch.from_numpy(1.0 / (255.0 * std)).view(1, 3, 1, 1)
+        self.offset = torch.from_numpy(-mean / std).view(1, 3, 1, 1)
+        self.max_upload_bytes = max_upload_bytes
+        self.max_pixels = max_pixels
+        self.draft = draft
+
+    def decode(self, data: bytes) -> Image.Image:
+        if len(data) > self.max_upload_bytes:
+            raise ValueError(f"Upload is too large ({len(data)} bytes, maximum is {self.max_upload_bytes}).")
+        try:
+            image = Image.open(io.BytesIO(data))
+        except Exception:
+            raise ValueError("Upload is not a supported image.")
+        if image.format not in self.allowed_formats:
+            raise ValueError(f"Unsupported image format: {image.format}.")
+        if image.width * image.height > self.max_pixels:
+            raise ValueError(f"Image is too large ({image.width}x{image.height}).")
+
+        # The headers above can be intact while the pixel data is truncated or corrupt,
+        # which only surfaces when the image is actually decoded
+        try:
+            if self.draft and image.format in ("JPEG", "MPO"):
+                # Decode at the smallest DCT scale that is still at least the target size
+                image.draft("RGB", (self.width, self.height))
+            return image.convert("RGB")
+        except (OSError, SyntaxError):
+            raise ValueError("Upload is a truncated or corrupted image.")
+
+    def resize(self, image: Image.Image) -> torch.Tensor:
+        image = image.resize((self.width, self.height), Image.BILINEAR)
+        return torch.from_numpy(np.array(image, dtype=np.uint8)).permute(2, 0, 1)
+
+    def allocate_batch(self, batch_size: int) -> torch.Tensor:
+        return torch.empty(batch_size, 3, self.height, self.width, dtype=torch.float32)
+
+    def normalize_batch(self, images, out=None) -> torch.Tensor:
+        """Stack uint8 (3, H, W) tensors into a normalized float batch, in `out[:len(images)]` if given."""
+        if out is None:
+            out = self.allocate_batch(len(images))
+        else:
+            out = out[:len(images)]
+        for i, image in enumerate(images):
+            out[i].copy_(image)
+        return out.mul_(self.scale).add_(self.offset)
+
+    def preprocess_bytes(self, data: bytes) -> torch.Tensor:
+        return self.resize(self.decode(data))
+
+    def __call__(self, image: Image.Image) -> torch.Tensor:
+        """Drop-in replacement for the torchvision basic transform on a single image."""
+        return self.normalize_batch([self.resize(image)])[0]
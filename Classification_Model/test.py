@@ -1,52 +1,189 @@
-import torch
-from transformers import ViTForImageClassification
-from torchvision import transforms
-from PIL import Image
+import os
 import json
+import time
+import argparse
+import torch
+
+from dataset_cache import IMAGE_EXTENSIONS, held_out_test_split, is_compiled, iter_decoded, scan_image_tree
+from inference_backends import CLASSIFIER_BACKENDS, load_predictor
+from preprocessing import FastPreprocessor, load_transform_details
+
+# Evaluate a checkpoint (or an optimized backend) on a whole image tree laid out like the
+# training data (<root>/<plant>/<disease>/<image>), or on single images. Images are decoded
+# on a process pool and classified in batches; the report is printed as JSON:
+# accuracy, top-k accuracy, per-class confusion matrix / precision / recall, latency and throughput.
+#
+#   python test.py                                  # whole default tree, final_model.pt
+#   python test.py --split test --backend int8      # held-out test split, INT8 artifact
+#   python test.py path/to/leaf.jpg                 # single image
+
+saved_models_dir = "L:/Plant Disease App/Classification_Model/saved_models"
+root_folder = "L:\\Plant Disease App\\Classification_Model\\Images Dataset of plants"
+compiled_dataset_dir = "L:/Plant Disease App/Classification_Model/compiled_dataset"
+
+
+def collect_images(paths, split):
+    """(image paths, labels or None) for the given files / directory trees."""
+    if split == "test":
+        # The held-out split FineTuning.py never trained on
+        if not is_compiled(compiled_dataset_dir):
+            raise SystemExit(f"--split test needs the compiled dataset in {compiled_dataset_dir} (run dataset_cache.py).")
+        return held_out_test_split(compiled_dataset_dir)
+
+    image_paths, labels = [], []
+    for path in paths:
+        if os.path.isdir(path):
+            tree_paths, tree_labels = scan_image_tree(path)
+            image_paths += tree_paths
+            labels += tree_labels
+        elif path.endswith(IMAGE_EXTENSIONS):
+            image_paths.append(path)
+            labels.append(None)
+        else:
+            raise SystemExit(f"Not an image or directory: {path}")
+    return image_paths, labels
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else None
+
+
+def evaluate(predictor, image_paths, labels, label_mapping, details, batch_size=64, workers=None, top_k=5, draft=False):
+    index_to_label = {index: label for label, index in label_mapping.items()}
+    preprocessor = FastPreprocessor(details)
+    buffer = preprocessor.allocate_batch(batch_size)
 
-# Paths to the saved model file, test image, and label mapping JSON file
-model_path = "L:/Plant Disease App/Classification_Model/saved_models/final_model.pt"
-image_path = "L:\Plant Disease App\Classification_Model\Images Dataset of plants\Corn\Common_Rust_Corn\Corn_Common_Rust (1).jpg"  # Update with your test image path
-label_mapping_path = "L:/Plant Disease App/Classification_Model/saved_models/label_mapping.json"
-
-# Define the model architecture with the same number of labels as used during training
-model = ViTForImageClassification.from_pretrained("google/vit-base-patch16-224-in21k", num_labels=65)
-model.load_state_dict(torch.load(model_path, map_location=torch.device('cpu')), strict=False)
-model.eval()  # Set the model to evaluation mode
-
-# Define the transformations applied to test images
-transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-])
-
-# Load label mapping from JSON file
-with open(label_mapping_path, "r") as f:
-    label_mapping = json.load(f)
-
-# Reverse the mapping to create a dictionary mapping index to disease name
-index_to_label_mapping = {v: k for k, v in label_mapping.items()}
-
-# Function to classify the disease from an image
-def classify_disease(image_path: str):
-    # Load and preprocess the image
-    image = Image.open(image_path).convert("RGB")
-    input_tensor = transform(image).unsqueeze(0)  # Add batch dimension
-
-    # Run inference
+    predictions = []
+    batch_latencies = []
+    corrupted = []
+    batch_images, batch_labels, batch_paths = [], [], []
+    top_k_hits = 0
+    labelled = 0
+
+    def run_batch():
+        nonlocal top_k_hits, labelled
+        pixel_values = preprocessor.normalize_batch(batch_images, out=buffer)
+        started = time.perf_counter()
+        with torch.no_grad():
+            logits = predictor(pixel_values)
+        batch_latencies.append(time.perf_counter() - started)
+
+        top = logits.topk(min(top_k, logits.shape[1]), dim=1).indices.tolist()
+        for path, label, candidates in zip(batch_paths, batch_labels, top):
+            predicted = index_to_label.get(candidates[0], "Unknown Disease")
+            predictions.append({"path": path, "label": label, "predicted": predicted})
+            if label is not None:
+                labelled += 1
+                top_k_hits += label_mapping[label] in candidates
+        batch_images.clear()
+        batch_labels.clear()
+        batch_paths.clear()
+
+    started = time.perf_counter()
+    for label, (path, image) in zip(labels, iter_decoded(image_paths, details, workers, draft=draft)):
+        if image is None:
+            corrupted.append(path)
+            continue
+        batch_images.append(torch.from_numpy(image))
+        batch_labels.append(label)
+        batch_paths.append(path)
+        if len(batch_images) == batch_size:
+            run_batch()
+    if batch_images:
+        run_batch()
+    total_seconds = time.perf_counter() - started
+
+    # Single-image latency, as seen by one /classify request
+    single = []
+    sample = buffer[:1].clone()
     with torch.no_grad():
-        outputs = model(input_tensor)
-        logits = outputs.logits
-        predicted_label = logits.argmax(dim=1).item()  # Get the predicted label index
-        print(f"Predicted label index: {predicted_label}")  # Debugging line
+        predictor(sample)
+        for _ in range(20):
+            t = time.perf_counter()
+            predictor(sample)
+            single.append(time.perf_counter() - t)
+
+    report = {
+        "images": len(predictions),
+        "corrupted": corrupted,
+        "latency": {
+            "single_image_ms_p50": percentile(single, 0.5) * 1000.0,
+            "batch_ms_p50": percentile(batch_latencies, 0.5) * 1000.0 if batch_latencies else None,
+            "batch_ms_p95": percentile(batch_latencies, 0.95) * 1000.0 if batch_latencies else None,
+            "batch_size": batch_size,
+        },
+        "throughput": {
+            "inference_images_per_sec": len(predictions) / sum(batch_latencies) if batch_latencies else None,
+            "end_to_end_images_per_sec": len(predictions) / total_seconds if total_seconds else None,
+        },
+    }
+
+    if labelled:
+        confusion = {}
+        for item in predictions:
+            if item["label"] is not None:
+                row = confusion.setdefault(item["label"], {})
+                row[item["predicted"]] = row.get(item["predicted"], 0) + 1
+        correct = sum(confusion[label].get(label, 0) for label in confusion)
+        per_class = {}
+        for label in sorted(confusion):
+            true_positives = confusion[label].get(label, 0)
+            predicted_as = sum(row.get(label, 0) for row in confusion.values())
+            per_class[label] = {
+                "support": sum(confusion[label].values()),
+                "recall": true_positives / sum(confusion[label].values()),
+                "precision": true_positives / predicted_as if predicted_as else 0.0,
+            }
+        report.update({
+            "accuracy": correct / labelled,
+            f"top_{top_k}_accuracy": top_k_hits / labelled,
+            "per_class": per_class,
+            "confusion_matrix": {label: confusion[label] for label in sorted(confusion)},
+        })
+    else:
+        report["predictions"] = [{"path": item["path"], "predicted": item["predicted"]} for item in predictions]
+    return report
 
-    # Check if the predicted label exists in the reversed mapping
-    disease_name = index_to_label_mapping.get(predicted_label, "Unknown Disease")
 
-    return disease_name
+def parse_args():
+    parser = argparse.ArgumentParser(description="Batch-evaluate a plant disease classifier on an image tree or single images.")
+    parser.add_argument("paths", nargs="*", default=[root_folder], help="Image files and/or <plant>/<disease>/<image> trees")
+    parser.add_argument("--split", choices=["all", "test"], default="all",
+                        help="'test' evaluates the held-out split of the compiled training dataset")
+    parser.add_argument("--backend", choices=list(CLASSIFIER_BACKENDS), default="torch")
+    parser.add_argument("--checkpoint", default=None, help="Defaults to the backend's artifact in saved_models")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=None, help="Decoding processes (default: one per CPU)")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--draft", action="store_true", help="Decode JPEGs in draft mode, exactly like Backend.py")
+    parser.add_argument("--output", default=None, help="Also write the JSON report to this file")
+    return parser.parse_args()
+
 
-# Call the classify_disease function and print the result
 if __name__ == "__main__":
-    disease_name = classify_disease(image_path)
-    print(f"Predicted disease: {disease_name}")
+    args = parse_args()
+    with open(os.path.join(saved_models_dir, "label_mapping.json"), "r") as f:
+        label_mapping = json.load(f)
+    details = load_transform_details(os.path.join(saved_models_dir, "transform_details.json"))
+
+    image_paths, labels = collect_images(args.paths, args.split)
+    unknown = sorted({label for label in labels if label is not None and label not in label_mapping})
+    if unknown:
+        raise SystemExit(f"Labels not in label_mapping.json: {', '.join(unknown)}")
+    if not image_paths:
+        raise SystemExit("No images found.")
+
+    # Strict loading: a checkpoint that doesn't match the architecture raises instead of
+    # silently leaving layers randomly initialized
+    checkpoint = args.checkpoint or os.path.join(saved_models_dir, CLASSIFIER_BACKENDS[args.backend][1])
+    predictor = load_predictor(args.backend, checkpoint, os.path.join(saved_models_dir, "vit_config.json"), len(label_mapping))
+
+    report = evaluate(predictor, image_paths, labels, label_mapping, details,
+                      batch_size=args.batch_size, workers=args.workers, top_k=args.top_k, draft=args.draft)
+    report = {"checkpoint": checkpoint, "backend": args.backend, **report}
+
+    print(json.dumps(report, indent=4))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
@@ -0,0 +1,115 @@
+import time
+import contextlib
+import torch
+from torch.utils.data import DataLoader
+
+# Training/evaluation loops shared by the fine-tuning scripts. Metrics are accumulated
+# as tensors on the device and only read back (a host sync) every `log_every` steps.
+
+PRECISIONS = {"fp32": None, "bf16": torch.bfloat16}
+
+
+def build_loader(dataset, batch_size, shuffle, num_workers=0, prefetch_factor=2, device=None, collate_fn=None,
+                 sampler=None):
+    """DataLoader with persistent, prefetching workers, and pinned memory when training on a GPU."""
+    options = {}
+    if num_workers > 0:
+        options = {"persistent_workers": True, "prefetch_factor": prefetch_factor}
+    return DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=shuffle and sampler is None,
+        sampler=sampler,
+        num_workers=num_workers,
+        pin_memory=device is not None and device.type == "cuda",
+        collate_fn=collate_fn,
+        **options
+    )
+
+def autocast(device, precision):
+    """bfloat16 autocast (CPU or GPU) for 'bf16'; a no-op for 'fp32'."""
+    if PRECISIONS[precision] is None:
+        return contextlib.nullcontext()
+    return torch.autocast(device_type=device.type, dtype=PRECISIONS[precision])
+
+
+def train_one_epoch(model, loader, optimizer, loss_fn, device, precision="fp32", accumulation_steps=1,
+                    log_every=50, header="", on_optimizer_step=None, teacher=None):
+    """
+    One pass over `loader`. Gradients are accumulated over `accumulation_steps` batches
+    before each optimizer step (effective batch = batch size * accumulation_steps).
+    `on_optimizer_step(images_done)` is called after every optimizer step, e.g. to checkpoint.
+    With a `teacher`, its logits are passed as a third argument to `loss_fn` (distillation).
+    Returns loss, accuracy, image counts and throughput in images/sec.
+    """
+    model.train()
+    running_loss = torch.zeros((), device=device)
+    correct = torch.zeros((), dtype=torch.long, device=device)
+    augmented = torch.zeros((), dtype=torch.long)
+    total = 0
+    num_batches = len(loader)
+
+    optimizer.zero_grad(set_to_none=True)
+    started = time.perf_counter()
+    for i, (pixel_values, labels, augmented_flags) in enumerate(loader):
+        pixel_values = pixel_values.to(device, non_blocking=True)
+        labels = labels.to(device, non_blocking=True)
+
+        with autocast(device, precision):
+            logits = model(pixel_values).logits
+            if teacher is None:
+                loss = loss_fn(logits.float(), labels)
+            else:
+                with torch.no_grad():
+                    teacher_logits = teacher(pixel_values).logits
+                loss = loss_fn(logits.float(), labels, teacher_logits.float())
+        (loss / accumulation_steps).backward()
+
+        running_loss += loss.detach() * labels.size(0)
+        correct += (logits.argmax(dim=1) == labels).sum()
+        augmented += augmented_flags.sum()
+        total += labels.size(0)
+
+        if (i + 1) % accumulation_steps == 0 or i + 1 == num_batches:
+            optimizer.step()
+            optimizer.zero_grad(set_to_none=True)
+            if on_optimizer_step is not None:
+                on_optimizer_step(total)
+
+        if log_every and (i + 1) % log_every == 0:
+            print(f"{header}Batch {i+1}/{num_batches}, Loss: {running_loss.item() / total:.4f}, "
+                  f"Accuracy: {correct.item() / total:.4f}")
+
+    # The .item() calls wait for the device, so the elapsed time covers all queued work
+    epoch_loss = running_loss.item() / total
+    epoch_accuracy = correct.item() / total
+    seconds = time.perf_counter() - started
+    return {
+        "loss": epoch_loss,
+        "accuracy": epoch_accuracy,
+        "images": total,
+        "augmented_images": int(augmented),
+        "seconds": seconds,
+        "images_per_sec": total / seconds,
+    }
+
+
+def evaluate_loader(model, loader, loss_fn, device, precision="fp32"):
+    """Loss and accuracy of `model` over `loader`, with one host sync at the end."""
+    model.eval()
+    total_loss = torch.zeros((), device=device)
+    correct = torch.zeros((), dtype=torch.long, device=device)
+    total = 0
+    started = time.perf_counter()
+    with torch.no_grad(), autocast(device, precision):
+        for pixel_values, labels, _ in loader:
+            pixel_values = pixel_values.to(device, non_blocking=True)
+            labels = labels.to(device, non_blocking=True)
+            logits = model(pixel_values).logits.float()
+            total_loss += loss_fn(logits, labels) * labels.size(0)
+            correct += (logits.argmax(dim=1) == labels).sum()
+            total += labels.size(0)
+    loss = total_loss.item() / total
+    accuracy = correct.item() / total
+    seconds = time.perf_counter() - started
+    return {"loss": loss, "accuracy": accuracy, "images": total, "images_per_sec": total / seconds}
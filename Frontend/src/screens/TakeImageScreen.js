@@ -146,7 +146,17 @@ export default function TakeImageScreen() {
         saveToDatabase();
       } else {
         console.error("Server error:", serverResponse.statusText, serverResponse.status);
-        setResponseData("Failed to classify image. Please try again.");
+        // Backend errors arrive as {"error": "..."}, e.g. an unsupported image or an oversized upload
+        let errorMessage = "Failed to classify image. Please try again.";
+        try {
+          const errorResponse = await serverResponse.json();
+          if (errorResponse && errorResponse.error) {
+            errorMessage = errorResponse.error;
+          }
+        } catch (parseError) {
+          console.error("Could not parse the error response:", parseError);
+        }
+        setResponseData(errorMessage);
         setModalVisible(true);
       }
     } catch (error) {
@@ -164,6 +174,16 @@ export default function TakeImageScreen() {
     return blob;
   };
 
+  // Top-k predictions arrive as [{disease_name, probability}, ...]
+  const formatDetailValue = (value) => {
+    if (Array.isArray(value)) {
+      return value
+        .map(item => `${item.disease_name} (${(item.probability * 100).toFixed(1)}%)`)
+        .join("\n");
+    }
+    return value;
+  };
+
   const renderResponseDetails = () => {
     try {
       const parsedData = typeof responseData === 'string' ? JSON.parse(responseData) : responseData;
@@ -173,7 +193,7 @@ export default function TakeImageScreen() {
       return Object.entries(parsedData).map(([key, value], index) => (
         <View key={index} style={styles.detailItem}>
           <Text style={styles.detailLabel}>{key}:</Text>
-          <Text style={styles.detailValue}>{value}</Text>
+          <Text style={styles.detailValue}>{formatDetailValue(value)}</Text>
         </View>
       ));
     } catch (error) {
@@ -0,0 +1,487 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import socket
+import platform
+import tempfile
+import subprocess
+import threading
+import itertools
+
+import numpy as np
+import psutil
+import torch
+import httpx
+import uvicorn
+from PIL import Image, ImageDraw
+
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+from fake_providers import PROFILES, FakeOllamaEmbeddings, fake_completion_tokens, install_fake_providers
+from pipeline_metrics import stage_observers
+
+# Offline benchmarks for Backend.py. The backend is served by uvicorn on a loopback port
+# from this process, with Replicate and OpenAI replaced by the local fakes in
+# fake_providers.py, so runs cost nothing and are repeatable. Results are written as JSON
+# and can be diffed across commits.
+#
+#   python benchmark.py load --rps 20 --duration 60 --output load.json     # /classify at a fixed request rate
+#   python benchmark.py micro --output micro.json                          # preprocessing, ViT forward pass, retrieval
+#   python benchmark.py compare baseline.json load.json                    # what got slower or faster
+
+
+def synthetic_leaf(seed: int, size=(1280, 960)) -> bytes:
+    """A JPEG of a leaf-like ellipse with lesion spots on a soil background, different for every seed."""
+    rng = random.Random(seed)
+    width, height = size
+    image = Image.new("RGB", size, (rng.randint(60, 110), rng.randint(45, 80), rng.randint(25, 50)))
+    draw = ImageDraw.Draw(image)
+    leaf_color = (rng.randint(30, 90), rng.randint(110, 190), rng.randint(20, 70))
+    draw.ellipse([width * 0.15, height * 0.1, width * 0.85, height * 0.9], fill=leaf_color)
+    for _ in range(rng.randint(5, 40)):
+        x, y = rng.uniform(0.25, 0.75) * width, rng.uniform(0.2, 0.8) * height
+        r = rng.uniform(0.005, 0.03) * width
+        draw.ellipse([x - r, y - r, x + r, y + r], fill=(rng.randint(90, 200), rng.randint(60, 160), rng.randint(0, 40)))
+    # Sensor-like noise so JPEG sizes and decode times resemble real photos
+    pixels = np.asarray(image, dtype=np.int16) + np.random.default_rng(seed).integers(-12, 13, (height, width, 3))
+    buffer = io.BytesIO()
+    Image.fromarray(pixels.clip(0, 255).astype(np.uint8)).save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def summarize(seconds) -> dict:
+    """Count, mean and p50/p95/p99/max in milliseconds."""
+    if not len(seconds):
+        return {"count": 0}
+    ms = np.asarray(seconds, dtype=np.float64) * 1000.0
+    return {
+        "count": int(ms.size),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+
+def time_call(fn, runs: int, warmup: int = 3) -> dict:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+
+class MemorySampler:
+    """Samples this process's resident set size on a background thread."""
+    def __init__(self, interval_seconds: float = 0.1):
+        self.interval_seconds = interval_seconds
+        self.process = psutil.Process()
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        self.samples.append(self.process.memory_info().rss)
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            self._sample()
+
+    def start(self):
+        self._sample()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> dict:
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        mb = 1024 * 1024
+        return {
+            "rss_start_mb": self.samples[0] / mb,
+            "rss_peak_mb": max(self.samples) / mb,
+            "rss_end_mb": self.samples[-1] / mb,
+        }
+
+
+def environment_info() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "torch_threads": torch.get_num_threads(),
+        "cpu_count": os.cpu_count(),
+        "platform": platform.platform(),
+    }
+
+
+def import_backend(args):
+    """
+    Imports Backend.py configured for benchmarking and points it at the fake providers.
+    The advisory cache is disabled (zero TTL) unless asked for, so every request
+    exercises retrieval and the LLM stage instead of measuring cache hits.
+    """
+    if not args.advisory_cache:
+        os.environ["ADVISORY_CACHE_TTL_SECONDS"] = "0"
+    if args.classifier_backend:
+        os.environ["CLASSIFIER_BACKEND"] = args.classifier_backend
+    import Backend
+
+    fakes = install_fake_providers(Backend, PROFILES[args.replicate_profile], PROFILES[args.openai_profile])
+    return Backend, fakes
+
+
+async def send_request(client, args, image: bytes) -> dict:
+    params = {"model_name": args.model, "language": args.language, "confidence_threshold": args.confidence_threshold}
+    files = {"file": ("leaf.jpg", image, "image/jpeg")}
+    started = time.perf_counter()
+    result = {}
+    try:
+        if args.endpoint == "stream":
+            async with client.stream("POST", "/classify/stream", params=params, files=files) as response:
+                body = []
+                async for chunk in response.aiter_text():
+                    if not body:
+                        result["ttfb"] = time.perf_counter() - started
+                    body.append(chunk)
+            body = "".join(body)
+            result["status"] = response.status_code
+            if "event: done" in body:
+                result["outcome"] = "advisory"
+            elif "event: uncertain" in body:
+                result["outcome"] = "uncertain"
+            else:
+                result["outcome"] = "error"
+        else:
+            response = await client.post("/classify", params=params, files=files)
+            payload = response.json()
+            result["status"] = response.status_code
+            if "error" in payload:
+                result["outcome"] = "error"
+            elif payload.get("status") == "uncertain":
+                result["outcome"] = "uncertain"
+            else:
+                result["outcome"] = "advisory"
+    except Exception as e:
+        result.update(status="exception", outcome=type(e).__name__)
+    result["latency"] = time.perf_counter() - started
+    return result
+
+
+class BackgroundServer:
+    """Serves the app with uvicorn on its own thread and event loop, like `python Backend.py` would."""
+    def __init__(self, app, port: int = 0):
+        if not port:
+            with socket.socket() as probe:
+                probe.bind(("127.0.0.1", 0))
+                port = probe.getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            if not self.thread.is_alive():
+                raise RuntimeError("The benchmark server failed to start.")
+            time.sleep(0.05)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+async def run_load(backend, fakes, args) -> dict:
+    """
+    Open-loop load: request i is sent at start + i / rps whether or not earlier requests
+    have finished, like independent users, so a slow server shows up as growing latency
+    instead of a lower request rate. `schedule_lag` shows when the client itself fell behind.
+    """
+    total = int(args.rps * args.duration)
+    pool_size = args.image_pool or total + args.warmup
+    print(f"Generating {pool_size} synthetic leaf images...")
+    images = [synthetic_leaf(seed, (args.image_width, args.image_height)) for seed in range(pool_size)]
+
+    stage_samples = {}
+
+    def observe(name, seconds):
+        stage_samples.setdefault(name, []).append(seconds)
+
+    memory = MemorySampler()
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    with BackgroundServer(backend.app, args.port) as server:
+        async with httpx.AsyncClient(base_url=server.url, timeout=None, limits=limits) as client:
+            for i in range(args.warmup):
+                await send_request(client, args, images[i % pool_size])
+
+            stage_observers.append(observe)
+            loop = asyncio.get_running_loop()
+            limit = asyncio.Semaphore(args.max_concurrency) if args.max_concurrency else None
+            lags = []
+
+            async def scheduled(i, due):
+                lags.append(loop.time() - due)
+                image = images[(args.warmup + i) % pool_size]
+                if limit is None:
+                    return await send_request(client, args, image)
+                async with limit:
+                    return await send_request(client, args, image)
+
+            print(f"Sending {total} requests at {args.rps} req/s to /classify{'/stream' if args.endpoint == 'stream' else ''}...")
+            memory.start()
+            start = loop.time()
+            tasks = []
+            for i in range(total):
+                due = start + i / args.rps
+                await asyncio.sleep(max(0.0, due - loop.time()))
+                tasks.append(asyncio.create_task(scheduled(i, due)))
+            results = await asyncio.gather(*tasks)
+            elapsed = loop.time() - start
+            memory_report = memory.stop()
+            stage_observers.remove(observe)
+
+    statuses, outcomes = {}, {}
+    for result in results:
+        statuses[str(result["status"])] = statuses.get(str(result["status"]), 0) + 1
+        outcomes[result["outcome"]] = outcomes.get(result["outcome"], 0) + 1
+
+    report = {
+        "benchmark": "load",
+        "environment": environment_info(),
+        "config": {
+            "endpoint": args.endpoint,
+            "model": args.model,
+            "language": args.language,
+            "target_rps": args.rps,
+            "duration_seconds": args.duration,
+            "max_concurrency": args.max_concurrency,
+            "image_size": [args.image_width, args.image_height],
+            "distinct_images": min(pool_size, total),
+            "advisory_cache": args.advisory_cache,
+            "classifier_backend": backend.model_registry.backend,
+            "replicate_profile": {"name": args.replicate_profile, **PROFILES[args.replicate_profile].describe()},
+            "openai_profile": {"name": args.openai_profile, **PROFILES[args.openai_profile].describe()},
+        },
+        "requests": {"sent": total, "statuses": statuses, "outcomes": outcomes},
+        "throughput": {
+            "achieved_rps": total / elapsed,
+            "advisories_per_sec": outcomes.get("advisory", 0) / elapsed,
+        },
+        "latency": summarize([result["latency"] for result in results]),
+        "stages": {name: summarize(samples) for name, samples in sorted(stage_samples.items())},
+        "schedule_lag": summarize(lags),
+        "memory": memory_report,
+        "server": {
+            "batching": backend.batching_classifier.metrics(),
+            "prediction_cache": backend.prediction_cache.metrics(),
+            "advisory_cache": backend.advisory_cache.metrics(),
+        },
+        "provider_calls": {name: fake.calls for name, fake in fakes.items()},
+    }
+    if args.endpoint == "stream":
+        report["time_to_first_byte"] = summarize([result["ttfb"] for result in results if "ttfb" in result])
+    return report
+
+
+def run_micro(backend, args) -> dict:
+    """Single-threaded timings of the CPU-bound pieces of one request, without the HTTP layer."""
+    memory = MemorySampler()
+    memory.start()
+    transform = backend.transform
+    report = {"benchmark": "micro", "environment": environment_info(), "preprocessing": {}, "vit_forward": {}}
+
+    # Preprocessing: decode (JPEG draft mode), resize to 224x224, normalize a batch
+    for width, height in ((640, 480), (1280, 960), (4032, 3024)):
+        data = synthetic_leaf(width, (width, height))
+        image = transform.decode(data)
+        report["preprocessing"][f"{width}x{height}"] = {
+            "jpeg_kb": len(data) / 1024,
+            "decode": time_call(lambda: transform.decode(data), args.runs),
+            "resize": time_call(lambda: transform.resize(image), args.runs),
+            "decode_and_resize": time_call(lambda: transform.preprocess_bytes(data), args.runs),
+        }
+    resized = [transform.resize(transform.decode(synthetic_leaf(seed, (640, 480)))) for seed in range(16)]
+    buffer = transform.allocate_batch(16)
+    report["preprocessing"]["normalize_batch_16"] = time_call(lambda: transform.normalize_batch(resized, out=buffer), args.runs)
+
+    # ViT forward pass through the configured inference backend
+    started = time.perf_counter()
+    backend.load_classification_model()
+    report["vit_forward"]["backend"] = backend.model_registry.backend
+    report["vit_forward"]["load_seconds"] = time.perf_counter() - started
+    for batch_size in args.batch_sizes:
+        batch = transform.normalize_batch(resized[:1] * batch_size)
+        timing = time_call(lambda: backend.predict_logits(batch), max(5, args.runs // batch_size))
+        timing["images_per_sec"] = batch_size * 1000.0 / timing["p50_ms"]
+        report["vit_forward"][f"batch_{batch_size}"] = timing
+
+    # Retrieval: building the in-memory index, lookups in it, and the Chroma fallback it replaces
+    started = time.perf_counter()
+    backend.rebuild_disease_context_index()
+    labels = list(backend.label_mapping)
+    vector_store = backend.providers.get("llama2_vector_store")
+    collection = vector_store._collection
+    names = itertools.cycle(labels)
+    report["retrieval"] = {
+        "build_index_seconds": time.perf_counter() - started,
+        "index_lookup": time_call(
+            lambda: backend.search_documents_by_disease(vector_store, next(names), "llama2"), args.runs
+        ),
+        "chroma_metadata_query": time_call(
+            lambda: collection.get(where={"disease_name": next(names)}), min(args.runs, 50)
+        ),
+    }
+    chunks = collection.get(where={"disease_name": labels[0]})
+    report["retrieval"]["assemble_context"] = time_call(
+        lambda: backend.render_disease_context(chunks["documents"], chunks["metadatas"], "llama2"), min(args.runs, 50)
+    )
+
+    # Prompt construction and parsing of a full-length completion
+    context = backend.search_documents_by_disease(vector_store, labels[0], "llama2") or ""
+    prompt = backend.build_llm_prompt(labels[0], context)
+    completion = "".join(fake_completion_tokens(prompt, 300))
+    report["llm_text"] = {
+        "prompt_chars": len(prompt),
+        "build_prompt": time_call(lambda: backend.build_llm_prompt(labels[0], context), args.runs),
+        "parse_response": time_call(lambda: backend.parse_llm_response(completion, labels[0]), args.runs),
+    }
+
+    # Ingestion-side embedding through the shared cache, with the Ollama stand-in
+    with tempfile.TemporaryDirectory() as directory:
+        cache = EmbeddingCache(os.path.join(directory, "embeddings.sqlite3"))
+        embeddings = CachedEmbeddings(FakeOllamaEmbeddings(PROFILES[args.ollama_profile]), cache, "fake-ollama")
+        texts = [f"chunk {i} of the knowledge base" for i in range(256)]
+        started = time.perf_counter()
+        embeddings.embed_documents(texts)
+        cold = time.perf_counter() - started
+        report["embedding_cache"] = {
+            "texts": len(texts),
+            "ollama_profile": args.ollama_profile,
+            "cold_ms": cold * 1000.0,
+            "warm": time_call(lambda: embeddings.embed_documents(texts), 10, warmup=0),
+        }
+        cache.db.close()
+
+    report["memory"] = memory.stop()
+    return report
+
+
+def flatten(report, prefix="") -> dict:
+    values = {}
+    for key, value in report.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            values.update(flatten(value, path + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[path] = value
+    return values
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list:
+    """
+    Rows of (metric, baseline, current, change %, regressed) for every numeric metric in
+    both reports. Latencies, memory and durations regress when they grow by more than
+    `threshold` percent, throughputs when they shrink by more than that.
+    """
+    old, new = flatten(baseline), flatten(current)
+    rows = []
+    for key in sorted(old.keys() & new.keys()):
+        if old[key] == 0:
+            continue
+        change = (new[key] - old[key]) / abs(old[key]) * 100.0
+        if key.endswith(("_ms", "_seconds", "_mb")):
+            regressed = change > threshold
+        elif key.endswith(("per_sec", "_rps")):
+            regressed = change < -threshold
+        else:
+            regressed = False
+        rows.append((key, old[key], new[key], change, regressed))
+    return rows
+
+
+def write_report(report: dict, output: str):
+    print(json.dumps(report, indent=4))
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=4)
+        print(f"Report written to {output}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline load tests and microbenchmarks for Backend.py.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def backend_options(command):
+        command.add_argument("--classifier-backend", default=None, help="CLASSIFIER_BACKEND to benchmark (default: Backend.py's)")
+        command.add_argument("--replicate-profile", choices=list(PROFILES), default="replicate-llama2-70b")
+        command.add_argument("--openai-profile", choices=list(PROFILES), default="openai-gpt-3.5-turbo")
+        command.add_argument("--advisory-cache", action="store_true", help="Keep the advisory cache on (off by default)")
+        command.add_argument("--output", default=None, help="Also write the JSON report to this file")
+
+    load = commands.add_parser("load", help="Drive /classify at a fixed request rate")
+    backend_options(load)
+    load.add_argument("--endpoint", choices=["classify", "stream"], default="classify")
+    load.add_argument("--rps", type=float, default=10.0)
+    load.add_argument("--duration", type=float, default=30.0, help="Seconds of load")
+    load.add_argument("--max-concurrency", type=int, default=0, help="Cap on in-flight requests (0: none)")
+    load.add_argument("--warmup", type=int, default=5, help="Requests sent before measuring")
+    load.add_argument("--model", choices=["llama2", "gpt-3.5-turbo"], default="llama2")
+    load.add_argument("--language", choices=["english", "urdu"], default="english")
+    load.add_argument("--confidence-threshold", type=float, default=0.0,
+                      help="Sent with every request; 0 makes every synthetic image reach the LLM stage")
+    load.add_argument("--image-pool", type=int, default=0,
+                      help="Distinct images to cycle through (0: a new one per request, so no prediction cache hits)")
+    load.add_argument("--image-width", type=int, default=1280)
+    load.add_argument("--image-height", type=int, default=960)
+    load.add_argument("--port", type=int, default=0, help="Loopback port for the server (0: any free port)")
+
+    micro = commands.add_parser("micro", help="Time preprocessing, the ViT forward pass and retrieval")
+    backend_options(micro)
+    micro.add_argument("--runs", type=int, default=100)
+    micro.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 16])
+    micro.add_argument("--ollama-profile", choices=list(PROFILES), default="instant")
+
+    diff = commands.add_parser("compare", help="Compare two JSON reports")
+    diff.add_argument("baseline")
+    diff.add_argument("current")
+    diff.add_argument("--threshold", type=float, default=10.0, help="Percent change that counts as a regression")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.command == "compare":
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        with open(args.current, "r") as f:
+            current = json.load(f)
+        rows = compare(baseline, current, args.threshold)
+        for key, old, new, change, regressed in rows:
+            print(f"{'REGRESSED ' if regressed else '          '}{key:<60} {old:>12.3f} -> {new:>12.3f} ({change:+.1f}%)")
+        regressions = sum(row[4] for row in rows)
+        print(f"{regressions} regression(s) beyond {args.threshold:.0f}%.")
+        sys.exit(1 if regressions else 0)
+
+    backend, fakes = import_backend(args)
+    if args.command == "load":
+        write_report(asyncio.run(run_load(backend, fakes, args)), args.output)
+    else:
+        write_report(run_micro(backend, args), args.output)
@@ -0,0 +1,208 @@
+import os
+import re
+import math
+from collections import Counter
+from typing import List
+
+# Builds the "Retrieved Information" block of the advisory prompt from the chunks stored
+# for one disease. Chunks are split into passages (a heading plus the paragraph under it),
+# passages that repeat or overlap earlier ones are dropped, and the rest are ranked by how
+# much they say about the four sections the prompt asks for. The best passages are kept
+# until the model's token budget is used up and are emitted in their original order.
+
+# Word stems that mark a passage as useful for each section of DiseaseResponse
+SECTION_KEYWORDS = {
+    "symptoms": (
+        "symptom", "sign", "spot", "lesion", "yellow", "brown", "black", "wilt", "curl", "discolor", "necro",
+        "chloro", "blotch", "ring", "canker", "mold", "mould", "mildew", "powder", "ooz", "stunt", "dieback",
+        "blight", "rotten", "decay", "margin", "underside", "identify",
+    ),
+    "causes": (
+        "cause", "pathogen", "fung", "bacteri", "virus", "viral", "oomycete", "spore", "sporang", "infect",
+        "spread", "transmit", "overwinter", "favor", "favour", "humid", "moist", "wet", "temperature", "weather",
+        "vector", "host", "lifecycle", "life cycle", "survive", "rain", "splash",
+    ),
+    "recommended_solutions": (
+        "manage", "control", "prevent", "remov", "prun", "destroy", "sanit", "rotat", "resistant", "resistance",
+        "irrigat", "drain", "spacing", "mulch", "clean", "burn", "avoid", "cultur", "monitor", "practice",
+        "debris", "weed", "ventilat", "tolerant", "certified",
+    ),
+    "pesticide_recommendations": (
+        "fungicide", "pesticide", "insecticide", "bactericide", "spray", "appl", "copper", "mancozeb",
+        "chlorothalonil", "captan", "myclobutanil", "sulfur", "sulphur", "neem", "azoxystrobin", "propiconazole",
+        "thiophanate", "streptomycin", "tebuconazole", "difenoconazole", "metalaxyl", "dose", "dosage",
+        "label", "interval", "active ingredient", "chemical",
+    ),
+}
+_SECTION_PATTERNS = {
+    section: re.compile(r"\b(?:" + "|".join(re.escape(stem) for stem in stems) + r")", re.IGNORECASE)
+    for section, stems in SECTION_KEYWORDS.items()
+}
+
+# Chunk metadata worth showing the LLM; ids, chunk indexes and the disease name (already
+# in the prompt) are left out
+USEFUL_METADATA = ("plant",)
+
+SHINGLE_SIZE = 5
+DUPLICATE_OVERLAP = 0.8
+# Below this many tokens a truncated passage isn't worth including
+MIN_PASSAGE_TOKENS = 24
+
+
+def approximate_token_count(text: str) -> int:
+    """
+    Tokenizer-free estimate that errs on the high side for BPE tokenizers: one token per
+    punctuation mark, one per 4 characters of ASCII words, and one per character of other
+    scripts (e.g. Urdu).
+    """
+    count = 0
+    for piece in re.findall(r"\w+|[^\w\s]", text):
+        if not piece[0].isalnum() and piece[0] != "_":
+            count += 1
+        elif piece.isascii():
+            count += math.ceil(len(piece) / 4)
+        else:
+            count += len(piece)
+    return count
+
+
+class TokenCounter:
+    """
+    Counts tokens locally: with a `tokenizers` tokenizer file (e.g. the tokenizer.json of
+    the model) when one is given and exists, else with `approximate_token_count`.
+    """
+    def __init__(self, tokenizer_file: str = None):
+        self.tokenizer = None
+        if tokenizer_file and os.path.exists(tokenizer_file):
+            from tokenizers import Tokenizer
+
+            self.tokenizer = Tokenizer.from_file(tokenizer_file)
+
+    @property
+    def exact(self) -> bool:
+        return self.tokenizer is not None
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+        return approximate_token_count(text)
+
+
+def split_passages(document: str) -> List[str]:
+    """
+    Splits a chunk into passages at line breaks. Short lines without sentence-ending
+    punctuation (headings like 'Symptoms and Signs' or 'Usage Instructions:') are kept
+    with the line that follows them.
+    """
+    passages = []
+    heading = []
+    for line in document.splitlines():
+        line = " ".join(line.split())
+        if not line:
+            continue
+        if len(line.split()) < 8 and not line.endswith((".", ";", "!", "?")):
+            heading.append(line)
+            continue
+        passages.append("\n".join(heading + [line]))
+        heading = []
+    if heading:
+        passages.append("\n".join(heading))
+    return passages
+
+
+def _words(text: str) -> List[str]:
+    return re.findall(r"\w+", text.lower())
+
+def _shingles(words: List[str]) -> set:
+    return {tuple(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def deduplicate_passages(passages: List[str]) -> List[str]:
+    """
+    Drops passages that repeat an earlier one: identical after normalizing case and
+    whitespace, or with most of their word 5-grams already seen (overlapping chunks).
+    """
+    kept = []
+    seen_texts = set()
+    seen_shingles = set()
+    for passage in passages:
+        words = _words(passage)
+        normalized = " ".join(words)
+        if not normalized or normalized in seen_texts:
+            continue
+        shingles = _shingles(words)
+        if shingles and len(shingles & seen_shingles) >= DUPLICATE_OVERLAP * len(shingles):
+            continue
+        kept.append(passage)
+        seen_texts.add(normalized)
+        seen_shingles |= shingles
+    return kept
+
+
+def section_hits(text: str) -> Counter:
+    """Keyword hits per advisory section."""
+    return Counter({section: len(pattern.findall(text)) for section, pattern in _SECTION_PATTERNS.items()})
+
+
+def truncate_to_tokens(text: str, max_tokens: int, counter: TokenCounter) -> str:
+    """The longest prefix of whole sentences of `text` within `max_tokens` (may be empty)."""
+    kept = ""
+    for sentence in re.split(r"(?<=[.!?])\s+", text):
+        candidate = f"{kept} {sentence}".strip()
+        if counter.count(candidate) > max_tokens:
+            break
+        kept = candidate
+    return kept
+
+
+def select_passages(passages: List[str], token_budget: int, counter: TokenCounter) -> List[str]:
+    """
+    Greedy selection under the token budget. The next passage is the one adding the most
+    keyword evidence for sections that are still thinly covered; passages that don't fit
+    are cut at a sentence boundary if a useful part fits, else skipped. Passages with no
+    section keywords only fill what budget is left. Returned in original order.
+    """
+    hits = [section_hits(passage) for passage in passages]
+    tokens = [counter.count(passage) for passage in passages]
+    covered = Counter()
+    remaining = token_budget
+    chosen = {}
+    candidates = set(range(len(passages)))
+
+    def gain(i):
+        return sum(min(count, 3) / (1 + covered[section]) for section, count in hits[i].items())
+
+    while candidates and remaining > 0:
+        best = max(candidates, key=lambda i: (gain(i), -i))
+        candidates.discard(best)
+        text = passages[best]
+        if tokens[best] > remaining:
+            if remaining < MIN_PASSAGE_TOKENS:
+                continue
+            text = truncate_to_tokens(text, remaining, counter)
+            if counter.count(text) < MIN_PASSAGE_TOKENS:
+                continue
+        chosen[best] = text
+        remaining -= counter.count(text) + 1
+        for section, count in hits[best].items():
+            covered[section] += min(count, 3)
+    return [chosen[i] for i in sorted(chosen)]
+
+
+def build_context(documents: List[str], metadatas: List[dict], token_budget: int, counter: TokenCounter) -> str:
+    """
+    The context block for one disease from its chunks (in chunk order) and their
+    metadata, within `token_budget` tokens as counted by `counter`.
+    """
+    header_lines = []
+    for key in USEFUL_METADATA:
+        values = sorted({str(metadata[key]) for metadata in metadatas if metadata and metadata.get(key)})
+        if values:
+            header_lines.append(f"{key.capitalize()}: {', '.join(values)}")
+    header = "\n".join(header_lines)
+
+    passages = deduplicate_passages([passage for document in documents for passage in split_passages(document or "")])
+    selected = select_passages(passages, token_budget - counter.count(header), counter)
+    return "\n".join(([header] if header else []) + selected)
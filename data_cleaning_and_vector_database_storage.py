@@ -1,14 +1,23 @@
 import json
-from langchain_core.documents import Document
+import os
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from langchain_ollama import OllamaEmbeddings
 from langchain_text_splitters import RecursiveJsonSplitter
 from fastapi.encoders import jsonable_encoder
-from pydantic import BaseModel, Field
-from langchain_chroma import Chroma
-from langchain.schema import Document
+from langchain.docstore.document import Document
 import chromadb
-import uuid
 
+from embedding_cache import CachedEmbeddings, EmbeddingCache, FakeEmbeddings
+
+
+DATA_FILE = "Plant Disease Management Dataset .json"
+CHROMA_PATH = "/Plant Disease App/plant_disease_data"
+COLLECTION_NAME = "plant_disease_documents"
+CHECKPOINT_FILE = "/Plant Disease App/plant_disease_data/ingestion_checkpoint.json"
+MANIFEST_FILE = "/Plant Disease App/plant_disease_data/ingestion_manifest.json"
+EMBEDDING_CACHE_DB = "/Plant Disease App/plant_disease_data/embedding_cache.sqlite3"
 
 
 def read_plant_disease_data(file_path, encoding="utf-8"):
@@ -31,104 +40,279 @@ def convert_to_langchain_documents(data_list):
                     document = Document(page_content=content, metadata=metadata)
                     langchain_documents[disease_name] = document
     return langchain_documents
-plant_data = read_plant_disease_data("Plant Disease Management Dataset .json")  
-langchain_docs = convert_to_langchain_documents(plant_data)
-        
-class Document(BaseModel):
-    """Interface for interacting with a document."""
-
-    metadata: dict = Field(default_factory=dict)
-    page_content: str
-
-    def __json__(self):
-        return {
-            "metadata": self.metadata,
-            "page_content": self.page_content
-        }
-    
-json_data = {}
-
-# Iterate through langchain_docs, where each value is a Document object
-for key, document in langchain_docs.items():
-    # Access the 'Disease Name' from the 'metadata' of the Document object
-    disease_name = document.metadata.get('disease_name')
-    
-    if disease_name:  # Only add if 'disease_name' exists
-        json_data[disease_name] = jsonable_encoder({
-            "metadata": document.metadata,
-            "page_content": document.page_content
-        })
-
-# Print the JSON data
-json_Plant_data = json.dumps(json_data, indent=4)
-print(json_Plant_data)
-loaded_json_data = json.loads(json_Plant_data)
-splitter = RecursiveJsonSplitter(max_chunk_size=500)
-json_chunks = splitter.split_json(json_data=loaded_json_data)
 
-from langchain.docstore.document import Document
-import uuid
-
-documents = []
-
-# Iterate over the elements in json_chunks (which is a list)
-for index, chunk in enumerate(json_chunks):
-    if isinstance(chunk, dict):
-        # Each chunk is a dictionary, so iterate through its keys and values
-        for disease_name, disease_data in chunk.items():
-            if "metadata" in disease_data and "page_content" in disease_data:
-                try:
-                    # Generate a unique ID and add it to the metadata
-                    unique_id = str(uuid.uuid4())
-                    metadata = disease_data["metadata"]
-                    metadata["id"] = unique_id  # Add the unique ID to the metadata
-
-                    # Create and append the Document object using the disease data
-                    documents.append(
-                        Document(
-                            page_content=disease_data["page_content"], 
-                            metadata=metadata  # Metadata now includes the unique ID
+def build_json_data(langchain_docs):
+    json_data = {}
+
+    # Iterate through langchain_docs, where each value is a Document object
+    for key, document in langchain_docs.items():
+        # Access the 'Disease Name' from the 'metadata' of the Document object
+        disease_name = document.metadata.get('disease_name')
+
+        if disease_name:  # Only add if 'disease_name' exists
+            json_data[disease_name] = jsonable_encoder({
+                "metadata": document.metadata,
+                "page_content": document.page_content
+            })
+    return json_data
+
+def chunk_id(disease_name, page_content):
+    """Content-addressed chunk id, so re-running ingestion never duplicates a chunk."""
+    return hashlib.sha256(f"{disease_name}\n{page_content}".encode("utf-8")).hexdigest()
+
+def split_into_documents(json_data, max_chunk_size=500):
+    splitter = RecursiveJsonSplitter(max_chunk_size=max_chunk_size)
+    json_chunks = splitter.split_json(json_data=json_data)
+
+    documents = []
+    seen_ids = set()
+    chunk_counts = {}
+
+    # Iterate over the elements in json_chunks (which is a list)
+    for index, chunk in enumerate(json_chunks):
+        if isinstance(chunk, dict):
+            # Each chunk is a dictionary, so iterate through its keys and values
+            for disease_name, disease_data in chunk.items():
+                if "metadata" in disease_data and "page_content" in disease_data:
+                    try:
+                        metadata = dict(disease_data["metadata"])
+                        unique_id = chunk_id(metadata["disease_name"], disease_data["page_content"])
+                        if unique_id in seen_ids:
+                            continue
+                        seen_ids.add(unique_id)
+
+                        # The content hash doubles as the Chroma id; chunk_index keeps the original order
+                        metadata["id"] = unique_id
+                        metadata["chunk_index"] = chunk_counts.get(metadata["disease_name"], 0)
+                        chunk_counts[metadata["disease_name"]] = metadata["chunk_index"] + 1
+
+                        documents.append(
+                            Document(
+                                page_content=disease_data["page_content"],
+                                metadata=metadata
+                            )
                         )
-                    )
-                except KeyError as e:
-                    print(f"KeyError: {e} in item at index {index}: {disease_data}")
-            else:
-                print(f"Missing keys in item at index {index}: {disease_data}")
-    else:
-        print(f"Expected dictionary in json_chunks at index {index}, but got {type(chunk)}.")
+                    except KeyError as e:
+                        print(f"KeyError: {e} in item at index {index}: {disease_data}")
+                else:
+                    print(f"Missing keys in item at index {index}: {disease_data}")
+        else:
+            print(f"Expected dictionary in json_chunks at index {index}, but got {type(chunk)}.")
+    return documents
+
+def load_checkpoint(checkpoint_path):
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        with open(checkpoint_path, "r") as f:
+            return set(json.load(f).get("completed_ids", []))
+    return set()
+
+def save_checkpoint(checkpoint_path, completed_ids):
+    if not checkpoint_path:
+        return
+    # Write to a temp file and rename so a crash never leaves a truncated checkpoint
+    tmp_path = checkpoint_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"completed_ids": sorted(completed_ids)}, f)
+    os.replace(tmp_path, checkpoint_path)
+
+def existing_ids(collection, ids, page_size=500):
+    """Returns the subset of `ids` that is already stored in the collection."""
+    found = set()
+    for start in range(0, len(ids), page_size):
+        found.update(collection.get(ids=ids[start:start + page_size], include=[])["ids"])
+    return found
+
+def stale_chunk_ids(collection, disease_names, new_ids):
+    """Ids stored for `disease_names` that are not among `new_ids` (outdated chunks, or uuid4 ids from older runs)."""
+    stale_ids = []
+    for disease_name in disease_names:
+        stored = collection.get(where={"disease_name": disease_name}, include=[])["ids"]
+        stale_ids.extend(chunk for chunk in stored if chunk not in new_ids)
+    return stale_ids
 
-# Check the length of documents
-print(f"Length of documents: {len(documents)}")
+def orphaned_chunk_ids(collection, disease_names):
+    """Ids of stored chunks whose disease is not in `disease_names` (diseases removed from the dataset)."""
+    stored = collection.get(include=["metadatas"])
+    return [
+        chunk for chunk, metadata in zip(stored["ids"], stored["metadatas"])
+        if metadata and metadata.get("disease_name") is not None and metadata["disease_name"] not in disease_names
+    ]
 
-# Check the metadata of the first document (for example)
-if documents:
-    print(f"Metadata of first document: {documents[0].metadata}")
+def ingest_documents(collection, embedding_function, documents, batch_size=64, workers=4, checkpoint_path=None):
+    """
+    Embeds documents in batches on a worker pool and writes each batch to Chroma
+    in one call. Chunks already stored (by content hash) or recorded in the
+    checkpoint are skipped, so an interrupted run resumes where it stopped.
 
-# print(documents)
+    Stored chunks of the ingested diseases that are not in `documents` are deleted
+    first. This migrates collections written before chunk ids were content hashes
+    (random uuid4 ids), which would otherwise keep a second copy of every chunk.
+    """
+    new_ids = {doc.metadata["id"] for doc in documents}
+    stale_ids = stale_chunk_ids(collection, sorted({doc.metadata["disease_name"] for doc in documents}), new_ids)
+    if stale_ids:
+        collection.delete(ids=stale_ids)
+        print(f"Removed {len(stale_ids)} stored chunks that are no longer part of the dataset.")
 
-embedding_function = OllamaEmbeddings(
-    model="llama2",
-)
-persistent_client = chromadb.PersistentClient(path="/Plant Disease App/plant_disease_data")
+    completed_ids = load_checkpoint(checkpoint_path)
+    stored_ids = existing_ids(collection, [doc.metadata["id"] for doc in documents])
+    pending = [doc for doc in documents if doc.metadata["id"] not in stored_ids | completed_ids]
+    print(f"{len(documents)} chunks, {len(documents) - len(pending)} already stored, {len(pending)} to ingest.")
+    if not pending:
+        return 0
 
-# Initialize the collection
-vector_store = Chroma(
-    client=persistent_client,
-    collection_name="plant_disease_documents",
-    embedding_function=embedding_function
-)
+    batches = [pending[start:start + batch_size] for start in range(0, len(pending), batch_size)]
 
-# Inserting documents into ChromaDB one at a time
-for idx, doc in enumerate(documents):
-    print(f"Inserting document {idx+1}/{len(documents)}...")
-    vector_store.add_documents([doc])  # Insert one document at a time
-    print(f"Document {idx+1} inserted.")
+    def embed_batch(batch):
+        return batch, embedding_function.embed_documents([doc.page_content for doc in batch])
 
-print("Documents inserted into ChromaDB successfully!")
+    inserted = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(embed_batch, batch) for batch in batches]
+        for done, future in enumerate(as_completed(futures), start=1):
+            batch, embeddings = future.result()
+            # Chroma writes stay on this thread; only embedding runs in parallel
+            collection.upsert(
+                ids=[doc.metadata["id"] for doc in batch],
+                embeddings=embeddings,
+                documents=[doc.page_content for doc in batch],
+                metadatas=[doc.metadata for doc in batch]
+            )
+            completed_ids.update(doc.metadata["id"] for doc in batch)
+            save_checkpoint(checkpoint_path, completed_ids)
+            inserted += len(batch)
+            print(f"Batch {done}/{len(batches)} inserted ({inserted}/{len(pending)} chunks).")
 
+    # The run finished, so the next one should start from the collection itself
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return inserted
 
+def disease_hashes(json_data):
+    """Content hash per disease, used to detect which diseases changed between runs."""
+    return {
+        disease_name: hashlib.sha256(json.dumps(disease_data, sort_keys=True).encode("utf-8")).hexdigest()
+        for disease_name, disease_data in json_data.items()
+    }
 
+def load_manifest(manifest_path):
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r") as f:
+            return json.load(f).get("diseases", {})
+    return {}
+
+def save_manifest(manifest_path, hashes):
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"diseases": hashes}, f, indent=4, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+def diff_against_manifest(json_data, manifest):
+    """Splits diseases into added / changed / removed / unchanged relative to the stored manifest."""
+    hashes = disease_hashes(json_data)
+    return {
+        "added": sorted(name for name in hashes if name not in manifest),
+        "changed": sorted(name for name in hashes if name in manifest and manifest[name] != hashes[name]),
+        "removed": sorted(name for name in manifest if name not in hashes),
+        "unchanged": sorted(name for name in hashes if manifest.get(name) == hashes[name]),
+    }
+
+def ingest_delta(collection, embedding_function, json_data, manifest_path, dry_run=False, **ingest_options):
+    """
+    Re-ingests only the diseases whose content changed since the last run.
+
+    Added and changed diseases are re-chunked and embedded, chunks of removed
+    diseases (and chunks a changed disease no longer has) are deleted, and the
+    rest of the collection is left alone. With dry_run, only the report is returned.
+    """
+    report = diff_against_manifest(json_data, load_manifest(manifest_path))
+    to_ingest = report["added"] + report["changed"]
+    documents = split_into_documents({name: json_data[name] for name in to_ingest})
+    report["chunks_to_embed"] = len(documents)
+
+    new_ids = {doc.metadata["id"] for doc in documents}
+    stale_ids = stale_chunk_ids(collection, report["changed"] + report["removed"], new_ids)
+    report["chunks_to_delete"] = len(stale_ids)
+
+    if dry_run:
+        return report
+
+    if stale_ids:
+        collection.delete(ids=stale_ids)
+    if documents:
+        ingest_documents(collection, embedding_function, documents, **ingest_options)
+    save_manifest(manifest_path, disease_hashes(json_data))
+    return report
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Ingest the plant disease dataset into ChromaDB.")
+    parser.add_argument("--data-file", default=DATA_FILE)
+    parser.add_argument("--chroma-path", default=CHROMA_PATH)
+    parser.add_argument("--collection", default=COLLECTION_NAME)
+    parser.add_argument("--batch-size", type=int, default=64, help="Chunks per embedding call and Chroma write")
+    parser.add_argument("--workers", type=int, default=4, help="Parallel embedding requests")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE, help="Progress file used to resume an interrupted run")
+    parser.add_argument("--manifest", default=MANIFEST_FILE, help="Per-disease content hashes from the last run")
+    parser.add_argument("--delta", action="store_true", help="Only re-ingest diseases that changed since the last run")
+    parser.add_argument("--dry-run", action="store_true", help="With --delta, report what would change without writing")
+    parser.add_argument("--embeddings", choices=["ollama", "fake"], default="ollama",
+                        help="Embedding provider; 'fake' embeds offline with deterministic vectors and needs its "
+                             "own --chroma-path or --collection, --manifest and --checkpoint")
+    parser.add_argument("--embedding-cache", default=EMBEDDING_CACHE_DB, help="Embedding cache, keyed per embedding model")
+    args = parser.parse_args()
+
+    # Chunk ids are content hashes and stored ids are skipped, so fake vectors written to the
+    # real collection (or recorded in its manifest / checkpoint) would never be replaced by Ollama's
+    if args.embeddings == "fake":
+        if args.chroma_path == CHROMA_PATH and args.collection == COLLECTION_NAME:
+            parser.error("--embeddings fake needs its own --chroma-path or --collection")
+        if args.manifest == MANIFEST_FILE or args.checkpoint == CHECKPOINT_FILE:
+            parser.error("--embeddings fake needs its own --manifest and --checkpoint")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    plant_data = read_plant_disease_data(args.data_file)
+    langchain_docs = convert_to_langchain_documents(plant_data)
+    json_data = build_json_data(langchain_docs)
+
+    if args.embeddings == "fake":
+        embedding_function = CachedEmbeddings(FakeEmbeddings(), EmbeddingCache(args.embedding_cache), "fake")
+    else:
+        embedding_function = CachedEmbeddings(
+            OllamaEmbeddings(model="llama2"), EmbeddingCache(args.embedding_cache), "ollama/llama2"
+        )
+    persistent_client = chromadb.PersistentClient(path=args.chroma_path)
+    collection = persistent_client.get_or_create_collection(args.collection, embedding_function=None)
+    ingest_options = {"batch_size": args.batch_size, "workers": args.workers, "checkpoint_path": args.checkpoint}
+
+    if args.delta or args.dry_run:
+        report = ingest_delta(
+            collection, embedding_function, json_data, args.manifest, dry_run=args.dry_run, **ingest_options
+        )
+        print(json.dumps({key: value for key, value in report.items() if key != "unchanged"}, indent=4))
+        print(f"{len(report['unchanged'])} diseases unchanged.")
+        if args.dry_run:
+            print("Dry run: no changes were written.")
+    else:
+        documents = split_into_documents(json_data)
 
+        # Check the length of documents
+        print(f"Length of documents: {len(documents)}")
 
+        # Check the metadata of the first document (for example)
+        if documents:
+            print(f"Metadata of first document: {documents[0].metadata}")
 
+        # The manifest is rewritten below, so a later --delta could no longer see which
+        # diseases were dropped from the dataset: their chunks are removed now
+        orphaned_ids = orphaned_chunk_ids(collection, set(json_data))
+        if orphaned_ids:
+            collection.delete(ids=orphaned_ids)
+            print(f"Removed {len(orphaned_ids)} chunks of diseases that are no longer in the dataset.")
 
+        inserted = ingest_documents(collection, embedding_function, documents, **ingest_options)
+        save_manifest(args.manifest, disease_hashes(json_data))
+        print(f"{inserted} documents inserted into ChromaDB successfully!")
@@ -0,0 +1,167 @@
+import asyncio
+import hashlib
+import random
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+
+
+def embedding_key(model_name: str, text: str) -> str:
+    """Content address of an embedding: the same model and text always map to the same key."""
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+
+def retry_with_backoff(call: Callable, is_rate_limited: Callable[[Exception], bool],
+                       max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 30.0):
+    """
+    Runs `call()`, retrying with exponential backoff and jitter while the provider rate-limits us.
+    Any other error is raised immediately.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return call()
+        except Exception as e:
+            if attempt == max_retries or not is_rate_limited(e):
+                raise
+            time.sleep(min(max_delay, base_delay * 2 ** attempt) * random.uniform(0.5, 1.0))
+
+
+async def aretry_with_backoff(call: Callable, is_rate_limited: Callable[[Exception], bool],
+                              max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 30.0):
+    """Async variant of `retry_with_backoff`; `call()` must return an awaitable."""
+    for attempt in range(max_retries + 1):
+        try:
+            return await call()
+        except Exception as e:
+            if attempt == max_retries or not is_rate_limited(e):
+                raise
+            await asyncio.sleep(min(max_delay, base_delay * 2 ** attempt) * random.uniform(0.5, 1.0))
+
+
+class EmbeddingCache:
+    """
+    Persistent embedding store keyed by hash(model + text).
+
+    Vectors are stored as float32 blobs in a single SQLite table, so a text is never
+    embedded twice by the same model. Keys include the model name, so vectors from
+    different models (or the offline fakes) never collide.
+    """
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+        self.db.commit()
+        self.lock = threading.Lock()
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self.lock:
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                page = keys[start:start + 500]
+                rows = self.db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(page))})", page
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]):
+        with self.lock:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items.items()]
+            )
+            self.db.commit()
+
+
+class CachedEmbeddings:
+    """
+    Wraps an embedding provider (anything with embed_documents / embed_query) with an EmbeddingCache.
+    Only texts missing from the cache are sent to the provider, each at most once per call.
+    """
+    def __init__(self, embeddings, cache: EmbeddingCache, model_name: str):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model_name = model_name
+        self.hits = 0
+        self.misses = 0
+
+    def _split(self, texts: List[str]):
+        keys = [embedding_key(self.model_name, text) for text in texts]
+        cached = self.cache.get_many(list(set(keys)))
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing.setdefault(key, text)
+        self.hits += len(texts) - sum(1 for key in keys if key not in cached)
+        self.misses += len(missing)
+        return keys, cached, missing
+
+    def _store(self, cached, missing, vectors):
+        computed = dict(zip(missing, vectors))
+        if computed:
+            self.cache.put_many(computed)
+        cached.update(computed)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, cached, missing = self._split(texts)
+        if missing:
+            self._store(cached, missing, self.embeddings.embed_documents(list(missing.values())))
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        keys, cached, missing = self._split([text])
+        if missing:
+            self._store(cached, missing, [self.embeddings.embed_query(text)])
+        return cached[keys[0]]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, cached, missing = self._split(texts)
+        if missing:
+            self._store(cached, missing, await self.embeddings.aembed_documents(list(missing.values())))
+        return [cached[key] for key in keys]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        keys, cached, missing = self._split([text])
+        if missing:
+            self._store(cached, missing, [await self.embeddings.aembed_query(text)])
+        return cached[keys[0]]
+
+
+class FakeEmbeddings:
+    """
+    Offline stand-in for an embedding provider.
+
+    Returns deterministic unit vectors derived from the text hash, after an
+    optional per-call latency, so ingestion and caching can be exercised
+    without network access or API keys.
+    """
+    def __init__(self, dimensions: int = 64, latency_seconds: float = 0.0):
+        self.dimensions = dimensions
+        self.latency_seconds = latency_seconds
+        self.calls = 0
+
+    def _vector(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dimensions).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        time.sleep(self.latency_seconds)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        await asyncio.sleep(self.latency_seconds)
+        return [self._vector(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
@@ -0,0 +1,241 @@
+import time
+import random
+import asyncio
+from typing import List
+
+import openai
+
+from embedding_cache import FakeEmbeddings
+
+# Offline stand-ins for the hosted providers, used by benchmark.py so Backend.py can be
+# load-tested without API keys, network access or per-call cost. Each fake mimics the
+# client API the backend actually calls (replicate.Client, openai.ChatCompletion /
+# openai.Embedding, langchain's OllamaEmbeddings) and sleeps according to a latency
+# profile, so the event loop sees the same waits a real provider would cause.
+
+
+class LatencyProfile:
+    """
+    How a fake provider behaves: time to the first token, token rate while streaming,
+    response length in tokens, +/- jitter applied to every delay, and the fraction of
+    calls that fail.
+    """
+    def __init__(self, first_token_seconds: float, tokens_per_second: float, completion_tokens: int = 300,
+                 jitter: float = 0.2, error_rate: float = 0.0, embedding_seconds_per_text: float = 0.0):
+        self.first_token_seconds = first_token_seconds
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.embedding_seconds_per_text = embedding_seconds_per_text
+
+    def _jittered(self, seconds: float) -> float:
+        return max(0.0, seconds * random.uniform(1.0 - self.jitter, 1.0 + self.jitter))
+
+    def first_token_delay(self) -> float:
+        return self._jittered(self.first_token_seconds)
+
+    def token_delay(self) -> float:
+        if not self.tokens_per_second:
+            return 0.0
+        return self._jittered(1.0 / self.tokens_per_second)
+
+    def completion_delay(self) -> float:
+        """Total time of a non-streamed completion: first token plus the rest at the token rate."""
+        per_token = 1.0 / self.tokens_per_second if self.tokens_per_second else 0.0
+        return self._jittered(self.first_token_seconds + per_token * (self.completion_tokens - 1))
+
+    def embedding_delay(self, texts: int) -> float:
+        return self._jittered(self.first_token_seconds + self.embedding_seconds_per_text * texts)
+
+    def maybe_fail(self, provider: str):
+        if self.error_rate and random.random() < self.error_rate:
+            raise FakeProviderError(f"{provider}: simulated provider failure")
+
+    def describe(self) -> dict:
+        return dict(vars(self))
+
+
+# Rough shapes of each provider, for comparing like with like across runs
+PROFILES = {
+    "instant": LatencyProfile(0.0, 0.0, jitter=0.0),
+    "replicate-llama2-70b": LatencyProfile(1.2, 35.0, embedding_seconds_per_text=0.05),
+    "openai-gpt-3.5-turbo": LatencyProfile(0.4, 80.0, embedding_seconds_per_text=0.002),
+    "ollama-local": LatencyProfile(0.15, 20.0, embedding_seconds_per_text=0.02),
+}
+
+
+class FakeProviderError(RuntimeError):
+    """Raised by a fake provider for the fraction of calls given by `LatencyProfile.error_rate`."""
+
+
+ADVISORY_SECTIONS = ("Symptoms", "Causes", "Recommended Solutions", "Pesticide Recommendations")
+
+
+def fake_completion_tokens(prompt: str, count: int) -> List[str]:
+    """
+    `count` word tokens laid out like a real advisory (all four section headers), so the
+    backend's section parsing does its normal amount of work. Deterministic per prompt.
+    """
+    rng = random.Random(prompt)
+    words = ("leaves", "spots", "fungal", "spray", "humidity", "remove", "infected", "apply", "weekly",
+             "copper", "yellowing", "lesions", "drainage", "rotate", "crops", "dose", "water", "early")
+    per_section = max(1, count // len(ADVISORY_SECTIONS) - 2)
+    tokens = []
+    for section in ADVISORY_SECTIONS:
+        tokens += [f"{section}: "] + [rng.choice(words) + " " for _ in range(per_section)] + [". "]
+    return tokens
+
+
+class FakeReplicateClient:
+    """
+    Stand-in for `replicate.Client`: `run`, `async_run` and `async_stream`.
+    Model versions containing 'embeddings' return a deterministic vector, anything else
+    a chat completion.
+    """
+    def __init__(self, profile: LatencyProfile, embedding_dimensions: int = 4096):
+        self.profile = profile
+        self.vectors = FakeEmbeddings(dimensions=embedding_dimensions)
+        self.calls = 0
+
+    def _output(self, model_version: str, input: dict):
+        self.calls += 1
+        self.profile.maybe_fail("replicate")
+        if "embeddings" in model_version:
+            return self.profile.embedding_delay(1), self.vectors.embed_query(input["text"])
+        return self.profile.completion_delay(), fake_completion_tokens(input["prompt"], self.profile.completion_tokens)
+
+    def run(self, model_version: str, input: dict):
+        delay, output = self._output(model_version, input)
+        time.sleep(delay)
+        return output
+
+    async def async_run(self, model_version: str, input: dict):
+        delay, output = self._output(model_version, input)
+        await asyncio.sleep(delay)
+        return output
+
+    async def async_stream(self, model_version: str, input: dict):
+        self.calls += 1
+        self.profile.maybe_fail("replicate")
+        return self._stream(fake_completion_tokens(input["prompt"], self.profile.completion_tokens))
+
+    async def _stream(self, tokens: List[str]):
+        await asyncio.sleep(self.profile.first_token_delay())
+        for i, token in enumerate(tokens):
+            if i:
+                await asyncio.sleep(self.profile.token_delay())
+            yield token
+
+
+class FakeChatCompletion:
+    """Stand-in for `openai.ChatCompletion` (openai 0.28): `create` and `acreate`, with or without `stream`."""
+    def __init__(self, profile: LatencyProfile):
+        self.profile = profile
+        self.calls = 0
+
+    def _tokens(self, messages: List[dict], max_tokens: int) -> List[str]:
+        self.calls += 1
+        self.profile.maybe_fail("openai")
+        return fake_completion_tokens(messages[-1]["content"], min(max_tokens, self.profile.completion_tokens))
+
+    @staticmethod
+    def _response(tokens: List[str], messages: List[dict]) -> dict:
+        prompt_tokens = sum(len(message["content"].split()) for message in messages)
+        return {
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                      "total_tokens": prompt_tokens + len(tokens)},
+        }
+
+    def create(self, model: str, messages: List[dict], max_tokens: int = 1000, stream: bool = False, **kwargs):
+        tokens = self._tokens(messages, max_tokens)
+        if stream:
+            return self._sync_stream(tokens)
+        time.sleep(self.profile.completion_delay())
+        return self._response(tokens, messages)
+
+    async def acreate(self, model: str, messages: List[dict], max_tokens: int = 1000, stream: bool = False, **kwargs):
+        tokens = self._tokens(messages, max_tokens)
+        if stream:
+            return self._stream(tokens)
+        await asyncio.sleep(self.profile.completion_delay())
+        return self._response(tokens, messages)
+
+    async def _stream(self, tokens: List[str]):
+        await asyncio.sleep(self.profile.first_token_delay())
+        for i, token in enumerate(tokens):
+            if i:
+                await asyncio.sleep(self.profile.token_delay())
+            yield {"choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+
+    def _sync_stream(self, tokens: List[str]):
+        time.sleep(self.profile.first_token_delay())
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(self.profile.token_delay())
+            yield {"choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+
+
+class FakeOpenAIEmbedding:
+    """Stand-in for `openai.Embedding` (openai 0.28): `create` and `acreate`."""
+    def __init__(self, profile: LatencyProfile, embedding_dimensions: int = 1536):
+        self.profile = profile
+        self.vectors = FakeEmbeddings(dimensions=embedding_dimensions)
+        self.calls = 0
+
+    def _response(self, input: List[str]) -> dict:
+        self.calls += 1
+        self.profile.maybe_fail("openai")
+        return {"data": [{"index": i, "embedding": vector} for i, vector in enumerate(self.vectors.embed_documents(input))]}
+
+    def create(self, model: str, input: List[str], **kwargs):
+        response = self._response(input)
+        time.sleep(self.profile.embedding_delay(len(input)))
+        return response
+
+    async def acreate(self, model: str, input: List[str], **kwargs):
+        response = self._response(input)
+        await asyncio.sleep(self.profile.embedding_delay(len(input)))
+        return response
+
+
+class FakeOllamaEmbeddings(FakeEmbeddings):
+    """
+    Stand-in for langchain_ollama's `OllamaEmbeddings` used by the ingestion script: same
+    deterministic vectors as `FakeEmbeddings`, with latency taken from a profile per batch.
+    """
+    def __init__(self, profile: LatencyProfile, dimensions: int = 4096):
+        super().__init__(dimensions=dimensions)
+        self.profile = profile
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        self.profile.maybe_fail("ollama")
+        time.sleep(self.profile.embedding_delay(len(texts)))
+        return [self._vector(text) for text in texts]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        self.profile.maybe_fail("ollama")
+        await asyncio.sleep(self.profile.embedding_delay(len(texts)))
+        return [self._vector(text) for text in texts]
+
+def install_fake_providers(backend, replicate_profile: LatencyProfile, openai_profile: LatencyProfile) -> dict:
+    """
+    Points an imported Backend module at the fakes: the Replicate clients of the Llama2 LLM
+    and embeddings (building them through the provider registry), and the module-level
+    OpenAI endpoints the OpenAI classes call. Returns the fakes, so callers can read their
+    call counts.
+    """
+    fakes = {
+        "replicate_llm": FakeReplicateClient(replicate_profile),
+        "replicate_embeddings": FakeReplicateClient(replicate_profile),
+        "openai_chat": FakeChatCompletion(openai_profile),
+        "openai_embeddings": FakeOpenAIEmbedding(openai_profile),
+    }
+    backend.providers.get("llama2_llm").client = fakes["replicate_llm"]
+    backend.providers.get("llama2_embeddings").client = fakes["replicate_embeddings"]
+    openai.ChatCompletion = fakes["openai_chat"]
+    openai.Embedding = fakes["openai_embeddings"]
+    return fakes
@@ -0,0 +1,99 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import openai
+
+from embedding_cache import aretry_with_backoff, retry_with_backoff
+
+# GPT chat and embeddings via the OpenAI API. Imported by Backend.py's provider registry
+# only when the gpt-3.5-turbo model is enabled or first requested.
+
+
+class OpenAIEmbeddings:
+    """
+    A simple embedding class for OpenAI embeddings (e.g. text-embedding-ada-002).
+    Texts are sent in batches of `batch_size` per request, concurrently, with backoff on rate limits.
+    """
+    def __init__(self, openai_api_key: str, model: str = "text-embedding-ada-002",
+                 batch_size: int = 256, max_concurrency: int = 4):
+        # Set your OpenAI key
+        openai.api_key = openai_api_key
+        self.model = model
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+
+    @staticmethod
+    def _is_rate_limited(error: Exception) -> bool:
+        return isinstance(error, openai.error.RateLimitError)
+
+    def _batches(self, texts: List[str]) -> List[List[str]]:
+        return [texts[start:start + self.batch_size] for start in range(0, len(texts), self.batch_size)]
+
+    def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+        response = retry_with_backoff(
+            lambda: openai.Embedding.create(model=self.model, input=batch),
+            self._is_rate_limited
+        )
+        return [d["embedding"] for d in response["data"]]
+
+    async def _aembed_batch(self, batch: List[str], semaphore: asyncio.Semaphore) -> List[List[float]]:
+        async with semaphore:
+            response = await aretry_with_backoff(
+                lambda: openai.Embedding.acreate(model=self.model, input=batch),
+                self._is_rate_limited
+            )
+        return [d["embedding"] for d in response["data"]]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        batches = self._batches(texts)
+        if len(batches) <= 1:
+            return [embedding for batch in batches for embedding in self._embed_batch(batch)]
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as executor:
+            return [embedding for result in executor.map(self._embed_batch, batches) for embedding in result]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed_batch([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        results = await asyncio.gather(*(self._aembed_batch(batch, semaphore) for batch in self._batches(texts)))
+        return [embedding for result in results for embedding in result]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self._aembed_batch([text], asyncio.Semaphore(1)))[0]
+
+
+class OpenAILLM:
+    """
+    A simple LLM class that uses OpenAI GPT for generating text (GPT-3.5-turbo by default).
+    """
+    def __init__(self, openai_api_key: str, model_name: str = "gpt-3.5-turbo", max_tokens: int = 1000):
+        openai.api_key = openai_api_key
+        self.model_name = model_name
+        self.max_tokens = max_tokens
+
+    def invoke(self, prompt: str) -> str:
+        response = openai.ChatCompletion.create(**self._request(prompt))
+        return response["choices"][0]["message"]["content"]
+
+    async def ainvoke(self, prompt: str) -> str:
+        response = await openai.ChatCompletion.acreate(**self._request(prompt))
+        return response["choices"][0]["message"]["content"]
+
+    async def astream(self, prompt: str):
+        async for chunk in await openai.ChatCompletion.acreate(**self._request(prompt), stream=True):
+            text = chunk["choices"][0]["delta"].get("content")
+            if text:
+                yield text
+
+    def _request(self, prompt: str) -> dict:
+        return dict(
+            model=self.model_name,
+            messages=[
+                {"role": "system", "content": "You are an expert plant disease management assistant."},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=self.max_tokens,
+            temperature=0.7
+        )
@@ -0,0 +1,131 @@
+import os
+import time
+import cProfile
+import contextlib
+import threading
+import contextvars
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+
+# Prometheus metrics for the /classify pipeline. Each request carries its model and
+# language labels in a context variable (set once by the HTTP middleware), so the
+# stage timers deeper in the call stack don't need them passed around.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+TOKEN_BUCKETS = (64, 128, 256, 512, 768, 1024, 1536, 2048, 3072, 4096, 8192)
+
+# Only known values become label values, so arbitrary query strings can't blow up cardinality
+KNOWN_MODELS = {"llama2", "gpt-3.5-turbo"}
+KNOWN_LANGUAGES = {"english", "urdu"}
+
+REQUEST_SECONDS = Histogram(
+    "plant_disease_request_seconds", "End-to-end request latency.",
+    ["endpoint", "model", "language"], buckets=LATENCY_BUCKETS
+)
+REQUESTS = Counter(
+    "plant_disease_requests_total", "Requests by endpoint and HTTP status.",
+    ["endpoint", "model", "language", "status"]
+)
+STAGE_SECONDS = Histogram(
+    "plant_disease_stage_seconds", "Latency of one pipeline stage (decode, classify, retrieve, llm, parse).",
+    ["stage", "model", "language"], buckets=LATENCY_BUCKETS
+)
+STAGE_ERRORS = Counter(
+    "plant_disease_stage_errors_total", "Exceptions raised inside a pipeline stage.",
+    ["stage", "model", "language", "error"]
+)
+LLM_TOKENS = Histogram(
+    "plant_disease_llm_tokens", "Tokens per LLM call (retrieved context, whole prompt, completion), counted locally.",
+    ["model", "kind"], buckets=TOKEN_BUCKETS
+)
+
+request_labels = contextvars.ContextVar("request_labels", default=("none", "none"))
+
+# Callbacks called with (stage, seconds) for every timed stage, e.g. by benchmark.py,
+# which needs exact percentiles rather than histogram buckets
+stage_observers = []
+
+
+def label_values(model_name, language):
+    model = (model_name or "none").lower()
+    language = (language or "english").lower()
+    return (
+        model if model in KNOWN_MODELS else "other",
+        language if language in KNOWN_LANGUAGES else "other",
+    )
+
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Times the enclosed block into the stage histogram (wall time, including awaits)
+    and counts any exception raised in it before re-raising.
+    """
+    model, language = request_labels.get()
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        STAGE_ERRORS.labels(name, model, language, type(e).__name__).inc()
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        STAGE_SECONDS.labels(name, model, language).observe(seconds)
+        for observer in stage_observers:
+            observer(name, seconds)
+
+
+def render_metrics():
+    """(body, content type) of every metric in the Prometheus text format."""
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+class RequestProfiler:
+    """
+    Profiles one request with `torch.profiler` (operator-level, incl. inference threads)
+    or `cProfile` (Python functions on the event loop thread) and writes the result to
+    `output_dir`. Work from concurrent requests that overlaps this one is included too.
+    Only one request is profiled at a time: both profilers allow one active instance
+    per thread, and every request runs on the event loop thread.
+    """
+    modes = ("torch", "cprofile")
+    _active = threading.Lock()
+
+    def __init__(self, mode, output_dir, name):
+        self.mode = mode
+        self.path = os.path.join(output_dir, f"{name}.{'json' if mode == 'torch' else 'prof'}")
+        os.makedirs(output_dir, exist_ok=True)
+        self.profiler = None
+
+    def start(self) -> bool:
+        """Starts profiling; False (and nothing started) while another request is being profiled."""
+        if not RequestProfiler._active.acquire(blocking=False):
+            return False
+        try:
+            if self.mode == "torch":
+                import torch.profiler
+
+                self.profiler = torch.profiler.profile(
+                    activities=[torch.profiler.ProfilerActivity.CPU], record_shapes=True
+                )
+                self.profiler.__enter__()
+            else:
+                self.profiler = cProfile.Profile()
+                self.profiler.enable()
+        except BaseException:
+            RequestProfiler._active.release()
+            raise
+        return True
+
+    def stop(self):
+        try:
+            if self.mode == "torch":
+                self.profiler.__exit__(None, None, None)
+                self.profiler.export_chrome_trace(self.path)
+                with open(self.path[:-len(".json")] + ".txt", "w") as f:
+                    f.write(self.profiler.key_averages().table(sort_by="self_cpu_time_total", row_limit=50))
+            else:
+                self.profiler.disable()
+                self.profiler.dump_stats(self.path)
+        finally:
+            RequestProfiler._active.release()
+        return self.path
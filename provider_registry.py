@@ -0,0 +1,65 @@
+import time
+import importlib
+import threading
+
+# Backend.py's heavyweight components (the classifier, the Chroma client and vector stores,
+# the LLM and embedding clients) are registered here with a factory and the modules that
+# factory needs, and are only imported and built when first asked for. Providers of a model
+# that is never enabled or requested are never imported, which keeps them off the startup path.
+
+
+class ProviderRegistry:
+    """
+    Named components built once, on the first `get`. A component's `requires` are built
+    first, then its `modules` are imported and passed to its factory. The import and
+    construction time of each component are recorded separately (see `report`).
+    """
+    def __init__(self):
+        self.specs = {}
+        self.instances = {}
+        self.timings = {}
+        self._lock = threading.RLock()
+
+    def register(self, name: str, factory, modules=(), requires=()):
+        self.specs[name] = (factory, tuple(modules), tuple(requires))
+
+    def get(self, name: str):
+        if name in self.instances:
+            return self.instances[name]
+        if name not in self.specs:
+            raise ValueError(f"Unknown component '{name}'. Registered: {', '.join(self.specs)}")
+
+        # One build at a time, so concurrent first requests share a single construction
+        with self._lock:
+            if name in self.instances:
+                return self.instances[name]
+            factory, modules, requires = self.specs[name]
+            for dependency in requires:
+                self.get(dependency)
+
+            timing = {"import_seconds": 0.0, "init_seconds": 0.0, "modules": {}}
+            self.timings[name] = timing
+            imported = []
+            for module in modules:
+                started = time.perf_counter()
+                imported.append(importlib.import_module(module))
+                timing["modules"][module] = time.perf_counter() - started
+                timing["import_seconds"] += timing["modules"][module]
+
+            started = time.perf_counter()
+            try:
+                instance = factory(*imported)
+            except Exception as e:
+                timing["error"] = f"{type(e).__name__}: {e}"
+                raise
+            finally:
+                timing["init_seconds"] = time.perf_counter() - started
+            self.instances[name] = instance
+            return instance
+
+    def is_built(self, name: str) -> bool:
+        return name in self.instances
+
+    def report(self) -> dict:
+        """Per component: whether it is built, and its import / init seconds once it was."""
+        return {name: {"built": name in self.instances, **self.timings.get(name, {})} for name in self.specs}
@@ -0,0 +1,104 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import replicate
+
+from embedding_cache import aretry_with_backoff, retry_with_backoff
+
+# Llama2 chat and embeddings via Replicate. Imported by Backend.py's provider registry
+# only when the llama2 model is enabled or first requested.
+
+
+class ReplicateLlama2Embeddings:
+    """
+    A simple embedding class for Llama2 embeddings via Replicate.
+
+    model_version: The specific model version on replicate, e.g.
+       "andreasjansson/llama-2-7b-embeddings:xxxx..."
+    max_concurrency: How many texts are embedded in parallel; the model takes one
+       text per prediction, so batches are fanned out and retried on rate limits.
+    """
+    def __init__(self, replicate_api_token: str, 
+                 model_version: str = "andreasjansson/llama-2-7b-embeddings:65c48f4d3e526a873d03ab973ca05989bbcdbdf9aca65fdee7ad2a9757e5b8fa",
+                 max_concurrency: int = 8):
+        self.client = replicate.Client(api_token=replicate_api_token)
+        self.model_version = model_version
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+
+    @staticmethod
+    def _is_rate_limited(error: Exception) -> bool:
+        return getattr(error, "status", None) == 429
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if len(texts) <= 1:
+            return [self.embed_query(text) for text in texts]
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(texts))) as executor:
+            return list(executor.map(self.embed_query, texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return retry_with_backoff(
+            lambda: self.client.run(self.model_version, input={"text": text}),
+            self._is_rate_limited
+        )
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return list(await asyncio.gather(*(self.aembed_query(text) for text in texts)))
+
+    async def aembed_query(self, text: str) -> List[float]:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            return await aretry_with_backoff(
+                lambda: self.client.async_run(self.model_version, input={"text": text}),
+                self._is_rate_limited
+            )
+
+
+class ReplicateLlama2LLM:
+    """
+    A simple LLM class that wraps Llama2 (Chat) via Replicate.
+
+    model_version: The specific model version on replicate, e.g.
+       "meta/llama-2-7b-chat:xxxx..."
+    """
+    def __init__(self, replicate_api_token: str,
+                 model_version: str = "meta/llama-2-70b-chat", max_new_tokens: int = 512):
+        self.client = replicate.Client(api_token=replicate_api_token)
+        self.model_version = model_version
+        self.max_new_tokens = max_new_tokens
+
+    def invoke(self, prompt: str) -> str:
+        output = self.client.run(
+            self.model_version,
+            input={"prompt": prompt, "max_new_tokens": self.max_new_tokens}
+        )
+        return self._join_output(output)
+
+    async def ainvoke(self, prompt: str) -> str:
+        output = await self.client.async_run(
+            self.model_version,
+            input={"prompt": prompt, "max_new_tokens": self.max_new_tokens}
+        )
+        if hasattr(output, "__aiter__"):
+            return "".join([str(chunk) async for chunk in output])
+        return self._join_output(output)
+
+    async def astream(self, prompt: str):
+        async for event in await self.client.async_stream(
+            self.model_version,
+            input={"prompt": prompt, "max_new_tokens": self.max_new_tokens}
+        ):
+            text = str(event)
+            if text:
+                yield text
+
+    @staticmethod
+    def _join_output(output) -> str:
+        if isinstance(output, str):
+            return output
+        elif isinstance(output, list):
+            return "".join(output)
+        else:
+            return str(output)
@@ -0,0 +1,180 @@
+import os
+import gc
+import sys
+import json
+import time
+import signal
+import socket
+import argparse
+import threading
+import multiprocessing
+
+import psutil
+import torch
+
+from Classification_Model.inference_backends import CLASSIFIER_BACKENDS, preload_predictor
+
+# Production serving: Backend.app behind several worker processes that share one listening
+# socket. The classifier weights are loaded once and shared between the workers instead of
+# being copied into each of them:
+#   fork - the parent loads the checkpoint, then forks the workers, which inherit the
+#          weights copy-on-write (inference never writes to them, so the pages stay shared)
+#   mmap - each worker memory-maps the checkpoint file; the OS page cache holds one copy
+#          (the only mode where fork isn't available, e.g. Windows)
+# Every worker gets its own torch thread budget (usable cores / workers by default, so the
+# workers don't oversubscribe the CPU) and can be pinned to its own cores.
+#
+# Workers are independent processes: /admin/* endpoints and /metrics only reach the worker
+# that handles the request, so reload a model by restarting the server.
+#
+#   python serve.py --workers 4
+#   python serve.py --workers 4 --cpu-affinity compact
+#   python serve.py --workers 2 --threads-per-worker 4 --preload mmap
+
+saved_models_dir = "L:/Plant Disease App/Classification_Model/saved_models"
+vit_config_path = "L:/Plant Disease App/Classification_Model/saved_models/vit_config.json"
+
+# A worker that dies sooner than this after starting is treated as a startup failure
+# (bad checkpoint, port, import error) and stops the server instead of being restarted
+MIN_WORKER_UPTIME_SECONDS = 10.0
+
+
+def usable_cores():
+    """CPU ids this process may run on (its affinity mask where the OS exposes one)."""
+    if hasattr(psutil.Process, "cpu_affinity"):
+        return sorted(psutil.Process().cpu_affinity())
+    return list(range(os.cpu_count() or 1))
+
+
+def plan_workers(workers, threads_per_worker=None, cpu_affinity="none"):
+    """
+    (torch threads, pinned cores or None) per worker. By default the usable physical
+    cores are split evenly between the workers; with 'compact' affinity worker i gets
+    the i-th consecutive slice of the usable cores.
+    """
+    cores = usable_cores()
+    physical = min(psutil.cpu_count(logical=False) or len(cores), len(cores))
+    threads = threads_per_worker or max(1, physical // workers)
+    plans = []
+    for index in range(workers):
+        pinned = None
+        if cpu_affinity == "compact":
+            start = (index * threads) % len(cores)
+            pinned = [cores[(start + i) % len(cores)] for i in range(min(threads, len(cores)))]
+        plans.append((threads, pinned))
+    return plans
+
+
+def bind_socket(host, port):
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(sock, threads, pinned, mmap, log_level):
+    """Worker process: set the thread budget and affinity, then import and serve Backend.app."""
+    if pinned:
+        psutil.Process().cpu_affinity(pinned)
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # fixed once parallel work has run in this process
+    if mmap:
+        os.environ["MODEL_MMAP"] = "1"
+
+    import uvicorn
+    import Backend
+
+    server = uvicorn.Server(uvicorn.Config(Backend.app, log_level=log_level))
+    server.run(sockets=[sock])
+
+
+def preload(backend):
+    """Loads the classifier in the parent, before the workers are forked."""
+    with open(os.path.join(saved_models_dir, "label_mapping.json"), "r") as f:
+        num_labels = len(json.load(f))
+    checkpoint_path = os.path.join(saved_models_dir, CLASSIFIER_BACKENDS[backend][1])
+    started = time.perf_counter()
+    preload_predictor(backend, checkpoint_path, vit_config_path, num_labels)
+    print(f"Preloaded {backend} classifier from {checkpoint_path} in {time.perf_counter() - started:.1f}s")
+    # Objects that exist now are never collected, so the collector doesn't touch (and
+    # un-share) their pages in the workers
+    gc.collect()
+    gc.freeze()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve Backend.py from several worker processes sharing one copy of the model.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=max(1, (psutil.cpu_count(logical=False) or 1) // 2))
+    parser.add_argument("--threads-per-worker", type=int, default=None,
+                        help="torch intra-op threads per worker (default: physical cores / workers)")
+    parser.add_argument("--cpu-affinity", choices=["none", "compact"], default="none",
+                        help="'compact' pins each worker to its own consecutive cores (Linux/Windows)")
+    parser.add_argument("--preload", choices=["fork", "mmap"], default="fork" if hasattr(os, "fork") else "mmap",
+                        help="Share the weights by forking a preloaded parent, or by memory-mapping the checkpoint")
+    parser.add_argument("--log-level", default="info")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    backend = os.environ.get("CLASSIFIER_BACKEND", "torch")
+    if args.preload == "fork" and not hasattr(os, "fork"):
+        raise SystemExit("--preload fork needs os.fork; use --preload mmap on this platform.")
+    if args.cpu_affinity != "none" and not hasattr(psutil.Process, "cpu_affinity"):
+        raise SystemExit("--cpu-affinity isn't supported on this platform.")
+
+    plans = plan_workers(args.workers, args.threads_per_worker, args.cpu_affinity)
+    sock = bind_socket(args.host, args.port)
+    if args.preload == "fork":
+        # Backend itself is only imported in the workers: its SQLite and Chroma clients
+        # must not be shared across fork. Loading runs no forward pass, so no OpenMP
+        # pool is started here either.
+        torch.set_num_threads(1)
+        preload(backend)
+    context = multiprocessing.get_context("fork" if args.preload == "fork" else "spawn")
+
+    def start(index):
+        threads, pinned = plans[index]
+        process = context.Process(
+            target=run_worker, args=(sock, threads, pinned, args.preload == "mmap", args.log_level),
+            name=f"worker-{index}", daemon=False
+        )
+        process.start()
+        print(f"Worker {index}: pid {process.pid}, {threads} torch threads, cores {pinned or 'any'}")
+        return process, time.monotonic()
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.set())
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+
+    print(f"Serving on http://{args.host}:{args.port} with {args.workers} workers ({args.preload} preload)")
+    workers = [start(index) for index in range(args.workers)]
+    exit_code = 0
+    while not stopping.wait(0.5):
+        for index, (process, started) in enumerate(workers):
+            if process.is_alive():
+                continue
+            if time.monotonic() - started < MIN_WORKER_UPTIME_SECONDS:
+                print(f"Worker {index} exited with code {process.exitcode} during startup; stopping.")
+                stopping.set()
+                exit_code = 1
+                break
+            print(f"Worker {index} exited with code {process.exitcode}; restarting.")
+            workers[index] = start(index)
+
+    for process, _ in workers:
+        if process.is_alive():
+            process.terminate()  # SIGTERM: uvicorn finishes in-flight requests, then exits
+    for process, _ in workers:
+        process.join(timeout=30)
+        if process.is_alive():
+            process.kill()
+    sock.close()
+    sys.exit(exit_code)